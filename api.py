@@ -0,0 +1,662 @@
+import io
+
+from flask import Blueprint
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import request
+from flask import stream_with_context
+from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import abort
+
+from archive import find_archived, load_archive, restore_cards
+from blog import flow_days, get_post, get_posts, move_posts, next_page, page_size, position_post
+from board import STATUS_LABELS, STATUS_NAMES, TODO, card_json, load_board
+from board import edit_post, insert_posts, remove_posts
+from cache import get_cache
+from db import get_pool, get_pools, write_board
+from events import board_channel, format_event, get_broker, publish
+from flow import load_flow, load_history
+from profiling import get_stats
+from search import search_posts
+from transfer import FORMATS, BoardImportError, export_board, import_board
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+@bp.before_request
+def require_user():
+    """
+    Reject API requests without a logged in user
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    if g.user is None:
+        abort(401)
+
+
+@bp.errorhandler(HTTPException)
+def json_error(e):
+    """
+    Report errors as JSON instead of HTML pages
+
+    Parameters
+    -----------
+    e: raised HTTP exception
+
+    Returns
+    -----------
+    JSON with the error description and the exception's status code
+
+    """
+    return {"error": e.description}, e.code
+
+
+def json_body():
+    """
+    JSON object sent with the request
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Request body as a dictionary
+
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, (dict, list)):
+        abort(400, "Expected a JSON body.")
+
+    return data
+
+
+def parse_status(name):
+    """
+    Convert a status name from a request into its number
+
+    Parameters
+    -----------
+    name: "todo", "doing" or "done"
+
+    Returns
+    -----------
+    Status number
+
+    """
+    if not isinstance(name, str) or name not in STATUS_NAMES:
+        abort(400, f"Unknown status {name!r}.")
+
+    return STATUS_NAMES[name]
+
+
+def parse_text(title, body):
+    """
+    Check the title and body of a card from a request
+
+    Parameters
+    -----------
+    - title: title sent with the request
+    - body: body sent with the request
+
+    Returns
+    -----------
+    None, aborts with 400 for a missing title or text of another type
+
+    """
+    if title is None or title == "":
+        abort(400, "Title is required.")
+    if not isinstance(title, str) or not isinstance(body, str):
+        abort(400, "Title and body must be strings.")
+
+
+def parse_ids(data):
+    """
+    Read a list of card ids from a request body
+
+    Parameters
+    -----------
+    data: request body
+
+    Returns
+    -----------
+    Non-empty list of integer ids
+
+    """
+    ids = data.get("ids") if isinstance(data, dict) else None
+    #JSON true and false are ints to isinstance
+    if not isinstance(ids, list) or not all(type(id) is int for id in ids):
+        abort(400, "Expected a list of integer ids.")
+    if not ids:
+        abort(400, "At least one post id is required.")
+
+    return ids
+
+
+@bp.route("/board")
+def board():
+    """
+    First page of every category of the current user's board
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the cards of each category, most recent first, and the
+    cursors of their next pages
+
+    """
+    pages = load_board(g.user["id"], page_size())
+    data = {
+        STATUS_LABELS[status]: [card_json(post) for post in page.posts]
+        for status, page in pages.items()
+    }
+    data["cursors"] = {STATUS_LABELS[status]: page.cursor for status, page in pages.items()}
+    return data
+
+
+def require_admin():
+    """
+    Reject users not listed in ADMIN_USERNAMES
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    if g.user["username"] not in current_app.config["ADMIN_USERNAMES"]:
+        abort(403)
+
+
+@bp.route("/admin/sql")
+def sql_stats():
+    """
+    SQL statistics of this worker process
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the profiled statements and the pool, shard pool and cache
+    counters
+
+    """
+    require_admin()
+    return {
+        "profiling": current_app.config["SQL_PROFILING"],
+        **get_stats().snapshot(),
+        "pool": get_pool().stats(),
+        "shards": {
+            str(shard): pool.stats() for shard, pool in get_pools().items() if shard is not None
+        },
+        "cache": get_cache().stats(),
+    }
+
+
+@bp.route("/admin/sql/reset", methods=("POST",))
+def reset_sql_stats():
+    require_admin()
+    get_stats().reset()
+    return {"reset": True}
+
+
+def parse_format():
+    """
+    Board file format named by the "format" query argument
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    "csv" or "json"
+
+    """
+    format = request.args.get("format", "csv")
+    if format not in FORMATS:
+        abort(400, f"Unknown format {format!r}.")
+
+    return format
+
+
+@bp.route("/board/import", methods=("POST",))
+def import_cards():
+    """
+    Add the cards of a CSV or JSON Lines request body to the board
+
+    The body is read while the cards are inserted, so uploads of any size
+    use the same memory.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the number of imported cards
+
+    """
+    format = parse_format()
+    #undecodable bytes are reported with their line by transfer.read_cards
+    stream = io.TextIOWrapper(
+        request.stream, encoding="utf8", errors="surrogateescape", newline=""
+    )
+
+    try:
+        count = import_board(g.user["id"], stream, format)
+    except BoardImportError as e:
+        return {"error": str(e), "imported": e.imported}, 400
+
+    return {"imported": count}
+
+
+@bp.route("/board/export")
+def export_cards():
+    """
+    Download every card of the board as CSV or JSON Lines
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Streamed attachment
+
+    """
+    format = parse_format()
+    chunks = export_board(g.user["id"], format)
+    filename = f"board.{'jsonl' if format == 'json' else 'csv'}"
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@bp.route("/board/wait")
+def wait():
+    """
+    Board long-poll, only served by the async server
+
+    Waiting here would hold a worker thread per client, so under WSGI the
+    endpoint refuses and clients fall back to polling /board.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    abort(501, "Long-polling needs the async server, see asgi.py.")
+
+
+@bp.route("/board/events")
+def events():
+    """
+    Stream changes of the current user's board as Server-Sent Events
+
+    Events are "created", "updated", "moved" and "deleted" card deltas. A
+    "resync" event ends the stream when the client fell too far behind and
+    has to load the whole board again.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    text/event-stream response
+
+    """
+    broker = get_broker()
+    subscription = broker.subscribe(board_channel(g.user["id"]))
+    keepalive = current_app.config["EVENTS_KEEPALIVE"]
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+
+            while not subscription.overflowed:
+                event = subscription.get(keepalive)
+                yield ": keepalive\n\n" if event is None else format_event(event)
+
+            yield format_event({"event": "resync"})
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/board/<status>")
+def column(status):
+    """
+    Next page of one category of the current user's board
+
+    Parameters
+    -----------
+    status: "todo", "doing" or "done"
+
+    Returns
+    -----------
+    JSON with the cards after the given cursor and the next cursor
+
+    """
+    page = next_page(parse_status(status))
+    return {"cards": [card_json(post) for post in page.posts], "cursor": page.cursor}
+
+
+@bp.route("/archive")
+def archive():
+    """
+    Page of the current user's archived cards
+
+    Query arguments are an optional "cursor" from the previous page and
+    "limit", capped by BOARD_MAX_PAGE_SIZE.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the cards, most recently created first, and the next cursor
+
+    """
+    try:
+        page = load_archive(g.user["id"], request.args.get("cursor"), page_size())
+    except ValueError:
+        abort(400, "A valid cursor is required.")
+
+    cards = [
+        {**card_json(post), "archived": post["archived"].isoformat()} for post in page.posts
+    ]
+    return {"cards": cards, "cursor": page.cursor}
+
+
+@bp.route("/archive/restore", methods=("POST",))
+def restore():
+    """
+    Move archived cards back to the Done category
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the ids of the restored cards, matching the requested ids
+
+    """
+    ids = list(dict.fromkeys(parse_ids(json_body())))
+
+    missing = set(ids) - find_archived(g.user["id"], ids)
+    if missing:
+        abort(404, f"Archived card id {min(missing)} doesn't exist.")
+
+    return {"restored": restore_cards(g.user["id"], ids)}
+
+
+@bp.route("/flow")
+def flow():
+    """
+    Cumulative flow, throughput and cycle time of the user's board
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with one entry per day of the "days" query argument, oldest first,
+    see flow.load_flow
+
+    """
+    return load_flow(g.user["id"], flow_days())
+
+
+@bp.route("/search")
+def search():
+    """
+    Search the current user's cards by title and body
+
+    Query arguments are "q", the words to find, "page", starting at 1, and
+    an optional "limit" capped by BOARD_MAX_PAGE_SIZE.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the best matching cards and the number of the next page
+
+    """
+    limit = request.args.get("limit", current_app.config["SEARCH_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["BOARD_MAX_PAGE_SIZE"]))
+    page = max(1, request.args.get("page", 1, type=int))
+    results = search_posts(g.user["id"], request.args.get("q", ""), page, limit)
+
+    return {"cards": [card_json(post) for post in results.posts], "next": results.next}
+
+
+@bp.route("/cards", methods=("POST",))
+def create():
+    """
+    Create one card, or several when the body is a list
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the created card or cards
+
+    """
+    data = json_body()
+    many = isinstance(data, list)
+    cards = []
+
+    for card in data if many else [data]:
+        if not isinstance(card, dict):
+            abort(400, "Expected a JSON object per card.")
+
+        parse_text(card.get("title"), card.get("body", ""))
+        status = parse_status(card.get("status", STATUS_LABELS[TODO]))
+        cards.append((card["title"], card.get("body", ""), status))
+
+    #all cards are created in one transaction
+    ids = write_board(insert_posts, g.user["id"], cards)
+    publish(g.user["id"], "created", ids)
+
+    created = [card_json(post) for post in get_posts(ids)]
+    return (created if many else created[0]), 201
+
+
+@bp.route("/cards/<int:id>")
+def card(id):
+    """
+    Get a single card
+
+    Parameters
+    -----------
+    id: card's unique id
+
+    Returns
+    -----------
+    JSON with the card
+
+    """
+    return card_json(get_post(id))
+
+
+@bp.route("/cards/<int:id>/history")
+def history(id):
+    """
+    Get the status changes of a card
+
+    Parameters
+    -----------
+    id: card's unique id
+
+    Returns
+    -----------
+    JSON with the card's transitions, oldest first
+
+    """
+    get_post(id)
+    return {"transitions": load_history(g.user["id"], id)}
+
+
+@bp.route("/cards/<int:id>", methods=("PATCH",))
+def update(id):
+    """
+    Change the title, body or status of a card
+
+    Parameters
+    -----------
+    id: card's unique id
+
+    Returns
+    -----------
+    JSON with the updated card
+
+    """
+    post = get_post(id)
+    data = json_body()
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+
+    title = data.get("title", post["title"])
+    body = data.get("body", post["body"])
+    status = parse_status(data.get("status", STATUS_LABELS[post["status"]]))
+    parse_text(title, body)
+
+    #a status change is committed with the new title and body
+    moved = status != post["status"]
+    write_board(edit_post, g.user["id"], id, title, body, status if moved else None)
+    if moved:
+        publish(g.user["id"], "moved", [id], status)
+    publish(g.user["id"], "updated", [id])
+
+    return card_json(get_post(id))
+
+
+@bp.route("/cards/<int:id>", methods=("DELETE",))
+def delete(id):
+    """
+    Delete a card
+
+    Parameters
+    -----------
+    id: card's unique id
+
+    Returns
+    -----------
+    Empty response
+
+    """
+    get_post(id)
+    write_board(remove_posts, g.user["id"], [id])
+    publish(g.user["id"], "deleted", [id])
+    return "", 204
+
+
+@bp.route("/cards/move", methods=("POST",))
+def move():
+    """
+    Move several cards to one category
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the new status and moved ids
+
+    """
+    data = json_body()
+    ids = parse_ids(data)
+    status = data.get("status")
+    moved = move_posts(ids, parse_status(status))
+    return {"status": status, "moved": moved}
+
+
+@bp.route("/cards/<int:id>/position", methods=("POST",))
+def position(id):
+    """
+    Move a card to a position in a category
+
+    The body names the category with "status", the card's own by default,
+    and the neighbours with "above" and "below", the ids of the cards to
+    show right above or below it. Without neighbours the card goes on top.
+
+    Parameters
+    -----------
+    id: card's unique id
+
+    Returns
+    -----------
+    JSON with the moved card
+
+    """
+    post = get_post(id)
+    data = json_body()
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+
+    status = parse_status(data.get("status", STATUS_LABELS[post["status"]]))
+    anchors = [data.get("above"), data.get("below")]
+    if any(anchor is not None and type(anchor) is not int for anchor in anchors):
+        abort(400, "Neighbours must be card ids.")
+
+    position_post(id, status, *anchors)
+    return card_json(get_post(id))
+
+
+@bp.route("/cards/delete", methods=("POST",))
+def delete_many():
+    """
+    Delete several cards in one transaction
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    JSON with the deleted ids
+
+    """
+    ids = list(dict.fromkeys(parse_ids(json_body())))
+    get_posts(ids)
+
+    write_board(remove_posts, g.user["id"], ids)
+    publish(g.user["id"], "deleted", ids)
+    return {"deleted": ids}
@@ -22,6 +22,96 @@ def create_app(test_config=None):
         SECRET_KEY="dev",
         # stores database
         DATABASE=os.path.join(app.instance_path, "flaskr.sqlite"),
+        # open connections kept per worker process
+        DATABASE_POOL_SIZE=8,
+        # seconds a request waits for a free connection
+        DATABASE_POOL_TIMEOUT=30.0,
+        # threads running queries for the async server, see asgi.py
+        DATABASE_EXECUTOR_WORKERS=4,
+        # database files the boards are spread over by user, 0 keeps them in
+        # DATABASE, which always holds the users, see db.reshard
+        DATABASE_SHARDS=0,
+        # file of each shard as a format of {database} and {shard}, defaults
+        # to flaskr-shard0.sqlite and so on next to DATABASE
+        DATABASE_SHARD_PATH=None,
+        # prepared statements kept by each connection
+        DATABASE_STATEMENT_CACHE_SIZE=128,
+        # posts shown per Kanban category before "Load more"
+        BOARD_PAGE_SIZE=50,
+        # largest page a client can ask for
+        BOARD_MAX_PAGE_SIZE=500,
+        # cards inserted per transaction by board imports
+        IMPORT_BATCH_SIZE=10000,
+        # days a card stays in Done before it is archived, see archive.py
+        ARCHIVE_AFTER_DAYS=30,
+        # cards archived per transaction
+        ARCHIVE_BATCH_SIZE=500,
+        # seconds between background archive passes, run by one worker at a
+        # time, None to only archive with the archive-cards command
+        ARCHIVE_INTERVAL=None,
+        # days shown by the flow analytics and the most a client can ask for
+        FLOW_DAYS=30,
+        FLOW_MAX_DAYS=366,
+        # search results per page
+        SEARCH_PAGE_SIZE=20,
+        # "memory" per process, "file" shared by local workers, or None
+        CACHE_TYPE="memory",
+        # entries kept before the least recently used are evicted
+        CACHE_MAXSIZE=1024,
+        # seconds a cached entry stays valid
+        CACHE_TTL=300,
+        # folder of the "file" cache, defaults to instance/cache
+        CACHE_DIR=None,
+        # logged in users remembered per worker
+        USER_CACHE_MAXSIZE=4096,
+        # seconds before a remembered user is read again
+        USER_CACHE_TTL=60,
+        # werkzeug hash method and cost, older hashes are upgraded on login
+        PASSWORD_HASH_METHOD="pbkdf2:sha256:260000",
+        PASSWORD_SALT_LENGTH=16,
+        # processes hashing passwords, 0 hashes on the request thread
+        PASSWORD_HASH_WORKERS=0,
+        # hashes running or waiting before sign-ins are turned away
+        PASSWORD_HASH_QUEUE=64,
+        # login attempts allowed as (burst, attempts regained per second)
+        RATELIMIT_ENABLED=True,
+        RATELIMIT_LOGIN_IP=(20, 1.0),
+        RATELIMIT_LOGIN_USER=(5, 1 / 60),
+        # "memory" per process or "sqlite" shared by local workers
+        RATELIMIT_STORAGE="memory",
+        # file of the "sqlite" storage, defaults to instance/ratelimit.sqlite
+        RATELIMIT_DATABASE=None,
+        # threads running Flask requests under the async server
+        ASGI_THREADS=32,
+        # longest wait of a board long-poll, seconds
+        LONGPOLL_TIMEOUT=30,
+        # board events buffered per listener before it must reload the board
+        EVENTS_BUFFER=100,
+        # seconds between keepalive comments on idle event streams
+        EVENTS_KEEPALIVE=15,
+        # time and count the SQL of every request, see profiling.py
+        SQL_PROFILING=False,
+        # seconds after which a profiled statement is logged as slow
+        SQL_SLOW_QUERY=0.1,
+        # distinct statements kept in the profiling totals
+        SQL_STATS_SIZE=1000,
+        # users allowed to see the admin endpoints
+        ADMIN_USERNAMES=(),
+        # commit writes of concurrent requests together on one thread
+        WRITE_PIPELINE=False,
+        # writes per batch, and seconds the writer waits to fill a batch
+        WRITE_BATCH_SIZE=64,
+        WRITE_BATCH_DELAY=0.0,
+        # PRAGMA synchronous of the writer, "FULL" fsyncs every batch
+        WRITE_SYNCHRONOUS="NORMAL",
+        # Prometheus metrics at /metrics, see metrics.py
+        METRICS_ENABLED=True,
+        # folder shared by worker processes, None when there is one process
+        METRICS_DIR=None,
+        # seconds between writes of a worker's metrics to METRICS_DIR
+        METRICS_FLUSH_INTERVAL=1.0,
+        # creates or migrates the schema on start, never drops data
+        ENSURE_SCHEMA=True,
     )
 
     if test_config is None:
@@ -38,22 +128,33 @@ def create_app(test_config=None):
         pass
 
     # setting up database commands
-    import db
+    import archive, board, db, metrics, profiling, search, transfer
 
     db.init_app(app)
+    board.init_app(app)
+    #before the blueprints, so the login lookup is measured too
+    metrics.init_app(app)
+    profiling.init_app(app)
+    search.init_app(app)
+    transfer.init_app(app)
+    archive.init_app(app)
 
     # setting up blueprints
-    import auth, blog
+    import api, auth, blog
 
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    app.register_blueprint(api.bp)
     
-    with app.app_context():
-        db.init_db()
+    if app.config["ENSURE_SCHEMA"]:
+        with app.app_context():
+            db.ensure_schema()
 
     #setting main page
     app.add_url_rule("/", endpoint="index")
 
     return app
 
-create_app()
\ No newline at end of file
+
+if __name__ == "__main__":
+    create_app().run()
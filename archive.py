@@ -0,0 +1,349 @@
+"""
+Archive of old Done cards
+
+Cards that sat in Done for ARCHIVE_AFTER_DAYS are moved from post to the
+archive table in batches, one transaction each, so the board's table and
+indexes keep the size of the working set however long boards are used.
+Passes run with the archive-cards command or, with ARCHIVE_INTERVAL set,
+on a background thread of the worker holding the archiver's lease in the
+directory database. Archived cards can be browsed and restored to the
+board.
+
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import click
+from flask import current_app
+
+import queries
+from board import DONE, decode_cursor, make_page, top_rank, touch_board
+from db import board_databases, board_shard, get_board_db, get_db, shard_id_end
+from db import write, write_board
+from events import publish
+from ranks import rank_between
+
+#guards the creation of archivers
+ARCHIVER_LOCK = threading.Lock()
+
+#name of the lease of background archive passes
+ARCHIVER_LEASE = "archiver"
+
+
+def archive_batch(shard, age, limit):
+    """
+    Move the oldest Done cards of one database to the archive
+
+    Parameters
+    -----------
+    - shard: shard number, None for the directory database
+    - age: days a card must have been in Done
+    - limit: cards moved at most
+
+    Returns
+    -----------
+    Dictionary of the archived card ids by board owner
+
+    """
+    db = get_db(shard)
+    #candidates are selected under the write lock, so passes of other
+    #processes never archive the same cards
+    if not db.in_transaction:
+        db.execute("BEGIN IMMEDIATE")
+    rows = db.execute(queries.ARCHIVE_CANDIDATES, (f"-{age} days", limit)).fetchall()
+    if not rows:
+        return {}
+
+    ids = json.dumps([row["id"] for row in rows])
+    db.execute(queries.ARCHIVE_POSTS, (ids,))
+    db.execute(queries.POSTS_DELETE, (ids,))
+
+    boards = {}
+    for row in rows:
+        boards.setdefault(row["author_id"], []).append(row["id"])
+    for author_id in boards:
+        touch_board(author_id)
+
+    return boards
+
+
+def archive_cards(age=None, batch_size=None):
+    """
+    Archive every card that sat in Done for longer than age
+
+    Each batch is its own write, so requests can commit between batches.
+
+    Parameters
+    -----------
+    - age: days in Done, ARCHIVE_AFTER_DAYS when None
+    - batch_size: cards per transaction, ARCHIVE_BATCH_SIZE when None
+
+    Returns
+    -----------
+    Number of archived cards
+
+    """
+    config = current_app.config
+    if age is None:
+        age = config["ARCHIVE_AFTER_DAYS"]
+    if batch_size is None:
+        batch_size = config["ARCHIVE_BATCH_SIZE"]
+
+    archived = 0
+    for shard in board_databases():
+        while True:
+            boards = write(archive_batch, shard, age, batch_size, shard=shard)
+            for author_id, ids in boards.items():
+                #open boards drop the cards like deleted ones
+                publish(author_id, "deleted", ids)
+
+            count = sum(len(ids) for ids in boards.values())
+            archived += count
+            if count < batch_size:
+                break
+
+    return archived
+
+
+def load_archive(author_id, cursor, limit):
+    """
+    Load a page of a user's archived cards
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - cursor: cursor of the previous page, None for the first page
+    - limit: number of cards to return
+
+    Returns
+    -----------
+    board.Page of archived cards, most recently created first, raises
+    ValueError for malformed cursors
+
+    """
+    db = get_board_db(author_id)
+
+    #one extra row tells whether a next page exists
+    if cursor is None:
+        rows = db.execute(queries.ARCHIVE_FIRST, (author_id, limit + 1)).fetchall()
+    else:
+        created, id = decode_cursor(cursor)
+        rows = db.execute(
+            queries.ARCHIVE_PAGE, (author_id, created, id, limit + 1)
+        ).fetchall()
+
+    return make_page(rows, limit, "created")
+
+
+def find_archived(author_id, ids):
+    """
+    Archived cards of a user among some ids
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of card ids
+
+    Returns
+    -----------
+    Set of the ids the user has archived
+
+    """
+    rows = get_board_db(author_id).execute(
+        queries.ARCHIVE_GET, (author_id, json.dumps(ids))
+    ).fetchall()
+    return {row["id"] for row in rows}
+
+
+def restore_posts(author_id, ids):
+    """
+    Move archived cards of a user back to the top of the Done column
+
+    Cards keep their id unless it is outside the id range of the board's
+    database, which happens when the board moved to a lower shard.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of archived card ids
+
+    Returns
+    -----------
+    List of the ids of the restored posts, in the order of ids, None for
+    cards the user has not archived
+
+    """
+    db = get_board_db(author_id)
+    end = shard_id_end(board_shard(author_id))
+
+    rows = db.execute(queries.ARCHIVE_GET, (author_id, json.dumps(ids))).fetchall()
+    rank = top_rank(author_id, DONE)
+    restored = {}
+    for row in rows:
+        id = row["id"] if row["id"] < end else None
+        rank = rank_between(rank, None)
+        restored[row["id"]] = db.execute(
+            queries.ARCHIVE_RESTORE,
+            (id, row["title"], row["body"], row["created"], author_id, rank),
+        ).lastrowid
+
+    db.execute(queries.ARCHIVE_DELETE, (author_id, json.dumps(ids)))
+    if restored:
+        touch_board(author_id)
+
+    return [restored.get(id) for id in ids]
+
+
+def restore_cards(author_id, ids):
+    """
+    Restore archived cards and show them on open boards
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of archived card ids
+
+    Returns
+    -----------
+    Same as restore_posts
+
+    """
+    restored = write_board(restore_posts, author_id, ids)
+
+    created = [id for id in restored if id is not None]
+    if created:
+        publish(author_id, "created", created)
+
+    return restored
+
+
+class Archiver:
+    """
+    Runs archive passes on a background thread of a worker process
+
+    Every worker starts one, but only the worker holding the lease runs
+    passes. The holder renews it before each pass, so when it stops another
+    worker takes over once the lease expired.
+
+    Parameters
+    -----------
+    - app: Flask application, passes run in its application context
+    - interval: seconds between the end of a pass and the next one
+
+    """
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        #long enough to cover a pass and the wait before the next one
+        self.lease = max(3 * interval, 60)
+        self.owner = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.passes = 0
+        self.archived = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def take_lease(self):
+        row = get_db().execute(
+            queries.LEASE_TAKE, (ARCHIVER_LEASE, self.owner, time.time(), self.lease)
+        ).fetchone()
+        return row is not None
+
+    def release_lease(self):
+        get_db().execute(queries.LEASE_RELEASE, (ARCHIVER_LEASE, self.owner))
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    if write(self.take_lease):
+                        self.archived += archive_cards()
+                        self.passes += 1
+                except Exception:
+                    #the next pass tries again
+                    self.app.logger.exception("Archive pass failed")
+
+        with self.app.app_context():
+            try:
+                write(self.release_lease)
+            except Exception:
+                self.app.logger.exception("Releasing the archive lease failed")
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def get_archiver():
+    """
+    Archiver of the current application
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Archiver running every ARCHIVE_INTERVAL seconds
+
+    """
+    archiver = current_app.extensions.get("archiver")
+
+    if archiver is None or archiver.pid != os.getpid():
+        with ARCHIVER_LOCK:
+            archiver = current_app.extensions.get("archiver")
+
+            if archiver is None or archiver.pid != os.getpid():
+                archiver = Archiver(
+                    current_app._get_current_object(), current_app.config["ARCHIVE_INTERVAL"]
+                )
+                current_app.extensions["archiver"] = archiver
+
+    return archiver
+
+
+def start_archiver():
+    """
+    Start the background archiver of a worker with its first request
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    if current_app.config["ARCHIVE_INTERVAL"] is not None:
+        get_archiver()
+
+
+@click.command("archive-cards")
+@click.option("--age", type=float, help="Days in Done, ARCHIVE_AFTER_DAYS by default.")
+@click.option("--batch-size", type=int, help="Cards per transaction.")
+def archive_cards_command(age, batch_size):
+    """
+    Move cards that sat in Done for too long to the archive
+
+    Parameters
+    -----------
+    - age: days a card must have been in Done
+    - batch_size: cards per transaction
+
+    Returns
+    -----------
+    None
+
+    """
+    click.echo(f"Archived {archive_cards(age, batch_size)} cards.")
+
+
+def init_app(app):
+    app.before_request(start_archiver)
+    app.cli.add_command(archive_cards_command)
@@ -0,0 +1,404 @@
+"""
+Async (ASGI) serving mode
+
+Serve with any ASGI server, for example:
+
+    uvicorn --factory asgi:create_asgi_app
+
+Board long-polls and event streams are answered by coroutines that wait
+on the event loop and read the database through db.QueryExecutor, so
+thousands of idle clients cost no threads. Every other request is passed
+to the Flask app on a bounded thread pool, which reads the request body
+from the connection as the view consumes it.
+
+"""
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BufferedReader, RawIOBase
+from urllib.parse import parse_qsl
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from werkzeug.http import parse_cookie
+
+import queries
+from app import create_app
+from db import get_executor, get_pools, shard_index
+from events import AsyncSubscription, board_channel, format_event, get_broker
+
+#requests answered on the event loop instead of the Flask app
+LONGPOLL_PATH = "/api/v1/board/wait"
+EVENTS_PATH = "/api/v1/board/events"
+
+
+class BodyStream(RawIOBase):
+    """
+    wsgi.input reading an ASGI request body from a worker thread
+
+    Each read waits for the next message on the event loop, so the body is
+    never held in memory as a whole. Reading past limit bytes raises
+    RequestEntityTooLarge, which Flask answers with 413.
+
+    Parameters
+    -----------
+    - receive: ASGI receive callable
+    - loop: event loop of the connection
+    - limit: largest body in bytes, None for no limit
+
+    """
+
+    def __init__(self, receive, loop, limit=None):
+        self.receive = receive
+        self.loop = loop
+        self.limit = limit
+        self.buffer = b""
+        self.received = 0
+        self.more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and self.more:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+
+            self.buffer = message.get("body", b"")
+            self.more = message.get("more_body", False)
+            self.received += len(self.buffer)
+            if self.limit is not None and self.received > self.limit:
+                raise RequestEntityTooLarge()
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def build_environ(scope, body):
+    """
+    WSGI environ for an ASGI HTTP request
+
+    Parameters
+    -----------
+    - scope: ASGI connection scope
+    - body: file object of the request body, see BodyStream
+
+    Returns
+    -----------
+    Dictionary passed to the WSGI app
+
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    #chunked bodies have no length, the stream ends with the last message
+    if "CONTENT_LENGTH" not in environ:
+        environ["wsgi.input_terminated"] = True
+
+    return environ
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode("utf8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AsgiApp:
+    """
+    ASGI application wrapping the Flask Kanban app
+
+    Parameters
+    -----------
+    - flask_app: application made by create_app
+    - threads: threads running Flask requests
+
+    """
+
+    def __init__(self, flask_app, threads=32):
+        self.flask_app = flask_app
+        self.threads = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+
+        with flask_app.app_context():
+            self.queries = get_executor()
+            self.pools = get_pools()
+            self.broker = get_broker()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] != "http":
+            raise NotImplementedError(f"Unsupported ASGI scope {scope['type']!r}.")
+        elif scope["path"] == LONGPOLL_PATH and scope["method"] == "GET":
+            await self.wait_for_board(scope, receive, send)
+        elif scope["path"] == EVENTS_PATH and scope["method"] == "GET":
+            await self.stream_board(scope, receive, send)
+        else:
+            await self.call_flask(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self):
+        self.threads.shutdown(wait=False)
+        self.queries.close()
+
+    def session_user(self, scope):
+        """
+        Id of the user logged in with the request's session cookie
+
+        Parameters
+        -----------
+        scope: ASGI connection scope
+
+        Returns
+        -----------
+        User id, None when not logged in
+
+        """
+        cookies = {}
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                cookies.update(parse_cookie(value.decode("latin1")))
+
+        cookie = cookies.get(self.flask_app.config["SESSION_COOKIE_NAME"])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+
+        if cookie is None or serializer is None:
+            return None
+
+        try:
+            session = serializer.loads(
+                cookie,
+                max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()),
+            )
+        except Exception:
+            return None
+
+        return session.get("user_id")
+
+    async def wait_for_board(self, scope, receive, send):
+        """
+        Long-poll until the user's board moves past a known version
+
+        Query arguments are "version", the version the client shows, and
+        an optional "timeout" in seconds capped by LONGPOLL_TIMEOUT. The
+        version is read when the poll starts, then again only when the
+        board's channel gets an event and at the timeout, so waiting
+        clients cost no queries. Events are published in-process, a change
+        made by another worker is seen at the timeout.
+
+        Parameters
+        -----------
+        - scope: ASGI connection scope
+        - receive: ASGI receive callable
+        - send: ASGI send callable
+
+        Returns
+        -----------
+        None
+
+        """
+        user_id = self.session_user(scope)
+        if user_id is None:
+            return await send_json(send, {"error": "Login required."}, 401)
+
+        config = self.flask_app.config
+        args = dict(parse_qsl(scope.get("query_string", b"").decode("latin1")))
+        try:
+            known = int(args.get("version", 0))
+            timeout = min(
+                float(args.get("timeout", config["LONGPOLL_TIMEOUT"])),
+                config["LONGPOLL_TIMEOUT"],
+            )
+        except ValueError:
+            return await send_json(send, {"error": "Invalid version or timeout."}, 400)
+
+        shards = config["DATABASE_SHARDS"]
+        pool = self.pools[shard_index(user_id, shards)] if shards else None
+
+        #subscribed before reading, so no change falls between the two
+        subscription = self.broker.subscribe(board_channel(user_id), AsyncSubscription)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                row = await self.queries.fetchone(queries.BOARD_VERSION, (user_id,), pool)
+                version = row["version"] if row else 0
+
+                remaining = deadline - time.monotonic()
+                if version != known or remaining <= 0:
+                    return await send_json(send, {"version": version, "changed": version != known})
+
+                await subscription.get(remaining)
+        finally:
+            self.broker.unsubscribe(subscription)
+
+    async def stream_board(self, scope, receive, send):
+        """
+        Stream board changes as Server-Sent Events from the event loop
+
+        Same events as the Flask view, without a thread per open stream.
+
+        Parameters
+        -----------
+        - scope: ASGI connection scope
+        - receive: ASGI receive callable
+        - send: ASGI send callable
+
+        Returns
+        -----------
+        None
+
+        """
+        user_id = self.session_user(scope)
+        if user_id is None:
+            return await send_json(send, {"error": "Login required."}, 401)
+
+        async def disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        keepalive = self.flask_app.config["EVENTS_KEEPALIVE"]
+        subscription = self.broker.subscribe(board_channel(user_id), AsyncSubscription)
+        disconnected = asyncio.ensure_future(disconnect())
+
+        async def write(text, more=True):
+            await send({"type": "http.response.body", "body": text.encode("utf8"), "more_body": more})
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                ],
+            })
+            await write("retry: 3000\n\n")
+
+            while not subscription.overflowed and not disconnected.done():
+                event = await subscription.get(keepalive)
+                await write(": keepalive\n\n" if event is None else format_event(event))
+
+            if subscription.overflowed:
+                await write(format_event({"event": "resync"}))
+            await write("", more=False)
+        finally:
+            disconnected.cancel()
+            self.broker.unsubscribe(subscription)
+
+    async def call_flask(self, scope, receive, send):
+        """
+        Run a request through the Flask app on the thread pool
+
+        The response body is sent chunk by chunk, so streamed responses
+        reach the client as they are produced.
+
+        Parameters
+        -----------
+        - scope: ASGI connection scope
+        - receive: ASGI receive callable
+        - send: ASGI send callable
+
+        Returns
+        -----------
+        None
+
+        """
+        loop = asyncio.get_running_loop()
+        body = BufferedReader(
+            BodyStream(receive, loop, self.flask_app.config["MAX_CONTENT_LENGTH"])
+        )
+        environ = build_environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in headers
+            ]
+
+        result = await loop.run_in_executor(
+            self.threads, self.flask_app.wsgi_app, environ, start_response
+        )
+        chunks = iter(result)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": started["headers"],
+            })
+
+            while True:
+                chunk = await loop.run_in_executor(self.threads, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.threads, result.close)
+
+
+def create_asgi_app(flask_app=None):
+    """
+    Build the ASGI application
+
+    Parameters
+    -----------
+    flask_app: application made by create_app, a new one when None
+
+    Returns
+    -----------
+    AsgiApp
+
+    """
+    if flask_app is None:
+        flask_app = create_app()
+
+    return AsgiApp(flask_app, flask_app.config["ASGI_THREADS"])
@@ -1,6 +1,7 @@
 import functools
 
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
 from flask import redirect
@@ -8,10 +9,12 @@ from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
 
-from db import get_db
+import queries
+from cache import MemoryCache
+from db import get_db, write
+from passwords import HashingBusy, get_hasher
+from ratelimit import hit
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -40,12 +43,55 @@ def login_required(view):
     return wrapped_view
 
 
+def get_user_cache():
+    """
+    Cache of logged in users' identities for the current worker
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    MemoryCache keyed by user id
+
+    """
+    cache = current_app.extensions.get("user_cache")
+
+    if cache is None:
+        cache = MemoryCache(
+            current_app.config["USER_CACHE_MAXSIZE"], current_app.config["USER_CACHE_TTL"]
+        )
+        current_app.extensions["user_cache"] = cache
+
+    return cache
+
+
+def forget_user(user_id):
+    """
+    Drop a cached identity, call it whenever a user's row changes
+
+    Parameters
+    -----------
+    user_id: id of the changed user
+
+    Returns
+    -----------
+    None
+
+    """
+    get_user_cache().delete(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
     """
     When user's session is continued, current user's data is accessible by g.user
     Keeps current user's credentials
 
+    Only the id and username are loaded, and they are cached per worker so
+    most requests do not query the database at all.
+
     Parameters
     -----------
     None
@@ -56,13 +102,70 @@ def load_logged_in_user():
 
     """
     user_id = session.get("user_id")
+    g.user = None
+
+    #static files never need the user
+    if user_id is None or request.endpoint == "static":
+        return
+
+    cache = get_user_cache()
+    g.user = cache.get(user_id)
+
+    if g.user is None:
+        user = get_db().execute(queries.USER_GET, (user_id,)).fetchone()
+
+        if user is not None:
+            g.user = {"id": user["id"], "username": user["username"]}
+            cache.set(user_id, g.user)
 
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = (
-            get_db().execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
-        )
+
+def busy(template):
+    """
+    Page shown when the password hasher is saturated
+
+    Parameters
+    -----------
+    template: form to show again
+
+    Returns
+    -----------
+    Form with an error message and status 503
+
+    """
+    flash("Too many sign-ins right now, please try again in a moment.")
+    return render_template(template), 503, {"Retry-After": "1"}
+
+
+def create_user(username, pwhash):
+    return get_db().execute(queries.USER_CREATE, (username, pwhash)).lastrowid
+
+
+def set_password(user_id, pwhash):
+    get_db().execute(queries.USER_SET_PASSWORD, (pwhash, user_id))
+
+
+def upgrade_password(user_id, password):
+    """
+    Store a password again with the configured hash method and cost
+
+    Parameters
+    -----------
+    - user_id: id of the user who just logged in
+    - password: their verified plain text password
+
+    Returns
+    -----------
+    None
+
+    """
+    try:
+        pwhash = get_hasher().hash(password)
+    except HashingBusy:
+        #the next login tries again
+        return
+
+    write(set_password, user_id, pwhash)
+    forget_user(user_id)
 
 
 @bp.route("/register", methods=("GET", "POST"))
@@ -94,11 +197,10 @@ def register():
         if error is None:
             try:
                 #hashing the password
-                db.execute(
-                    "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)),
-                )
-                db.commit()
+                write(create_user, username, get_hasher().hash(password))
+
+            except HashingBusy:
+                return busy("auth/register.html")
             
             #validate username is unique
             except db.IntegrityError:
@@ -132,24 +234,38 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
+
+        #turn floods away before any database or hashing work
+        config = current_app.config
+        retry = hit(f"ip:{request.remote_addr}", config["RATELIMIT_LOGIN_IP"]) or hit(
+            f"user:{username}", config["RATELIMIT_LOGIN_USER"]
+        )
+        if retry:
+            flash(f"Too many login attempts, please try again in {retry} seconds.")
+            return render_template("auth/login.html"), 429, {"Retry-After": str(retry)}
+
         db = get_db()
         error = None
         try:
-            user = db.execute(
-            "SELECT * FROM user WHERE username = ?", (username,)
-            ).fetchone()
+            user = db.execute(queries.USER_BY_NAME, (username,)).fetchone()
         except:
             flash("You need to create an account first")
             return redirect(url_for("auth.register"))
 
         #check credentials
-        if user is None:
-            error = "Incorrect username."
-        elif not check_password_hash(user["password"], password):
-            error = "Incorrect password."
+        try:
+            if user is None:
+                error = "Incorrect username."
+            elif not get_hasher().verify(user["password"], password):
+                error = "Incorrect password."
+        except HashingBusy:
+            return busy("auth/login.html")
 
         #create new session for logged in user
         if error is None:
+            if get_hasher().needs_rehash(user["password"]):
+                upgrade_password(user["id"], password)
+
             session.clear()
             session["user_id"] = user["id"]
             return redirect(url_for("index"))
@@ -0,0 +1,1010 @@
+"""
+Benchmarks for the Kanban request paths
+
+Usage
+-----------
+python3 bench.py index --users 10000 --cards 1000
+python3 bench.py search --users 2000 --cards 200
+python3 bench.py suite --save baseline.json
+python3 bench.py suite --compare baseline.json
+python3 bench.py shards --shards 0 1 2 4 --processes 4
+
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from app import create_app
+from board import TODO, insert_posts
+from db import PRAGMAS, get_db, get_pool, init_db, write_board
+from events import Broker
+from passwords import get_hasher
+from transfer import export_board, import_board
+
+#the four queries blog.index ran before the board was loaded per user
+LEGACY_INDEX_QUERIES = (
+    "SELECT p.id, title, body, created, author_id, username"
+    " FROM post p JOIN user u ON p.author_id = u.id"
+    " ORDER BY created DESC",
+) + tuple(
+    "SELECT p.id, title, body, created, author_id, username"
+    " FROM post p JOIN user u ON p.author_id = u.id"
+    f" WHERE p.status = {status} AND p.author_id = {{author_id}}"
+    " ORDER BY created DESC"
+    for status in (0, 1, 2)
+)
+
+
+def populate(db, users, cards):
+    """
+    Fill an empty database with synthetic users and tasks
+
+    Parameters
+    -----------
+    - db: database connection
+    - users: number of users to create
+    - cards: number of tasks per user, spread over all categories
+
+    Returns
+    -----------
+    None
+
+    """
+    db.execute("PRAGMA synchronous = OFF")
+    db.executemany(
+        "INSERT INTO user (id, username, password) VALUES (?, ?, ?)",
+        ((i, f"user{i}", "!") for i in range(1, users + 1)),
+    )
+    db.executemany(
+        "INSERT INTO post (title, body, status, author_id, created)"
+        " VALUES (?, ?, ?, ?, datetime('2020-01-01', ? || ' seconds'))",
+        (
+            (f"task {n}", "synthetic body", n % 3, author_id, n)
+            for author_id in range(1, users + 1)
+            for n in range(cards)
+        ),
+    )
+    db.commit()
+
+
+def close(app):
+    """
+    Close the pooled connections of a benchmark app
+
+    Parameters
+    -----------
+    app: Flask application
+
+    Returns
+    -----------
+    None
+
+    """
+    with app.app_context():
+        get_pool().close()
+
+
+def percentiles(samples):
+    """
+    Summarize latency samples
+
+    Parameters
+    -----------
+    samples: list of durations in seconds
+
+    Returns
+    -----------
+    Dictionary with p50, p95 and p99 in milliseconds
+
+    """
+    cuts = statistics.quantiles(samples, n=100)
+    return {
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+    }
+
+
+def report(name, samples):
+    summary = percentiles(samples)
+    print(
+        f"{name:<24} n={len(samples):<6}"
+        + " ".join(f"{k}={v:8.2f}ms" for k, v in summary.items())
+    )
+
+
+def bench_index(args):
+    """
+    Time the board page against a large synthetic database
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"TESTING": True, "DATABASE": db_path})
+        with app.app_context():
+            init_db()
+            started = time.perf_counter()
+            populate(get_db(), args.users, args.cards)
+            print(
+                f"populated {args.users} users x {args.cards} cards"
+                f" in {time.perf_counter() - started:.1f}s"
+            )
+
+            #raw queries of the previous implementation for comparison
+            if args.legacy:
+                samples = []
+                for _ in range(args.legacy):
+                    author_id = random.randint(1, args.users)
+                    started = time.perf_counter()
+                    for sql in LEGACY_INDEX_QUERIES:
+                        get_db().execute(sql.format(author_id=author_id)).fetchall()
+                    samples.append(time.perf_counter() - started)
+                report("legacy index queries", samples)
+
+        client = app.test_client()
+        samples = []
+        for _ in range(args.requests):
+            with client.session_transaction() as session:
+                session["user_id"] = random.randint(1, args.users)
+            started = time.perf_counter()
+            response = client.get("/")
+            samples.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+        report("GET /", samples)
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def bench_search(args):
+    """
+    Time searches of one user's board against a large synthetic database
+
+    Every card holds the searched word, so a search that is not narrowed
+    to the user's cards inside the index pays for every board.
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"TESTING": True, "DATABASE": db_path})
+        with app.app_context():
+            init_db()
+            started = time.perf_counter()
+            populate(get_db(), args.users, args.cards)
+            print(
+                f"populated {args.users} users x {args.cards} cards"
+                f" in {time.perf_counter() - started:.1f}s"
+            )
+
+        client = app.test_client()
+        for query in args.queries:
+            samples = []
+            for _ in range(args.requests):
+                with client.session_transaction() as session:
+                    session["user_id"] = random.randint(1, args.users)
+                started = time.perf_counter()
+                response = client.get("/api/v1/search", query_string={"q": query})
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+            report(f"search {query!r}", samples)
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def bench_move(args):
+    """
+    Compare moving cards one form post at a time with one batch request
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"TESTING": True, "DATABASE": db_path})
+        with app.app_context():
+            populate(get_db(), 1, args.cards)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = 1
+
+        per_card = []
+        batch = []
+        for run in range(args.runs):
+            ids = random.sample(range(1, args.cards + 1), args.batch)
+            target = ("todo", "doing", "done")[run % 3]
+
+            #what the board page does today: one post and one re-render per card
+            started = time.perf_counter()
+            for id in ids:
+                response = client.post(f"/{id}/move_{target}", follow_redirects=True)
+                assert response.status_code == 200, response.status_code
+            per_card.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            response = client.post("/move", json={"ids": ids, "status": target})
+            assert response.status_code == 200, response.status_code
+            batch.append(time.perf_counter() - started)
+
+        report(f"{args.batch} x move_{{status}}", per_card)
+        report(f"POST /move ({args.batch} ids)", batch)
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def bench_login(args):
+    """
+    Measure logins per second with concurrent clients
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({
+            "TESTING": True,
+            "DATABASE": db_path,
+            "PASSWORD_HASH_WORKERS": args.workers,
+            "PASSWORD_HASH_QUEUE": args.clients,
+            "RATELIMIT_ENABLED": False,
+        })
+        with app.app_context():
+            hasher = get_hasher()
+            db = get_db()
+            db.executemany(
+                "INSERT INTO user (username, password) VALUES (?, ?)",
+                ((f"user{i}", hasher.hash("secret")) for i in range(args.clients)),
+            )
+            db.commit()
+
+        def client_loop(i, samples):
+            client = app.test_client()
+            for _ in range(args.logins):
+                started = time.perf_counter()
+                response = client.post(
+                    "/auth/login", data={"username": f"user{i}", "password": "secret"}
+                )
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 302, response.status_code
+
+        samples = []
+        threads = [
+            threading.Thread(target=client_loop, args=(i, samples))
+            for i in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        cores = min(args.workers or 1, os.cpu_count())
+        report(f"POST /auth/login x{args.clients}", samples)
+        print(
+            f"{len(samples) / elapsed:.1f} logins/s,"
+            f" {len(samples) / elapsed / cores:.1f} logins/s per core"
+            f" ({args.workers} hash workers)"
+        )
+
+        hasher.close()
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def bench_startup(args):
+    """
+    Time app creation against an existing, already migrated database
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"TESTING": True, "DATABASE": db_path})
+        with app.app_context():
+            populate(get_db(), args.users, args.cards)
+        close(app)
+
+        samples = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            app = create_app({"TESTING": True, "DATABASE": db_path})
+            samples.append(time.perf_counter() - started)
+            close(app)
+        report("create_app", samples)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def bench_import(args):
+    """
+    Time importing and exporting a large board
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    csv_fd, csv_path = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(csv_fd, "w") as f:
+            f.write("title,body,status,created\n")
+            for n in range(args.cards):
+                f.write(f"task {n},synthetic body,{('todo', 'doing', 'done')[n % 3]},\n")
+
+        app = create_app({"TESTING": True, "DATABASE": db_path, "IMPORT_BATCH_SIZE": args.batch})
+        with app.app_context():
+            db = get_db()
+            db.execute("INSERT INTO user (username, password) VALUES ('bench', '!')")
+            db.commit()
+
+            started = time.perf_counter()
+            with open(csv_path, newline="") as f:
+                count = import_board(1, f, "csv")
+            elapsed = time.perf_counter() - started
+            print(f"import {count} cards: {elapsed:.2f}s ({count / elapsed:,.0f} cards/s)")
+
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in export_board(1, "csv"))
+            elapsed = time.perf_counter() - started
+            print(f"export {size / 1e6:.1f} MB: {elapsed:.2f}s ({count / elapsed:,.0f} cards/s)")
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+        os.unlink(csv_path)
+
+
+def bench_writes(args):
+    """
+    Compare committing every write on its request with the write pipeline
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    for pipeline in (False, True):
+        db_fd, db_path = tempfile.mkstemp()
+        try:
+            app = create_app({
+                "DATABASE": db_path,
+                "DATABASE_POOL_SIZE": args.clients + 1,
+                "DATABASE_PRAGMAS": {**PRAGMAS, "synchronous": args.synchronous},
+                "WRITE_PIPELINE": pipeline,
+                "WRITE_SYNCHRONOUS": args.synchronous,
+            })
+            with app.app_context():
+                populate(get_db(), args.clients, 0)
+
+            samples = []
+
+            def client_loop(user_id):
+                client = app.test_client()
+                with client.session_transaction() as session:
+                    session["user_id"] = user_id
+                for n in range(args.writes):
+                    started = time.perf_counter()
+                    response = client.post("/api/v1/cards", json={"title": f"card {n}"})
+                    samples.append(time.perf_counter() - started)
+                    assert response.status_code == 201, response.status_code
+
+            threads = [
+                threading.Thread(target=client_loop, args=(i,))
+                for i in range(1, args.clients + 1)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            name = "write pipeline" if pipeline else "commit per request"
+            report(name, samples)
+            print(f"{'':<24} {len(samples) / elapsed:.0f} writes/s")
+
+            writer = app.extensions.get("db_writers", {}).get(None)
+            if writer is not None:
+                print(f"{'':<24} {writer.writes / writer.batches:.1f} writes per commit")
+                writer.close()
+            close(app)
+        finally:
+            os.close(db_fd)
+            os.unlink(db_path)
+
+
+def write_cards(config, args, worker, barrier):
+    """
+    Commit cards one at a time for the users of one benchmark process
+
+    Parameters
+    -----------
+    - config: configuration of the benchmark app
+    - args: parsed command line arguments
+    - worker: number of the process, users are split between processes
+    - barrier: waited on before the first write
+
+    Returns
+    -----------
+    None
+
+    """
+    app = create_app(config)
+    users = range(worker + 1, args.users + 1, args.processes)
+
+    with app.app_context():
+        barrier.wait()
+        for n in range(args.writes):
+            write_board(insert_posts, users[n % len(users)], [(f"card {n}", "", TODO)])
+
+
+def bench_shards(args):
+    """
+    Compare the write throughput of several processes over more shards
+
+    Every process commits its own writes, so with a single database they
+    queue for its write lock. Each shard has its own lock, so throughput
+    grows with the number of shards until the cores or the disk are busy.
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    context = multiprocessing.get_context("fork")
+
+    for shards in args.shards:
+        directory = tempfile.mkdtemp()
+        try:
+            config = {
+                "DATABASE": os.path.join(directory, "kanban.sqlite"),
+                "DATABASE_SHARDS": shards,
+                "DATABASE_PRAGMAS": {**PRAGMAS, "synchronous": args.synchronous},
+            }
+            app = create_app(config)
+            with app.app_context():
+                populate(get_db(), args.users, 0)
+            close(app)
+
+            barrier = context.Barrier(args.processes + 1)
+            workers = [
+                context.Process(target=write_cards, args=(config, args, worker, barrier))
+                for worker in range(args.processes)
+            ]
+            for worker in workers:
+                worker.start()
+
+            barrier.wait()
+            started = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+            name = f"{shards} shards" if shards else "single database"
+            print(f"{name:<24} {args.processes * args.writes / elapsed:8.0f} writes/s")
+        finally:
+            shutil.rmtree(directory)
+
+
+def bench_fanout(args):
+    """
+    Time publishing board events to many open streams
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    broker = Broker(args.events)
+    publish_times = []
+    delivery_times = []
+    lock = threading.Lock()
+
+    def listen(subscription):
+        delays = []
+        for _ in range(args.events):
+            event = subscription.get(10)
+            delays.append(time.perf_counter() - event["sent"])
+        broker.unsubscribe(subscription)
+        with lock:
+            delivery_times.extend(delays)
+
+    subscriptions = [broker.subscribe("board:1") for _ in range(args.listeners)]
+    threads = [threading.Thread(target=listen, args=(s,)) for s in subscriptions]
+    for thread in threads:
+        thread.start()
+
+    for _ in range(args.events):
+        started = time.perf_counter()
+        broker.publish("board:1", {"event": "moved", "ids": [1], "sent": started})
+        publish_times.append(time.perf_counter() - started)
+
+    for thread in threads:
+        thread.join()
+
+    report(f"publish to {args.listeners}", publish_times)
+    report("delivery", delivery_times)
+
+
+#request paths timed by the suite, registrations run before the logins using them
+SUITE = ("index", "get_post", "create", "move", "register", "login")
+
+#latency percentiles compared against a baseline
+METRICS = ("p50", "p95", "p99")
+
+
+class Workload:
+    """
+    Builds the suite's requests against a populated database
+
+    Parameters
+    -----------
+    - app: Flask application
+    - users: number of synthetic users
+    - cards: tasks per synthetic user
+
+    """
+
+    def __init__(self, app, users, cards):
+        self.app = app
+        self.users = users
+        self.cards = cards
+        self.accounts = itertools.count()
+        self.registered = 0
+        self.serializer = app.session_interface.get_signing_serializer(app)
+
+    def request(self, name):
+        """
+        One request of a suite path for a random user
+
+        Parameters
+        -----------
+        name: path name from SUITE
+
+        Returns
+        -----------
+        (method, path, form data, session cookie) tuple
+
+        """
+        user = random.randint(1, self.users)
+        card = (user - 1) * self.cards + random.randint(1, self.cards)
+        cookie = self.serializer.dumps({"user_id": user})
+
+        if name == "index":
+            return "GET", "/", None, cookie
+        if name == "get_post":
+            return "GET", f"/{card}/update", None, cookie
+        if name == "create":
+            return "POST", "/create", {"title": "bench", "body": "created by bench.py"}, cookie
+        if name == "move":
+            return "POST", f"/{card}/move_{random.choice(('todo', 'doing', 'done'))}", None, cookie
+        if name == "register":
+            self.registered += 1
+            username = f"bench{next(self.accounts)}"
+            return "POST", "/auth/register", {"username": username, "password": "secret"}, None
+        if name == "login":
+            username = f"bench{random.randrange(self.registered)}"
+            return "POST", "/auth/login", {"username": username, "password": "secret"}, None
+
+        raise ValueError(f"Unknown suite path {name!r}.")
+
+
+def executed(app):
+    """
+    Statements run so far by the connections of an app's pool
+
+    Parameters
+    -----------
+    app: Flask application
+
+    Returns
+    -----------
+    Number of statements
+
+    """
+    with app.app_context():
+        stats = get_pool().stats()
+
+    return stats["statement_hits"] + stats["statement_misses"]
+
+
+def summarize(samples, queries, elapsed=None):
+    """
+    Result of one suite path as stored in a baseline
+
+    Parameters
+    -----------
+    - samples: request durations in seconds
+    - queries: statements run by all the requests
+    - elapsed: wall time of a concurrent run, adds requests per second
+
+    Returns
+    -----------
+    Dictionary of metrics
+
+    """
+    result = {"n": len(samples), **percentiles(samples), "queries": queries / len(samples)}
+    if elapsed is not None:
+        result["rps"] = len(samples) / elapsed
+
+    return result
+
+
+def run_client(workload, name, count):
+    """
+    Time requests of one path through the Flask test client, one at a time
+
+    Parameters
+    -----------
+    - workload: Workload building the requests
+    - name: path name from SUITE
+    - count: number of requests
+
+    Returns
+    -----------
+    Dictionary of metrics
+
+    """
+    app = workload.app
+    client = app.test_client()
+    samples = []
+    queries = 0
+
+    for _ in range(count):
+        method, path, data, cookie = workload.request(name)
+        if cookie is None:
+            client.delete_cookie("localhost", "session")
+        else:
+            client.set_cookie("localhost", "session", cookie)
+
+        before = executed(app)
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        samples.append(time.perf_counter() - started)
+        queries += executed(app) - before
+        assert response.status_code < 400, (path, response.status_code)
+
+    return summarize(samples, queries)
+
+
+def run_server(workload, name, count, address, concurrency):
+    """
+    Time requests of one path through a local WSGI server under concurrency
+
+    Parameters
+    -----------
+    - workload: Workload building the requests
+    - name: path name from SUITE
+    - count: number of requests
+    - address: (host, port) of the server
+    - concurrency: clients sending requests at the same time
+
+    Returns
+    -----------
+    Dictionary of metrics
+
+    """
+    samples = []
+    errors = []
+    sent = itertools.count()
+
+    def client_loop():
+        connection = http.client.HTTPConnection(*address)
+        while next(sent) < count:
+            method, path, data, cookie = workload.request(name)
+            headers = {} if cookie is None else {"Cookie": f"session={cookie}"}
+            body = None
+            if data is not None:
+                body = urlencode(data)
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+            started = time.perf_counter()
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            samples.append(time.perf_counter() - started)
+            if response.status >= 400:
+                errors.append((path, response.status))
+        connection.close()
+
+    before = executed(workload.app)
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    assert not errors, errors[:5]
+    return summarize(samples, executed(workload.app) - before, elapsed)
+
+
+def compare(baseline, results, tolerance):
+    """
+    Print the change of every metric against a saved baseline
+
+    Parameters
+    -----------
+    - baseline: results loaded from a baseline file
+    - results: results of this run
+    - tolerance: slowdown allowed before a percentile counts as a regression
+
+    Returns
+    -----------
+    List of regressed "path metric" names
+
+    """
+    regressions = []
+
+    for key in results:
+        if key not in baseline:
+            continue
+
+        for metric in METRICS + ("queries",):
+            old, new = baseline[key][metric], results[key][metric]
+            #cache hits make queries per request vary a little between runs
+            limit = old + 0.5 if metric == "queries" else old * (1 + tolerance)
+            regressed = new > limit
+            if regressed:
+                regressions.append(f"{key} {metric}")
+
+            change = (new - old) / old * 100 if old else 0.0
+            print(
+                f"{key:<24} {metric:<8} {old:10.2f} -> {new:10.2f} {change:+7.1f}%"
+                + ("  REGRESSION" if regressed else "")
+            )
+
+    return regressions
+
+
+def bench_suite(args):
+    """
+    Time the main request paths and save or compare a baseline
+
+    Every path runs through the Flask test client, which shows the cost of
+    the app alone, and through a threaded local WSGI server with concurrent
+    clients, which adds HTTP parsing and contention.
+
+    Parameters
+    -----------
+    args: parsed command line arguments
+
+    Returns
+    -----------
+    None
+
+    """
+    config = {"DATABASE": None, "RATELIMIT_ENABLED": False}
+    if args.hash_method:
+        config["PASSWORD_HASH_METHOD"] = args.hash_method
+
+    db_fd, config["DATABASE"] = tempfile.mkstemp()
+    try:
+        app = create_app(config)
+        with app.app_context():
+            populate(get_db(), args.users, args.cards)
+
+        workload = Workload(app, args.users, args.cards)
+        counts = {"register": args.logins, "login": args.logins}
+        results = {}
+
+        for name in SUITE:
+            results[f"client {name}"] = run_client(workload, name, counts.get(name, args.requests))
+
+        #the werkzeug server logs every request
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            for name in SUITE:
+                results[f"server {name}"] = run_server(
+                    workload, name, counts.get(name, args.requests),
+                    server.server_address, args.concurrency,
+                )
+        finally:
+            server.shutdown()
+
+        print(f"{'path':<24} {'n':>6} " + " ".join(f"{m:>9}" for m in METRICS) + "   queries      rps")
+        for key, result in results.items():
+            print(
+                f"{key:<24} {result['n']:>6} "
+                + " ".join(f"{result[m]:7.2f}ms" for m in METRICS)
+                + f" {result['queries']:9.1f}"
+                + (f" {result['rps']:8.1f}" if "rps" in result else "")
+            )
+
+        if args.save:
+            meta = {
+                "users": args.users,
+                "cards": args.cards,
+                "concurrency": args.concurrency,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "machine": platform.platform(),
+                "cpus": os.cpu_count(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            with open(args.save, "w") as f:
+                json.dump({"meta": meta, "results": results}, f, indent=2)
+            print(f"saved baseline to {args.save}")
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)["results"]
+            regressions = compare(baseline, results, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} regressions: " + ", ".join(regressions))
+                sys.exit(1)
+
+        close(app)
+    finally:
+        os.close(db_fd)
+        os.unlink(config["DATABASE"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="board page latency")
+    index.add_argument("--users", type=int, default=10000)
+    index.add_argument("--cards", type=int, default=1000)
+    index.add_argument("--requests", type=int, default=200)
+    index.add_argument(
+        "--legacy", type=int, default=0,
+        help="also time N runs of the old four-query index",
+    )
+    index.set_defaults(run=bench_index)
+
+    search = commands.add_parser("search", help="search latency on a shared index")
+    search.add_argument("--users", type=int, default=2000)
+    search.add_argument("--cards", type=int, default=200)
+    search.add_argument("--requests", type=int, default=200)
+    search.add_argument("--queries", nargs="+", default=["synthetic", "task 1"])
+    search.set_defaults(run=bench_search)
+
+    move = commands.add_parser("move", help="per-card versus batch moves")
+    move.add_argument("--cards", type=int, default=1000)
+    move.add_argument("--batch", type=int, default=20)
+    move.add_argument("--runs", type=int, default=30)
+    move.set_defaults(run=bench_move)
+
+    login = commands.add_parser("login", help="password hashing throughput")
+    login.add_argument("--clients", type=int, default=8)
+    login.add_argument("--logins", type=int, default=10)
+    login.add_argument(
+        "--workers", type=int, default=0,
+        help="hash worker processes, 0 hashes on the request threads",
+    )
+    login.set_defaults(run=bench_login)
+
+    startup = commands.add_parser("startup", help="cold start cost")
+    startup.add_argument("--users", type=int, default=1000)
+    startup.add_argument("--cards", type=int, default=100)
+    startup.add_argument("--runs", type=int, default=50)
+    startup.set_defaults(run=bench_startup)
+
+    bulk = commands.add_parser("import", help="bulk board import and export")
+    bulk.add_argument("--cards", type=int, default=1000000)
+    bulk.add_argument("--batch", type=int, default=10000)
+    bulk.set_defaults(run=bench_import)
+
+    writes = commands.add_parser("writes", help="per-request commits versus the write pipeline")
+    writes.add_argument("--clients", type=int, default=16)
+    writes.add_argument("--writes", type=int, default=50, help="writes per client")
+    writes.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous of both runs")
+    writes.set_defaults(run=bench_writes)
+
+    shards = commands.add_parser("shards", help="write throughput by number of shards")
+    shards.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4])
+    shards.add_argument("--processes", type=int, default=4)
+    shards.add_argument("--users", type=int, default=1000)
+    shards.add_argument("--writes", type=int, default=500, help="writes per process")
+    shards.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous of all runs")
+    shards.set_defaults(run=bench_shards)
+
+    fanout = commands.add_parser("fanout", help="event delivery to open streams")
+    fanout.add_argument("--listeners", type=int, default=1000)
+    fanout.add_argument("--events", type=int, default=100)
+    fanout.set_defaults(run=bench_fanout)
+
+    suite = commands.add_parser("suite", help="all request paths, with baselines")
+    suite.add_argument("--users", type=int, default=1000)
+    suite.add_argument("--cards", type=int, default=100)
+    suite.add_argument("--requests", type=int, default=200, help="requests per path")
+    suite.add_argument("--logins", type=int, default=20, help="registrations and logins")
+    suite.add_argument("--concurrency", type=int, default=8)
+    suite.add_argument("--hash-method", help="password hash method, the app's by default")
+    suite.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    suite.add_argument("--compare", metavar="FILE", help="compare against a JSON baseline")
+    suite.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="slowdown of a percentile counted as a regression, 0.2 is 20%%",
+    )
+    suite.set_defaults(run=bench_suite)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
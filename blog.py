@@ -1,14 +1,31 @@
+import json
+
 from flask import Blueprint
+from flask import Response
+from flask import current_app
 from flask import flash
 from flask import g
-from flask import redirect, session
+from flask import make_response
+from flask import redirect
 from flask import render_template
 from flask import request
+from flask import session
 from flask import url_for
 from werkzeug.exceptions import abort
+from werkzeug.http import is_resource_modified
 
+import queries
+from archive import find_archived, load_archive, restore_cards
 from auth import login_required
-from db import get_db
+from board import DOING, DONE, STATUS_NAMES, TODO
+from board import board_key, board_version, load_board, load_column
+from board import edit_post, insert_posts, place_post, remove_posts, set_status, spread_column
+from cache import get_cache
+from db import get_board_db, write_board
+from events import publish
+from flow import load_flow
+from ranks import MAX_LENGTH
+from search import search_posts
 
 bp = Blueprint("blog", __name__)
 
@@ -28,45 +45,217 @@ def index():
 
 
     """
-    db = get_db()
+    #anonymous visitors have no board yet
+    if g.user is None:
+        return redirect(url_for("auth.register"))
+
+    #the page only changes with the board's version and the page size
+    limit = page_size()
+    version = board_version(g.user["id"])
+    etag = f"{g.user['id']}-{version.version}-{limit}"
+
+    #pending flash messages are part of the page, so it must be rendered
+    flashes = "_flashes" in session
+
+    if not flashes and not is_resource_modified(
+        request.environ, etag=etag, last_modified=version.modified
+    ):
+        response = Response(status=304)
+    else:
+        cache = get_cache()
+        key = board_key(g.user["id"])
+        cached = None if flashes else cache.get(key)
+
+        #a cached page is only valid for the same version and page size
+        if cached is not None and cached[:2] == (version.version, limit):
+            page = cached[2]
+        else:
+            #most recent post goes first in every category
+            board = load_board(g.user["id"], limit)
+            page = render_template(
+                "blog/index.html",
+                posts_todo=board[TODO],
+                posts_doing=board[DOING],
+                posts_done=board[DONE],
+            )
+            if not flashes:
+                cache.set(key, (version.version, limit, page))
+
+        response = make_response(page)
+
+    #browsers keep the page but ask again before every use
+    response.set_etag(etag)
+    response.last_modified = version.modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route("/column/<status>")
+@login_required
+def column(status):
+    """
+    Display the next page of one Kanban category
+
+    Parameters
+    -----------
+    status: "todo", "doing" or "done"
+
+    Returns
+    -----------
+    Page with the posts that follow the cursor given in the query string
+
+    """
+    if status not in STATUS_NAMES:
+        abort(404)
+
+    page = next_page(STATUS_NAMES[status])
+    title = {"todo": "To Do", "doing": "Doing", "done": "Done"}[status]
+
+    return render_template("blog/column.html", status=status, title=title, page=page)
+
+
+@bp.route("/search")
+@login_required
+def search():
+    """
+    Search the current user's tasks by title and description
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Page with the best matches for the "q" query argument
+
+    """
+    text = request.args.get("q", "")
+    page = max(1, request.args.get("page", 1, type=int))
+    results = search_posts(g.user["id"], text, page)
 
+    return render_template("blog/search.html", q=text, page=page, results=results)
+
+
+@bp.route("/archive")
+@login_required
+def archive():
+    """
+    Browse the current user's archived tasks
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Page with the archived tasks after the "cursor" query argument, most
+    recently created first
+
+    """
     try:
-        #keeping current user's id to select their own posts
-        _id = session["user_id"]
-        
+        page = load_archive(g.user["id"], request.args.get("cursor"), page_size())
+    except ValueError:
+        abort(400, "A valid cursor is required.")
 
-        posts = db.execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            " ORDER BY created DESC"
-        ).fetchall()
-
-        #most recent post goes first
-        posts_todo = db.execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            f" WHERE p.status = 0 AND p.author_id = {_id}"
-            " ORDER BY created DESC"
-        ).fetchall()
-
-        posts_doing = db.execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            f" WHERE p.status = 1 AND p.author_id = {_id}"
-            " ORDER BY created DESC"
-        ).fetchall()
-
-        posts_done = db.execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            f" WHERE p.status = 2 AND p.author_id = {_id}"
-            " ORDER BY created DESC"
-        ).fetchall()
-        return render_template("blog/index.html", posts=posts, posts_todo=posts_todo, posts_doing=posts_doing, posts_done=posts_done)
-    except:
-        return redirect(url_for("auth.register"))
+    return render_template("blog/archive.html", page=page)
 
-    
+
+@bp.route("/flow")
+@login_required
+def flow():
+    """
+    Cumulative flow, throughput and cycle time of the current user's board
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Page with one row per day of the "days" query argument, newest first
+
+    """
+    return render_template("blog/flow.html", flow=load_flow(g.user["id"], flow_days()))
+
+
+@bp.route("/archive/<int:id>/restore", methods=("POST",))
+@login_required
+def restore(id):
+    """
+    Move an archived task back to the Done category
+
+    Parameters
+    -----------
+    id: archived post's id
+
+    Returns
+    -----------
+    Archive page without the restored task
+
+    """
+    if id not in find_archived(g.user["id"], [id]):
+        abort(404, f"Archived post id {id} doesn't exist.")
+
+    restore_cards(g.user["id"], [id])
+    return redirect(url_for("blog.archive"))
+
+
+def page_size():
+    """
+    Number of posts to show per category
+
+    Uses the "limit" query argument when given, capped by BOARD_MAX_PAGE_SIZE.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Page size
+
+    """
+    limit = request.args.get("limit", current_app.config["BOARD_PAGE_SIZE"], type=int)
+    return max(1, min(limit, current_app.config["BOARD_MAX_PAGE_SIZE"]))
+
+
+def flow_days():
+    """
+    Number of days of flow analytics to show
+
+    Uses the "days" query argument when given, capped by FLOW_MAX_DAYS.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Number of days
+
+    """
+    days = request.args.get("days", current_app.config["FLOW_DAYS"], type=int)
+    return max(1, min(days, current_app.config["FLOW_MAX_DAYS"]))
+
+
+def next_page(status):
+    """
+    Load the page of a category that follows the requested cursor
+
+    Parameters
+    -----------
+    status: category to page through
+
+    Returns
+    -----------
+    Page of the current user's posts
+
+    """
+    try:
+        return load_column(g.user["id"], status, request.args["cursor"], page_size())
+    except (KeyError, ValueError):
+        abort(400, "A valid cursor is required.")
 
 
 def get_post(id, check_author=True):
@@ -84,16 +273,7 @@ def get_post(id, check_author=True):
     post with given id
 
     """
-    post = (
-        get_db()
-        .execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            " WHERE p.id = ?",
-            (id,),
-        )
-        .fetchone()
-    )
+    post = get_board_db(g.user["id"]).execute(queries.POST_GET, (id,)).fetchone()
     #raise errors when no post or incorrect author
     if post is None:
         abort(404, f"Post id {id} doesn't exist.")
@@ -104,6 +284,100 @@ def get_post(id, check_author=True):
     return post
 
 
+def get_posts(ids):
+    """
+    Get several posts of the current user with one query
+
+    Parameters
+    -----------
+    ids: list of post ids
+
+    Returns
+    -----------
+    List of posts in the order of ids
+
+    """
+    rows = get_board_db(g.user["id"]).execute(
+        queries.POSTS_GET, (json.dumps(ids),)
+    ).fetchall()
+    posts = {row["id"]: row for row in rows}
+
+    #same errors as get_post, for the first id that fails
+    for id in ids:
+        if id not in posts:
+            abort(404, f"Post id {id} doesn't exist.")
+
+        if posts[id]["author_id"] != g.user["id"]:
+            abort(403)
+
+    return [posts[id] for id in ids]
+
+
+def move_posts(ids, status):
+    """
+    Move posts of the current user to another Kanban category
+
+    Ownership of all posts is checked before anything changes and every
+    post is updated in a single transaction.
+
+    Parameters
+    -----------
+    - ids: list of post ids
+    - status: new category, one of TODO, DOING or DONE
+
+    Returns
+    -----------
+    List of moved post ids
+
+    """
+    #moving the same card twice is one move
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        #nothing to write, the cached board stays valid
+        return ids
+    get_posts(ids)
+
+    write_board(set_status, g.user["id"], ids, status)
+    publish(g.user["id"], "moved", ids, status)
+
+    return ids
+
+
+def position_post(id, status, above=None, below=None):
+    """
+    Move a post of the current user to a position in a category
+
+    Only the post's row is written. Once its rank gets too long the
+    category is spread again in a second write, so later moves stay short.
+
+    Parameters
+    -----------
+    - id: post id
+    - status: category, the post's own or another one
+    - above: id of the post to show right above it, or None
+    - below: id of the post to show right below it, or None, without
+      either the post goes on top
+
+    Returns
+    -----------
+    The post's new rank
+
+    """
+    anchors = [anchor for anchor in (above, below) if anchor is not None]
+    for anchor in get_posts([id] + anchors)[1:]:
+        if anchor["status"] != status:
+            abort(400, f"Post id {anchor['id']} is in another category.")
+
+    rank = write_board(place_post, g.user["id"], id, status, above, below)
+    publish(g.user["id"], "moved", [id], status)
+
+    if len(rank) > MAX_LENGTH:
+        write_board(spread_column, g.user["id"], status)
+        #every card of the category got a new rank
+        publish(g.user["id"], "resync", [])
+
+    return rank
+
 
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
@@ -134,12 +408,8 @@ def create():
 
         #insering new post into database
         else:
-            db = get_db()
-            db.execute(
-                "INSERT INTO post (title, body, status, author_id) VALUES (?, ?, ?, ?)",
-                (title, body, status, g.user["id"]),
-            )
-            db.commit()
+            ids = write_board(insert_posts, g.user["id"], [(title, body, status)])
+            publish(g.user["id"], "created", ids)
             return redirect(url_for("blog.index"))
 
     return render_template("blog/create.html")
@@ -175,15 +445,63 @@ def update(id):
         
         #updating post details in database
         else:
-            db = get_db()
-            db.execute(
-                "UPDATE post SET title = ?, body = ? WHERE id = ?", (title, body, id)
-            )
-            db.commit()
+            write_board(edit_post, g.user["id"], id, title, body)
+            publish(g.user["id"], "updated", [id])
             return redirect(url_for("blog.index"))
 
     return render_template("blog/update.html", post=post)
 
+@bp.route("/move", methods=("POST",))
+@login_required
+def move():
+    """
+    Move any number of posts to one category in a single request
+
+    Accepts a JSON body {"ids": [...], "status": "doing"} or form fields
+    with repeated "id" values and a "status".
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    - JSON with the new status and moved ids for JSON requests
+    - Otherwise redirects to Index page
+
+    """
+    if request.is_json:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            abort(400, "Expected a JSON object.")
+        ids = data.get("ids")
+        status = data.get("status")
+        #a string would be read as a list of digits
+        if not isinstance(ids, list) or not all(type(id) is int for id in ids):
+            abort(400, "Expected a list of integer ids.")
+    else:
+        ids = request.form.getlist("id")
+        status = request.form.get("status")
+
+    if not isinstance(status, str) or status not in STATUS_NAMES:
+        abort(400, f"Unknown status {status!r}.")
+
+    try:
+        ids = [int(id) for id in ids]
+    except ValueError:
+        abort(400, "Post ids must be integers.")
+
+    if not ids:
+        abort(400, "At least one post id is required.")
+
+    moved = move_posts(ids, STATUS_NAMES[status])
+
+    if request.is_json:
+        return {"status": status, "moved": moved}
+
+    return redirect(url_for("blog.index"))
+
+
 @bp.route("/<int:id>/move_doing", methods=("POST",))
 @login_required
 def move_doing(id):
@@ -199,23 +517,8 @@ def move_doing(id):
     Index Kanban page with a post moved to Doing category
 
     """
-    post = get_post(id)
-    status = 1
-    error = None
-
-    if error is not None:
-        flash(error)
-    
-    #update status in the database
-    else:
-        db = get_db()
-        db.execute(
-            "UPDATE post SET status = ? WHERE id = ?", (status, id)
-        )
-        db.commit()
-        return redirect(url_for("blog.index"))
-
-    return render_template("blog/index.html", post=post)
+    move_posts([id], DOING)
+    return redirect(url_for("blog.index"))
 
 
 @bp.route("/<int:id>/move_done", methods=("POST",))
@@ -233,23 +536,8 @@ def move_done(id):
     Index Kanban page with a post moved to Done category
 
     """
-    post = get_post(id)
-    status = 2
-    error = None
-
-    if error is not None:
-        flash(error)
-
-    #update status in the database
-    else:
-        db = get_db()
-        db.execute(
-            "UPDATE post SET status = ? WHERE id = ?", (status, id)
-        )
-        db.commit()
-        return redirect(url_for("blog.index"))
-
-    return render_template("blog/index.html", post=post)
+    move_posts([id], DONE)
+    return redirect(url_for("blog.index"))
 
 @bp.route("/<int:id>/move_todo", methods=("POST",))
 @login_required
@@ -266,23 +554,39 @@ def move_todo(id):
     Index Kanban page with a post moved to To Do category
 
     """
-    post = get_post(id)
-    status = 0
-    error = None
+    move_posts([id], TODO)
+    return redirect(url_for("blog.index"))
 
-    if error is not None:
-        flash(error)
-    
-    #updates status in the database
-    else:
-        db = get_db()
-        db.execute(
-            "UPDATE post SET status = ? WHERE id = ?", (status, id)
-        )
-        db.commit()
-        return redirect(url_for("blog.index"))
 
-    return render_template("blog/index.html", post=post)
+@bp.route("/<int:id>/position", methods=("POST",))
+@login_required
+def position(id):
+    """
+    Move a post to a position in a category, next to another post
+
+    Form fields are "status", the category, and "above" or "below", the id
+    of the post to show right above or below it.
+
+    Parameters
+    -----------
+    id: post's unique id
+
+    Returns
+    -----------
+    Index Kanban page with the post at its new position
+
+    """
+    status = STATUS_NAMES.get(request.form.get("status"))
+    if status is None:
+        abort(400, "A valid status is required.")
+
+    #a malformed neighbour would put the post at the top instead
+    anchors = [request.form.get(name) for name in ("above", "below")]
+    if any(anchor is not None and not anchor.isdecimal() for anchor in anchors):
+        abort(400, "Neighbours must be post ids.")
+
+    position_post(id, status, *(None if anchor is None else int(anchor) for anchor in anchors))
+    return redirect(url_for("blog.index"))
 
 
 @bp.route("/<int:id>/delete", methods=("POST",))
@@ -301,9 +605,8 @@ def delete(id):
 
     """
     get_post(id)
-    db = get_db()
 
     #deletes post from database
-    db.execute("DELETE FROM post WHERE id = ?", (id,))
-    db.commit()
+    write_board(remove_posts, g.user["id"], [id])
+    publish(g.user["id"], "deleted", [id])
     return redirect(url_for("blog.index"))
@@ -0,0 +1,564 @@
+import json
+from collections import namedtuple
+
+import click
+
+import queries
+from cache import get_cache
+from db import board_databases, get_board_db, get_db, write_board
+from ranks import MAX_LENGTH, rank_between, spread
+
+#kanban categories in the order they are shown on the board
+TODO = 0
+DOING = 1
+DONE = 2
+STATUSES = (TODO, DOING, DONE)
+
+#names used by forms and JSON requests
+STATUS_NAMES = {"todo": TODO, "doing": DOING, "done": DONE}
+
+#status numbers back to their names
+STATUS_LABELS = {status: name for name, status in STATUS_NAMES.items()}
+
+#posts of one column and the cursor of the next page, None on the last page
+Page = namedtuple("Page", ["posts", "cursor"])
+
+#version of a board and when it last changed, None for untouched boards
+Version = namedtuple("Version", ["version", "modified"])
+
+
+def card_json(post):
+    """
+    Convert a post row into its JSON representation
+
+    Parameters
+    -----------
+    post: post row
+
+    Returns
+    -----------
+    Dictionary with the card's fields
+
+    """
+    return {
+        "id": post["id"],
+        "title": post["title"],
+        "body": post["body"],
+        "status": STATUS_LABELS[post["status"]],
+        "created": post["created"].isoformat(),
+        "rank": post["rank"],
+    }
+
+
+def encode_cursor(post, key="rank"):
+    """
+    Cursor pointing right after a post in its column
+
+    Parameters
+    -----------
+    - post: last post of a page
+    - key: column the page is ordered by before the id
+
+    Returns
+    -----------
+    Opaque cursor string
+
+    """
+    return f"{post[key]},{post['id']}"
+
+
+def decode_cursor(cursor):
+    """
+    Read the position stored in a cursor
+
+    Parameters
+    -----------
+    cursor: string made by encode_cursor
+
+    Returns
+    -----------
+    (key, id) tuple, raises ValueError for malformed cursors
+
+    """
+    #ranks of cards added before ranks existed are empty
+    key, separator, id = cursor.rpartition(",")
+    if not separator:
+        raise ValueError(f"Malformed cursor {cursor!r}.")
+
+    return key, int(id)
+
+
+def make_page(rows, limit, key="rank"):
+    """
+    Turn rows fetched with one extra row into a page
+
+    Parameters
+    -----------
+    - rows: up to limit + 1 posts
+    - limit: page size
+    - key: column the rows are ordered by before the id
+
+    Returns
+    -----------
+    Page with at most limit posts
+
+    """
+    if len(rows) > limit:
+        return Page(rows[:limit], encode_cursor(rows[limit - 1], key))
+
+    return Page(rows, None)
+
+
+def load_board(author_id, limit):
+    """
+    Load the first page of every Kanban category of a single user
+
+    All three columns are read with one statement made of three index range
+    scans, so the cost depends on the page size and not on the number of
+    posts on the board or in the whole database.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - limit: number of posts shown per category
+
+    Returns
+    -----------
+    Dictionary mapping each status to its first Page, highest ranked first
+
+    """
+    #one extra row per column tells whether a next page exists
+    rows = get_board_db(author_id).execute(
+        queries.BOARD_PAGE, (author_id, limit + 1)
+    ).fetchall()
+
+    columns = {status: [] for status in STATUSES}
+    for row in rows:
+        columns[row["status"]].append(row)
+
+    return {status: make_page(posts, limit) for status, posts in columns.items()}
+
+
+def load_column(author_id, status, cursor, limit):
+    """
+    Load the next page of one Kanban category
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - status: category to page through
+    - cursor: cursor of the previous page
+    - limit: number of posts to return
+
+    Returns
+    -----------
+    Page of posts ranked below the cursor
+
+    """
+    rank, id = decode_cursor(cursor)
+    rows = get_board_db(author_id).execute(
+        queries.COLUMN_PAGE, (author_id, status, rank, id, limit + 1)
+    ).fetchall()
+
+    return make_page(rows, limit)
+
+
+def board_key(author_id):
+    """
+    Cache key of a user's rendered board
+
+    Parameters
+    -----------
+    author_id: id of the board's owner
+
+    Returns
+    -----------
+    Cache key string
+
+    """
+    return f"board:{author_id}"
+
+
+def board_version(author_id):
+    """
+    Current version of a user's board
+
+    Parameters
+    -----------
+    author_id: id of the board's owner
+
+    Returns
+    -----------
+    Version, starting at 0 for boards that never changed
+
+    """
+    row = get_board_db(author_id).execute(queries.BOARD_VERSION, (author_id,)).fetchone()
+    if row is None:
+        return Version(0, None)
+
+    return Version(row["version"], row["modified"])
+
+
+def touch_board(author_id):
+    """
+    Bump the version of a user's board and drop its cached page
+
+    Call it in the same transaction as the change, before committing.
+
+    Parameters
+    -----------
+    author_id: id of the board's owner
+
+    Returns
+    -----------
+    None
+
+    """
+    get_board_db(author_id).execute(queries.BOARD_TOUCH, (author_id,))
+    get_cache().delete(board_key(author_id))
+
+
+def top_rank(author_id, status, exclude=None):
+    """
+    Rank of the first card of a column
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - status: category
+    - exclude: id of a post to ignore, usually the one being moved
+
+    Returns
+    -----------
+    Rank, None for empty columns
+
+    """
+    row = get_board_db(author_id).execute(
+        queries.COLUMN_TOP, (author_id, status, exclude)
+    ).fetchone()
+    return row["rank"] if row else None
+
+
+def bottom_rank(author_id, status):
+    """
+    Rank of the last card of a column
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - status: category
+
+    Returns
+    -----------
+    Rank, None for empty columns
+
+    """
+    row = get_board_db(author_id).execute(
+        queries.COLUMN_BOTTOM, (author_id, status)
+    ).fetchone()
+    return row["rank"] if row else None
+
+
+def top_ranks(author_id, ids, status):
+    """
+    Ranks putting posts at the top of a column, in the order of ids
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of post ids
+    - status: category the posts move to
+
+    Returns
+    -----------
+    JSON array of [id, rank] pairs for POSTS_MOVE
+
+    """
+    rank = top_rank(author_id, status)
+    pairs = []
+    for id in reversed(ids):
+        rank = rank_between(rank, None)
+        pairs.append([id, rank])
+
+    return json.dumps(pairs)
+
+
+def count_flow(author_id, transitions):
+    """
+    Add logged transitions to the board's flow of today
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - transitions: rows with from_status, to_status and cycle
+
+    Returns
+    -----------
+    None
+
+    """
+    if not transitions:
+        return
+
+    columns = dict.fromkeys(STATUSES, 0)
+    created = completed = cycle = 0
+    for transition in transitions:
+        if transition["from_status"] is None:
+            created += 1
+        else:
+            columns[transition["from_status"]] -= 1
+        if transition["to_status"] is not None:
+            columns[transition["to_status"]] += 1
+        if transition["cycle"] is not None:
+            completed += 1
+            cycle += transition["cycle"]
+
+    get_board_db(author_id).execute(
+        queries.FLOW_COUNT,
+        (author_id, columns[TODO], columns[DOING], columns[DONE], created, completed, cycle),
+    )
+
+
+def log_moves(author_id, ids, status):
+    """
+    Log posts leaving their status, before the move is written
+
+    Posts already in status are left out.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of post ids
+    - status: new category, None for deleted posts
+
+    Returns
+    -----------
+    None
+
+    """
+    transitions = get_board_db(author_id).execute(
+        queries.TRANSITIONS_LOG, (author_id, json.dumps(ids), status)
+    ).fetchall()
+    count_flow(author_id, transitions)
+
+
+#writes of a board, run through db.write so they are committed together
+#with the board's new version and its status history
+def insert_posts(author_id, posts):
+    """
+    Create posts on a user's board
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - posts: list of (title, body, status) tuples
+
+    Returns
+    -----------
+    List of the new post ids, each on top of its column
+
+    """
+    db = get_board_db(author_id)
+    ranks = {}
+    ids = []
+
+    for title, body, status in posts:
+        if status not in ranks:
+            ranks[status] = top_rank(author_id, status)
+        ranks[status] = rank_between(ranks[status], None)
+        ids.append(
+            db.execute(
+                queries.POST_CREATE, (title, body, status, author_id, ranks[status])
+            ).lastrowid
+        )
+
+    count_flow(
+        author_id,
+        db.execute(queries.TRANSITIONS_CREATED, (author_id, json.dumps(ids))).fetchall(),
+    )
+    touch_board(author_id)
+    return ids
+
+
+def edit_post(author_id, id, title, body, status=None):
+    """
+    Change the title and body of a post, and its status when given
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - id: post id
+    - title: new title
+    - body: new body
+    - status: new category, unchanged when None, the post goes on top
+
+    Returns
+    -----------
+    None
+
+    """
+    db = get_board_db(author_id)
+    db.execute(queries.POST_UPDATE, (title, body, id))
+    if status is not None:
+        log_moves(author_id, [id], status)
+        db.execute(queries.POSTS_MOVE, (status, top_ranks(author_id, [id], status)))
+    touch_board(author_id)
+
+
+def set_status(author_id, ids, status):
+    """
+    Move posts of a user's board to the top of another category
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of post ids, the first one ends up on top
+    - status: new category
+
+    Returns
+    -----------
+    None
+
+    """
+    log_moves(author_id, ids, status)
+    get_board_db(author_id).execute(
+        queries.POSTS_MOVE, (status, top_ranks(author_id, ids, status))
+    )
+    touch_board(author_id)
+
+
+def place_post(author_id, id, status, above=None, below=None):
+    """
+    Move a post to a position in a column, writing only its row
+
+    The position is given by the card to show right above the post or
+    right below it, the other neighbour is looked up. Without either the
+    post goes on top of the column. A column without room between the
+    neighbours is spread first.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - id: post id
+    - status: category, the post's own or another one
+    - above: id of a post of the column, or None
+    - below: id of a post of the column, or None
+
+    Returns
+    -----------
+    The post's new rank
+
+    """
+    db = get_board_db(author_id)
+
+    def neighbour(sql, anchor):
+        row = db.execute(queries.POST_GET, (anchor,)).fetchone()
+        other = db.execute(
+            sql, (author_id, status, row["rank"], anchor, id)
+        ).fetchone()
+        return row["rank"], other["rank"] if other else None
+
+    if above is not None:
+        high, low = neighbour(queries.RANK_BELOW, above)
+    elif below is not None:
+        low, high = neighbour(queries.RANK_ABOVE, below)
+    else:
+        low, high = top_rank(author_id, status, exclude=id), None
+
+    try:
+        rank = rank_between(low, high)
+    except ValueError:
+        #equal or exhausted neighbours, only happens once per spread
+        spread_column(author_id, status)
+        return place_post(author_id, id, status, above, below)
+
+    log_moves(author_id, [id], status)
+    db.execute(queries.POST_PLACE, (id, status, rank))
+    touch_board(author_id)
+    return rank
+
+
+def spread_column(author_id, status):
+    """
+    Give the cards of a column evenly spaced ranks, keeping their order
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - status: category
+
+    Returns
+    -----------
+    None
+
+    """
+    db = get_board_db(author_id)
+    ids = [row["id"] for row in db.execute(queries.COLUMN_IDS, (author_id, status))]
+    db.executemany(queries.POST_SET_RANK, zip(spread(len(ids)), ids))
+    touch_board(author_id)
+
+
+def rebalance_ranks(length=MAX_LENGTH):
+    """
+    Spread every column holding a rank longer than length
+
+    Each column is spread in its own write.
+
+    Parameters
+    -----------
+    length: longest rank left as it is
+
+    Returns
+    -----------
+    Number of spread columns
+
+    """
+    columns = []
+    for shard in board_databases():
+        columns += get_db(shard).execute(queries.RANKS_TOO_LONG, (length,)).fetchall()
+
+    for author_id, status in columns:
+        write_board(spread_column, author_id, status)
+
+    return len(columns)
+
+
+def remove_posts(author_id, ids):
+    """
+    Delete posts of a user's board
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - ids: list of post ids
+
+    Returns
+    -----------
+    None
+
+    """
+    log_moves(author_id, ids, None)
+    get_board_db(author_id).execute(queries.POSTS_DELETE, (json.dumps(ids),))
+    touch_board(author_id)
+
+
+@click.command("rebalance-ranks")
+@click.option("--length", type=int, default=MAX_LENGTH, help="Longest rank left as it is.")
+def rebalance_ranks_command(length):
+    """
+    Give columns with long ranks evenly spaced ones again
+
+    Parameters
+    -----------
+    length: longest rank left as it is
+
+    Returns
+    -----------
+    None
+
+    """
+    click.echo(f"Rebalanced {rebalance_ranks(length)} columns.")
+
+
+def init_app(app):
+    app.cli.add_command(rebalance_ranks_command)
@@ -0,0 +1,305 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with a time to live
+
+    Parameters
+    -----------
+    - maxsize: number of entries kept before the least recently used goes
+    - ttl: seconds an entry stays valid
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a value
+
+        Parameters
+        -----------
+        key: cache key
+
+        Returns
+        -----------
+        Cached value, None when missing or expired
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entries when full
+
+        Parameters
+        -----------
+        - key: cache key
+        - value: value to store
+
+        Returns
+        -----------
+        None
+
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Drop a value
+
+        Parameters
+        -----------
+        key: cache key
+
+        Returns
+        -----------
+        None
+
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Usage counters of the cache
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Dictionary with size, hits, misses and evictions
+
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class FileCache:
+    """
+    Cache stored as files in a local directory, shared by worker processes
+
+    Entries are written atomically and expire by modification time. Every
+    evict_every writes of a process the directory is counted, and once it
+    holds more than maxsize entries the oldest ones are removed, so it can
+    briefly grow by evict_every entries per worker. Counters are kept per
+    process.
+
+    Parameters
+    -----------
+    - directory: folder holding the entries
+    - maxsize: number of entries kept
+    - ttl: seconds an entry stays valid
+    - evict_every: writes between checks of the size, a sixteenth of
+      maxsize when None
+
+    """
+
+    def __init__(self, directory, maxsize=1024, ttl=300, evict_every=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evict_every = evict_every or max(1, maxsize // 16)
+        self._sets = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        name = hashlib.sha1(key.encode("utf8")).hexdigest()
+        return os.path.join(self.directory, name + ".cache")
+
+    def get(self, key):
+        path = self.path(key)
+
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.unlink(path)
+                raise FileNotFoundError(path)
+
+            with open(path, "rb") as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        #a different key with the same hash counts as a miss
+        if stored_key != key:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        #write to a temporary file first so readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        self._sets += 1
+        if self._sets % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the oldest entries while the directory is over maxsize
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None
+
+        """
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".cache")]
+        if len(entries) <= self.maxsize:
+            return
+
+        #other workers may remove or replace entries while this one looks
+        modified = []
+        for entry in entries:
+            try:
+                modified.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+
+        modified.sort()
+        for _, path in modified[: len(modified) - self.maxsize]:
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".cache"):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        return {
+            "size": sum(1 for e in os.scandir(self.directory) if e.name.endswith(".cache")),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class NullCache:
+    """
+    Cache that stores nothing, used when CACHE_TYPE is None
+
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"size": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_cache():
+    """
+    Cache of the current application
+
+    CACHE_TYPE selects the backend: "memory" for one process, "file" to share
+    entries between the workers of one machine, or None to disable caching.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Cache object with get, set, delete, clear and stats methods
+
+    """
+    cache = current_app.extensions.get("cache")
+
+    if cache is None:
+        config = current_app.config
+        kind = config["CACHE_TYPE"]
+
+        if kind == "memory":
+            cache = MemoryCache(config["CACHE_MAXSIZE"], config["CACHE_TTL"])
+        elif kind == "file":
+            directory = config["CACHE_DIR"] or os.path.join(current_app.instance_path, "cache")
+            cache = FileCache(directory, config["CACHE_MAXSIZE"], config["CACHE_TTL"])
+        elif kind is None:
+            cache = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_TYPE {kind!r}.")
+
+        current_app.extensions["cache"] = cache
+
+    return cache
@@ -1,34 +1,1039 @@
+import asyncio
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 from flask import current_app
 from flask import g
 
+#folder with versioned schema changes, relative to the app root
+MIGRATIONS_FOLDER = "migrations"
+
+#seconds a worker waits for another one to finish migrating a database
+MIGRATION_WAIT = 600
+
+#post ids of shard n start at (n + 1) << SHARD_ID_BITS, below is the range of
+#the directory database, so ids stay unique when boards move between shards
+SHARD_ID_BITS = 40
+
+#applied once to every new connection, override with DATABASE_PRAGMAS
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,
+}
+
+
+#words as the unicode61 tokenizer of the search index splits them
+SEARCH_WORD = re.compile(r"[^\W_]+")
+
+
+def search_terms(author_id, text):
+    """
+    Words of a text as terms of one board in the search index
+
+    Every term starts with the id of the board's owner, so a search reads
+    only the index entries of one board, however many boards share the
+    index. Registered as an SQL function on every connection for the
+    triggers of post_fts.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - text: title or body of a post, or search box input
+
+    Returns
+    -----------
+    Space separated terms
+
+    """
+    return " ".join(f"u{author_id}x{word}" for word in SEARCH_WORD.findall(text or ""))
+
+
+def register_functions(db):
+    """
+    Add the SQL functions the schema's triggers call to a connection
+
+    The triggers of post_fts call search_terms, so on a connection without
+    it every insert, delete or edit of a post fails with "no such function:
+    search_terms" and is rolled back, leaving post and the index as they
+    were. Tools writing to a database outside the app, like repair scripts,
+    must call this on their connection first.
+
+    Parameters
+    -----------
+    db: sqlite3 connection
+
+    Returns
+    -----------
+    None
+
+    """
+    db.create_function("search_terms", 2, search_terms, deterministic=True)
+
+
+class StatementCache:
+    """
+    Mirrors the prepared statement cache of one connection to count hits
+
+    sqlite3 keeps the most recently used statements of a connection in an
+    LRU cache keyed by SQL text. This keeps the same LRU over the SQL text
+    alone, so it knows when a statement is reused instead of parsed again.
+
+    Parameters
+    -----------
+    size: number of statements the connection caches
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+
+    def touch(self, sql):
+        """
+        Record that a statement is executed
+
+        Parameters
+        -----------
+        sql: statement text
+
+        Returns
+        -----------
+        None
+
+        """
+        if sql in self._statements:
+            self._statements.move_to_end(sql)
+            self.hits += 1
+            return
+
+        self.misses += 1
+        self._statements[sql] = None
+        if len(self._statements) > self.size:
+            self._statements.popitem(last=False)
+
+
+class QueryRecord:
+    """
+    One statement run while a QueryLog was attached
+
+    Parameters
+    -----------
+    sql: statement text
+
+    """
+
+    __slots__ = ("sql", "seconds", "rows")
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class QueryLog:
+    """
+    Statements run on a connection, with their durations and row counts
+
+    Row counts are the rows changed by a statement or, for queries, the
+    rows read with fetchone, fetchmany or fetchall. Time spent fetching is
+    added to the statement.
+
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def run(self, cursor, method, sql, parameters):
+        """
+        Run a statement on a recording cursor
+
+        Parameters
+        -----------
+        - cursor: RecordingCursor of the connection
+        - method: "execute" or "executemany"
+        - sql: statement text
+        - parameters: bound parameters
+
+        Returns
+        -----------
+        The cursor
+
+        """
+        record = QueryRecord(sql)
+        cursor.record = record
+        self.records.append(record)
+
+        started = time.perf_counter()
+        try:
+            getattr(cursor, method)(sql, parameters)
+        finally:
+            record.seconds = time.perf_counter() - started
+
+        if cursor.rowcount > 0:
+            record.rows = cursor.rowcount
+
+        return cursor
+
+    @property
+    def seconds(self):
+        return sum(record.seconds for record in self.records)
+
+
+class RecordingCursor(sqlite3.Cursor):
+    """
+    Cursor adding the rows it returns to its statement's QueryRecord
+
+    """
+
+    record = None
+
+    def fetch(self, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        self.record.seconds += time.perf_counter() - started
+        return rows
+
+    def fetchone(self):
+        row = self.fetch(super().fetchone)
+        self.record.rows += row is not None
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.fetch(super().fetchmany, size or self.arraysize)
+        self.record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.fetch(super().fetchall)
+        self.record.rows += len(rows)
+        return rows
+
+    def __next__(self):
+        #rows read by iterating the cursor, StopIteration ends the loop
+        row = self.fetch(super().__next__)
+        self.record.rows += 1
+        return row
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection that counts reuse of its prepared statements
+
+    With a QueryLog attached as `log`, every statement is also timed and
+    recorded. Without one the only cost is checking the attribute.
+
+    """
+
+    log = None
+
+    def __init__(self, *args, cached_statements=128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.statements = StatementCache(cached_statements)
+
+    def execute(self, sql, parameters=()):
+        self.statements.touch(sql)
+        if self.log is None:
+            return super().execute(sql, parameters)
+
+        return self.log.run(self.cursor(RecordingCursor), "execute", sql, parameters)
+
+    def executemany(self, sql, parameters):
+        self.statements.touch(sql)
+        if self.log is None:
+            return super().executemany(sql, parameters)
+
+        return self.log.run(self.cursor(RecordingCursor), "executemany", sql, parameters)
+
+
+class ConnectionPool:
+    """
+    Keeps tuned database connections open between application contexts
+
+    At most `size` connections exist at once. Idle connections are reused,
+    new ones are opened while the pool is below its size and callers wait
+    for a released connection once it is full.
+
+    Parameters
+    -----------
+    - database: path of the SQLite file
+    - size: maximum number of open connections
+    - timeout: seconds to wait for a free connection
+    - pragmas: PRAGMA settings applied to each new connection
+    - statements: prepared statements cached by each connection
+
+    """
+
+    def __init__(
+        self, database, size=8, timeout=30.0, pragmas=PRAGMAS, statements=128
+    ):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.statements = statements
+        self.connections = []
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open a new connection and tune it
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Connection returning rows as sqlite3.Row
+
+        """
+        db = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=Connection,
+            cached_statements=self.statements,
+        )
+        db.row_factory = sqlite3.Row
+        register_functions(db)
+
+        deadline = time.monotonic() + self.timeout
+        for name, value in self.pragmas.items():
+            while True:
+                try:
+                    db.execute(f"PRAGMA {name} = {value}")
+                    break
+                except sqlite3.OperationalError as e:
+                    #switching to WAL does not wait for workers setting up the database
+                    if "locked" not in str(e) or time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.01)
+
+        with self._lock:
+            self.connections.append(db)
+
+        return db
+
+    def acquire(self):
+        """
+        Take a connection from the pool, opening one when none is idle
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        sqlite3 connection
+
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError("database connection pool exhausted")
+
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.misses += 1
+            try:
+                return self.connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+        with self._lock:
+            self.hits += 1
+        return db
+
+    def release(self, db):
+        """
+        Give a connection back to the pool
+
+        Parameters
+        -----------
+        db: connection returned by acquire
+
+        Returns
+        -----------
+        None
+
+        """
+        #never hand out a connection in the middle of a transaction
+        if db.in_transaction:
+            db.rollback()
+
+        self._idle.put(db)
+        self._slots.release()
+
+    def close(self):
+        """
+        Close all idle connections
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None
+
+        """
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            with self._lock:
+                self.connections.remove(db)
+            db.close()
+
+    def stats(self):
+        """
+        Usage counters of the pool
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Dictionary with connection and prepared statement counters
+
+        """
+        with self._lock:
+            statement_hits = sum(db.statements.hits for db in self.connections)
+            statement_misses = sum(db.statements.misses for db in self.connections)
+
+        executed = statement_hits + statement_misses
+        return {
+            "size": self.size,
+            "open": len(self.connections),
+            "idle": self._idle.qsize(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "statement_hits": statement_hits,
+            "statement_misses": statement_misses,
+            "statement_hit_rate": statement_hits / executed if executed else 0.0,
+        }
+
+
+def shard_index(author_id, shards):
+    """
+    Shard holding a user's board
+
+    Uses jump consistent hashing, so the result never changes between
+    processes or releases and growing from n to n + 1 shards only moves
+    the boards of one user in n + 1.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - shards: number of shards, at least 1
+
+    Returns
+    -----------
+    Shard number from 0 to shards - 1
+
+    """
+    key = author_id & 0xFFFFFFFFFFFFFFFF
+    index, jump = -1, 0
+
+    while jump < shards:
+        index = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((index + 1) * ((1 << 31) / ((key >> 33) + 1)))
+
+    return index
+
+
+def board_shard(author_id):
+    """
+    Database holding a user's board with the configured DATABASE_SHARDS
+
+    Parameters
+    -----------
+    author_id: id of the board's owner
+
+    Returns
+    -----------
+    Shard number, None when boards are kept in the directory database
+
+    """
+    shards = current_app.config["DATABASE_SHARDS"]
+    return shard_index(author_id, shards) if shards else None
+
+
+def shard_path(shard):
+    """
+    File of a database
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    Path of the SQLite file
+
+    """
+    database = current_app.config["DATABASE"]
+    if shard is None:
+        return database
+
+    pattern = current_app.config["DATABASE_SHARD_PATH"]
+    if pattern is None:
+        root, extension = os.path.splitext(database)
+        return f"{root}-shard{shard}{extension}"
+
+    return pattern.format(database=database, shard=shard)
+
+
+def shard_id_start(shard):
+    """
+    Start of the range new post ids of a database are taken from
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    Largest id below the range
+
+    """
+    return 0 if shard is None else (shard + 1) << SHARD_ID_BITS
+
+
+def shard_id_end(shard):
+    """
+    End of the range new post ids of a database are taken from
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    First id above the range
+
+    """
+    return shard_id_start(shard) + (1 << SHARD_ID_BITS)
+
+
+def get_pool(shard=None):
+    """
+    Connection pool of the current application
+
+    The pool is created on first use and again after a fork, since SQLite
+    connections must not be shared between processes.
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    ConnectionPool for the database
+
+    """
+    pools = current_app.extensions.setdefault("db_shard_pools", {})
+    pool = current_app.extensions.get("db_pool") if shard is None else pools.get(shard)
+
+    if pool is None or pool.pid != os.getpid():
+        pool = ConnectionPool(
+            shard_path(shard),
+            size=current_app.config["DATABASE_POOL_SIZE"],
+            timeout=current_app.config["DATABASE_POOL_TIMEOUT"],
+            pragmas=current_app.config.get("DATABASE_PRAGMAS", PRAGMAS),
+            statements=current_app.config["DATABASE_STATEMENT_CACHE_SIZE"],
+        )
+        if shard is None:
+            current_app.extensions["db_pool"] = pool
+        else:
+            pools[shard] = pool
+
+    return pool
+
+
+def get_pools():
+    """
+    Connection pools of the directory and every configured shard
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Dictionary of ConnectionPool by shard number, None for the directory
+
+    """
+    return {shard: get_pool(shard) for shard in databases()}
+
+
+def databases(shards=None):
+    """
+    Databases of the application
+
+    Parameters
+    -----------
+    shards: number of shards, DATABASE_SHARDS when None
+
+    Returns
+    -----------
+    List of shard numbers, starting with None for the directory database
+
+    """
+    if shards is None:
+        shards = current_app.config["DATABASE_SHARDS"]
+
+    return [None, *range(shards)]
+
+
+def board_databases():
+    """
+    Databases holding boards with the configured DATABASE_SHARDS
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    List of shard numbers, [None] when boards are kept in the directory
+
+    """
+    shards = current_app.config["DATABASE_SHARDS"]
+    return list(range(shards)) if shards else [None]
+
+
+class QueryExecutor:
+    """
+    Runs queries for async code on a dedicated thread pool
+
+    Coroutines await the result while the blocking sqlite3 call runs on one
+    of the executor's threads with a connection from the pool, so the event
+    loop stays free to serve other connections.
+
+    Parameters
+    -----------
+    - pool: ConnectionPool the queries take their connections from
+    - workers: number of threads running queries
+
+    """
+
+    def __init__(self, pool, workers=4):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="db")
+
+    def run(self, sql, parameters, commit, pool=None):
+        pool = pool or self.pool
+        db = pool.acquire()
+        try:
+            rows = db.execute(sql, parameters).fetchall()
+            if commit:
+                db.commit()
+            return rows
+        finally:
+            pool.release(db)
+
+    async def fetchall(self, sql, parameters=(), pool=None):
+        """
+        Run a query and return all rows
+
+        Parameters
+        -----------
+        - sql: statement text
+        - parameters: bound parameters
+        - pool: ConnectionPool of a shard, the executor's pool when None
+
+        Returns
+        -----------
+        List of rows
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.run, sql, parameters, False, pool
+        )
+
+    async def fetchone(self, sql, parameters=(), pool=None):
+        rows = await self.fetchall(sql, parameters, pool)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, parameters=(), pool=None):
+        """
+        Run a statement and commit it
+
+        Parameters
+        -----------
+        - sql: statement text
+        - parameters: bound parameters
+        - pool: ConnectionPool of a shard, the executor's pool when None
+
+        Returns
+        -----------
+        List of returned rows
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.run, sql, parameters, True, pool
+        )
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def get_executor():
+    """
+    Query executor of the current application for async code
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    QueryExecutor sharing the application's connection pool
+
+    """
+    executor = current_app.extensions.get("db_executor")
+
+    if executor is None or executor.pool is not get_pool():
+        executor = QueryExecutor(
+            get_pool(), current_app.config["DATABASE_EXECUTOR_WORKERS"]
+        )
+        current_app.extensions["db_executor"] = executor
+
+    return executor
+
+
+#guards the creation of write pipelines
+WRITER_LOCK = threading.Lock()
+
+
+class WritePipeline:
+    """
+    Commits the writes of concurrent requests together on one thread
+
+    Requests submit their writes as functions and wait on a future. The
+    writer thread runs every queued write, up to max_batch, in one
+    transaction and commits once, so concurrent requests share an fsync
+    and never wait for each other's write lock. Each write runs in its own
+    savepoint, so a failing write is rolled back alone and its error is
+    raised in the request that submitted it.
+
+    Parameters
+    -----------
+    - app: Flask application, the writer runs in its application context
+    - max_batch: writes committed together at most
+    - max_delay: seconds to wait for more writes before committing a batch
+    - synchronous: PRAGMA synchronous of the writer, e.g. "FULL" to fsync
+      every batch or "NORMAL" to only fsync at WAL checkpoints
+    - shard: shard number the writes go to, None for the directory database
+
+    """
+
+    def __init__(
+        self, app, max_batch=64, max_delay=0.0, synchronous="NORMAL", shard=None
+    ):
+        self.app = app
+        self.shard = shard
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self.pid = os.getpid()
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self.run,
+            name="db-writer" if shard is None else f"db-writer-{shard}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """
+        Queue a write
+
+        Parameters
+        -----------
+        - function: runs the write's statements on its database, never commits
+        - args: its arguments
+
+        Returns
+        -----------
+        Future resolved with the function's result once it is committed
+
+        """
+        future = Future()
+        self._queue.put((future, function, args))
+        return future
+
+    def run(self):
+        with self.app.app_context():
+            pool = get_pool(self.shard)
+            db = pool.acquire()
+            db.execute(f"PRAGMA synchronous = {self.synchronous}")
+            #get_db in the writes returns the writer's connection
+            if self.shard is None:
+                g.db = db
+            else:
+                g.shards = {self.shard: db}
+
+            try:
+                while True:
+                    batch = self.collect()
+                    if batch:
+                        self.commit(db, batch)
+                    if batch is None or None in batch:
+                        break
+            finally:
+                g.pop("db", None)
+                g.pop("shards", None)
+                pool.release(db)
+
+    def collect(self):
+        """
+        Wait for the next writes
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        List of queued writes, ending with None when the pipeline closes
+
+        """
+        job = self._queue.get()
+        if job is None:
+            return None
+
+        batch = [job]
+        deadline = time.monotonic() + self.max_delay
+
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            try:
+                timeout = deadline - time.monotonic()
+                batch.append(
+                    self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+
+        return batch
+
+    def commit(self, db, batch):
+        """
+        Run a batch of writes in one transaction and resolve their futures
+
+        Parameters
+        -----------
+        - db: connection of the writer
+        - batch: queued writes
+
+        Returns
+        -----------
+        None
+
+        """
+        jobs = [job for job in batch if job is not None and job[0].set_running_or_notify_cancel()]
+        done = []
+
+        try:
+            db.execute("BEGIN IMMEDIATE")
+
+            for future, function, args in jobs:
+                db.execute("SAVEPOINT write")
+                try:
+                    done.append((future, function(*args)))
+                except Exception as e:
+                    db.execute("ROLLBACK TO write")
+                    future.set_exception(e)
+                db.execute("RELEASE write")
+
+            db.commit()
+        except sqlite3.Error as e:
+            #nothing of the batch was committed
+            if db.in_transaction:
+                db.rollback()
+            for future, function, args in jobs:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(done)
+        for future, result in done:
+            future.set_result(result)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def get_writer(shard=None):
+    """
+    Write pipeline of a database of the current application
+
+    Every shard has its own writer, so writes to different shards are
+    committed in parallel.
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    WritePipeline configured from WRITE_* settings
+
+    """
+    writers = current_app.extensions.setdefault("db_writers", {})
+    writer = writers.get(shard)
+
+    if writer is None or writer.pid != os.getpid():
+        #two writers would fight over the write lock again
+        with WRITER_LOCK:
+            writer = writers.get(shard)
+
+            if writer is None or writer.pid != os.getpid():
+                config = current_app.config
+                writer = WritePipeline(
+                    current_app._get_current_object(),
+                    max_batch=config["WRITE_BATCH_SIZE"],
+                    max_delay=config["WRITE_BATCH_DELAY"],
+                    synchronous=config["WRITE_SYNCHRONOUS"],
+                    shard=shard,
+                )
+                writers[shard] = writer
+
+    return writer
+
+
+def write(function, *args, shard=None):
+    """
+    Run a write and commit it
+
+    With WRITE_PIPELINE on, the write is committed by the writer thread
+    together with the writes of concurrent requests. Otherwise it runs on
+    the request's connection and is committed at once. Either way it is
+    committed when this returns.
+
+    Parameters
+    -----------
+    - function: runs the write's statements through get_db, never commits
+    - args: its arguments, functions must not rely on the request or g
+    - shard: shard number the function writes to, None for the directory
+
+    Returns
+    -----------
+    The function's result
+
+    """
+    if current_app.config["WRITE_PIPELINE"]:
+        return get_writer(shard).submit(function, *args).result()
+
+    db = get_db(shard)
+    result = function(*args)
+    db.commit()
+    return result
+
+
+def write_board(function, author_id, *args):
+    """
+    Run a write of a user's board and commit it on the board's database
+
+    Parameters
+    -----------
+    - function: runs the write's statements through get_board_db, never
+      commits, called with author_id and args
+    - author_id: id of the board's owner
+    - args: its other arguments
+
+    Returns
+    -----------
+    The function's result
+
+    """
+    return write(function, author_id, *args, shard=board_shard(author_id))
+
 
-def get_db():
+def get_db(shard=None):
     """
     Connect to database
 
     Parameters
     -----------
-    None
+    shard: shard number, None for the directory database with the users
 
     Returns
     -----------
-    Global database for the lifetime of an application context
+    Pooled database connection for the lifetime of an application context
 
     """
+    if shard is not None:
+        shards = g.setdefault("shards", {})
+        if shard not in shards:
+            shards[shard] = get_pool(shard).acquire()
+            shards[shard].log = g.get("query_log")
+
+        return shards[shard]
+
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
+        #set by profiling.start_request when SQL_PROFILING is on
+        g.db.log = g.get("query_log")
 
     return g.db
 
 
+def get_board_db(author_id):
+    """
+    Connect to the database holding a user's board
+
+    Parameters
+    -----------
+    author_id: id of the board's owner
+
+    Returns
+    -----------
+    Pooled connection of the user's shard, or of the directory database
+    when DATABASE_SHARDS is 0
+
+    """
+    return get_db(board_shard(author_id))
+
+
 def close_db(e=None):
     """
-    Closing connect after successful request to database
+    Returning the connection to the pool after a request to database
 
     Parameters
     -----------
@@ -42,13 +1047,21 @@ def close_db(e=None):
     db = g.pop("db", None)
 
     if db is not None:
-        db.close()
+        db.log = None
+        get_pool().release(db)
+
+    for shard, db in g.pop("shards", {}).items():
+        db.log = None
+        get_pool(shard).release(db)
 
 
 def init_db():
     """
     Clear existing data and create new tables
 
+    Every database gets the whole schema, users are only stored in the
+    directory database and boards in their shard.
+
     Parameters
     -----------
     None
@@ -58,11 +1071,506 @@ def init_db():
     None
 
     """
-    db = get_db()
+    for shard in databases():
+        init_database(shard)
+
+
+def init_database(shard=None):
+    """
+    Clear one database and create new tables
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    None
+
+    """
+    db = get_db(shard)
 
     with current_app.open_resource("schema.sql") as f:
         db.executescript(f.read().decode("utf8"))
 
+    #bring the fresh tables up to the latest schema version
+    migrate_database(shard)
+    seed_ids(shard)
+
+
+def seed_ids(shard=None):
+    """
+    Start the post ids of a shard at the beginning of its range
+
+    Also moves the ids of shards seeded below their range by older versions
+    up to it, and only writes when the sequence has to change.
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    None
+
+    """
+    if shard is None:
+        return
+
+    #AUTOINCREMENT continues from the largest id the table ever had
+    db = get_db(shard)
+    start = shard_id_start(shard)
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'post'").fetchone()
+    if row is not None and row[0] >= start:
+        return
+
+    db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'post' AND seq < ?", (start, start))
+    db.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'post', ?"
+        " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'post')",
+        (start,),
+    )
+    db.commit()
+
+
+def split_script(script):
+    """
+    Statements of an SQL script, to run them one by one in a transaction
+
+    Parameters
+    -----------
+    script: SQL text
+
+    Returns
+    -----------
+    Generator of single statements
+
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        #complete_statement knows about the BEGIN ... END of triggers
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def lock_database(db):
+    """
+    Start a write transaction at once, waiting for migrating workers
+
+    While it is held no other connection can write, so schema changes made
+    inside it are checked and applied by one process only.
+
+    Parameters
+    -----------
+    db: connection of the database
+
+    Returns
+    -----------
+    None
+
+    """
+    deadline = time.monotonic() + MIGRATION_WAIT
+
+    while True:
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            #busy_timeout ran out while another worker migrates
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+
+
+def list_migrations():
+    """
+    Find migration scripts in the migrations folder
+
+    Scripts are named NNNN_description.sql and applied in version order.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    List of (version, name) tuples sorted by version
+
+    """
+    folder = os.path.join(current_app.root_path, MIGRATIONS_FOLDER)
+    migrations = []
+
+    for name in os.listdir(folder):
+        match = re.match(r"(\d+)_\w+\.sql$", name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+
+    return sorted(migrations)
+
+
+def schema_version(shard=None):
+    """
+    Version of the latest migration applied to a database
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    Version number, 0 when no migration was applied yet
+
+    """
+    db = get_db(shard)
+    table = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+
+    if table is None:
+        return 0
+
+    return db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate():
+    """
+    Apply pending migrations to every database without dropping data
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    List of migration names applied to at least one database
+
+    """
+    applied = []
+
+    for shard in databases():
+        for name in migrate_database(shard):
+            if name not in applied:
+                applied.append(name)
+
+    return applied
+
+
+def migrate_database(shard=None):
+    """
+    Apply pending migrations to one database
+
+    Every migration runs in its own write transaction together with the
+    schema_version row that records it. The version is read again inside
+    it, so workers starting together apply each migration once.
+
+    Parameters
+    -----------
+    shard: shard number, None for the directory database
+
+    Returns
+    -----------
+    List of applied migration names
+
+    """
+    db = get_db(shard)
+    current = schema_version(shard)
+    applied = []
+
+    for version, name in list_migrations():
+        if version <= current:
+            continue
+
+        with current_app.open_resource(os.path.join(MIGRATIONS_FOLDER, name)) as f:
+            script = f.read().decode("utf8")
+
+        lock_database(db)
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                " version INTEGER PRIMARY KEY,"
+                " name TEXT NOT NULL,"
+                " applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+            )
+            #another worker may have applied it while this one waited
+            current = schema_version(shard)
+            if version > current:
+                for statement in split_script(script):
+                    db.execute(statement)
+                db.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name)
+                )
+                applied.append(name)
+            db.commit()
+        except sqlite3.Error:
+            #leave the database at the last successful version
+            db.rollback()
+            raise
+
+    return applied
+
+
+def ensure_schema(shards=None):
+    """
+    Make sure every database has the latest schema without touching its data
+
+    Safe to run on every start, also by several workers at once: an up to
+    date database only costs a metadata lookup, an empty one gets the
+    tables and an older one gets the pending migrations. Tables are only
+    created while holding the database's write lock, after checking again
+    that they are missing. Use the init-db command to wipe a database.
+
+    The schema's triggers call SQL functions of the app, so writes to post
+    only work on connections set up with register_functions.
+
+    Parameters
+    -----------
+    shards: number of shards, DATABASE_SHARDS when None
+
+    Returns
+    -----------
+    None
+
+    """
+    latest = list_migrations()[-1][0]
+
+    for shard in databases(shards):
+        if schema_version(shard) >= latest:
+            seed_ids(shard)
+            continue
+
+        db = get_db(shard)
+        lock_database(db)
+        try:
+            tables = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post'"
+            ).fetchone()
+
+            if tables is None:
+                with current_app.open_resource("schema.sql") as f:
+                    for statement in split_script(f.read().decode("utf8")):
+                        db.execute(statement)
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+        migrate_database(shard)
+        seed_ids(shard)
+
+
+#tables other than post keeping the rows of a board by author_id
+BOARD_TABLES = ("board", "flow_day")
+
+#append-only tables of a board, their rows get new ids on the target
+BOARD_LOGS = ("post_transition",)
+
+
+def new_post_id(db, shard):
+    """
+    Take an unused post id from the range of a database
+
+    Parameters
+    -----------
+    - db: connection of the database, in a transaction
+    - shard: shard number of the database, None for the directory
+
+    Returns
+    -----------
+    Id no post or archived card of the database has
+
+    """
+    while True:
+        row = db.execute(
+            "UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = 'post' RETURNING seq"
+        ).fetchone()
+        if row is None:
+            id = shard_id_start(shard) + 1
+            db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('post', ?)", (id,))
+        else:
+            id = row[0]
+
+        #archived cards keep their ids, which are not in the sequence
+        if not db.execute("SELECT 1 FROM archive WHERE id = ?", (id,)).fetchone():
+            return id
+
+
+def copy_cards(author_id, table, old, new, target, renumbered_ids, batch_size):
+    """
+    Copy the posts or archived cards of a board to another database
+
+    Rows keep their ids unless the id is above the range of the target, or
+    a post or archived card of the target already has it, which happens
+    with boards created before every shard had its own range. Those get a
+    new id of the target.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - table: "post" or "archive"
+    - old: connection of the source database
+    - new: connection of the target database, in a transaction
+    - target: shard number of the target, None for the directory
+    - renumbered_ids: dictionary the new ids are added to by old id
+    - batch_size: rows read from the source at once
+
+    Returns
+    -----------
+    Number of copied rows
+
+    """
+    end = shard_id_end(target)
+    copied = 0
+
+    cursor = old.execute(f"SELECT * FROM {table} WHERE author_id = ?", (author_id,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        columns = rows[0].keys()
+        for row in rows:
+            id = row["id"]
+            taken = new.execute(
+                "SELECT 1 FROM post WHERE id = ? UNION ALL SELECT 1 FROM archive WHERE id = ?",
+                (id, id),
+            ).fetchone()
+            if id >= end or taken:
+                id = renumbered_ids[row["id"]] = new_post_id(new, target)
+
+            values = [id if name == "id" else row[name] for name in columns]
+            new.execute(
+                f"INSERT INTO {table} ({', '.join(columns)})"
+                f" VALUES ({', '.join('?' * len(columns))})",
+                values,
+            )
+        copied += len(rows)
+
+    return copied
+
+
+def move_board(author_id, source, target, batch_size=1000):
+    """
+    Move a user's board from one database to another
+
+    The board is copied and committed on the target in one transaction
+    before it is deleted from the source, so an interrupted move never
+    loses cards, and running it again only finishes the delete. The source
+    rows are only deleted once the target holds as many cards as them.
+    Cards whose ids the target cannot take get new ones, see copy_cards,
+    and the board's logs follow them.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - source: shard number the board is in, None for the directory
+    - target: shard number to move it to, None for the directory
+    - batch_size: posts read from the source at once
+
+    Returns
+    -----------
+    Number of moved posts
+
+    """
+    old = get_db(source)
+    new = get_db(target)
+    count = (
+        "SELECT (SELECT COUNT(*) FROM post WHERE author_id = ?),"
+        " (SELECT COUNT(*) FROM archive WHERE author_id = ?)"
+    )
+    renumbered_ids = {}
+
+    new.execute("BEGIN")
+    try:
+        #a previous run committed the copy but stopped before the delete
+        copied = tuple(new.execute(count, (author_id, author_id)).fetchone())
+        if copied == (0, 0):
+            copied = tuple(
+                copy_cards(author_id, table, old, new, target, renumbered_ids, batch_size)
+                for table in ("post", "archive")
+            )
+
+            for table in BOARD_TABLES:
+                for row in old.execute(f"SELECT * FROM {table} WHERE author_id = ?", (author_id,)):
+                    new.execute(
+                        f"INSERT OR REPLACE INTO {table} ({', '.join(row.keys())})"
+                        f" VALUES ({', '.join('?' * len(row))})",
+                        tuple(row),
+                    )
+
+            for table in BOARD_LOGS:
+                #rows of a previous run without cards are copied again
+                new.execute(f"DELETE FROM {table} WHERE author_id = ?", (author_id,))
+                rows = old.execute(
+                    f"SELECT * FROM {table} WHERE author_id = ? ORDER BY id", (author_id,)
+                )
+                for row in rows:
+                    names = [name for name in row.keys() if name != "id"]
+                    values = [row[name] for name in names]
+                    values[names.index("post_id")] = renumbered_ids.get(
+                        row["post_id"], row["post_id"]
+                    )
+                    new.execute(
+                        f"INSERT INTO {table} ({', '.join(names)})"
+                        f" VALUES ({', '.join('?' * len(names))})",
+                        values,
+                    )
+        new.commit()
+    except Exception:
+        new.rollback()
+        raise
+
+    if copied != tuple(old.execute(count, (author_id, author_id)).fetchone()):
+        raise sqlite3.IntegrityError(
+            f"The board of user {author_id} differs on both databases, it was not deleted."
+        )
+
+    for table in ("post", "archive") + BOARD_TABLES + BOARD_LOGS:
+        old.execute(f"DELETE FROM {table} WHERE author_id = ?", (author_id,))
+    old.commit()
+
+    return copied[0]
+
+
+def reshard(shards, batch_size=1000):
+    """
+    Move every board to its database for a new number of shards
+
+    Run it while the application is stopped, then set DATABASE_SHARDS to
+    the new number. With jump consistent hashing, adding a shard only moves
+    the boards that hash to it.
+
+    Parameters
+    -----------
+    - shards: new number of shards, 0 keeps every board in the directory
+    - batch_size: posts read from a source database at once
+
+    Returns
+    -----------
+    (moved boards, moved posts) tuple
+
+    """
+    ensure_schema(shards)
+    boards = posts = 0
+
+    for source in databases(max(shards, current_app.config["DATABASE_SHARDS"])):
+        if source is not None and not os.path.exists(shard_path(source)):
+            continue
+
+        authors = [
+            row[0] for row in get_db(source).execute(
+                "SELECT author_id FROM post UNION SELECT author_id FROM archive"
+                " UNION SELECT author_id FROM board"
+            )
+        ]
+        for author_id in authors:
+            target = shard_index(author_id, shards) if shards else None
+            if target != source:
+                posts += move_board(author_id, source, target, batch_size)
+                boards += 1
+
+    return boards, posts
+
 
 @click.command("init-db")
 def init_db_command():
@@ -82,6 +1590,48 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
+@click.command("migrate")
+def migrate_command():
+    """
+    Apply pending schema migrations to an existing database
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    for name in migrate():
+        click.echo(f"Applied {name}.")
+
+    click.echo(f"Database is at schema version {schema_version()}.")
+
+
+@click.command("reshard")
+@click.argument("shards", type=click.IntRange(min=0))
+@click.option("--batch-size", type=int, default=1000, help="Posts read at once.")
+def reshard_command(shards, batch_size):
+    """
+    Move every board to its database for a new number of shards
+
+    Parameters
+    -----------
+    - shards: new number of shards, 0 for a single database
+    - batch_size: posts read from a source database at once
+
+    Returns
+    -----------
+    None
+
+    """
+    boards, posts = reshard(shards, batch_size)
+    click.echo(f"Moved {boards} boards ({posts} cards).")
+    click.echo(f"Set DATABASE_SHARDS = {shards} before starting the app.")
+
+
 def init_app(app):
     """
     Create application factory
@@ -95,4 +1645,6 @@ def init_app(app):
     None
     """
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(reshard_command)
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import queue
+import threading
+
+from flask import current_app
+
+import queries
+from board import STATUS_LABELS, card_json
+from db import get_board_db
+
+
+class Subscription:
+    """
+    Events of one channel for a listener running on a thread
+
+    Parameters
+    -----------
+    - channel: name of the channel
+    - size: events buffered before the listener counts as too slow
+
+    """
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.overflowed = False
+        self.queue = queue.Queue(size)
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        Wait for the next event
+
+        Parameters
+        -----------
+        timeout: seconds to wait
+
+        Returns
+        -----------
+        Event, None when the timeout passed first
+
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """
+    Events of one channel for a listener running on an event loop
+
+    Parameters
+    -----------
+    - channel: name of the channel
+    - size: events buffered before the listener counts as too slow
+
+    """
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.overflowed = False
+        self.queue = asyncio.Queue(size)
+        self.loop = asyncio.get_running_loop()
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def deliver(self, event):
+        #publishers run on other threads than the loop
+        self.loop.call_soon_threadsafe(self.put, event)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    In-process publish/subscribe of board changes
+
+    Publishing never blocks: a listener whose buffer is full is marked as
+    overflowed and should reload the whole board.
+
+    Parameters
+    -----------
+    size: events buffered per listener
+
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, kind=Subscription):
+        """
+        Start listening to a channel
+
+        Parameters
+        -----------
+        - channel: name of the channel
+        - kind: Subscription or AsyncSubscription
+
+        Returns
+        -----------
+        New subscription
+
+        """
+        subscription = kind(channel, self.size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            listeners = self._channels.get(subscription.channel, set())
+            listeners.discard(subscription)
+            if not listeners:
+                self._channels.pop(subscription.channel, None)
+
+    def publish(self, channel, event):
+        """
+        Send an event to every listener of a channel
+
+        Parameters
+        -----------
+        - channel: name of the channel
+        - event: JSON serializable dictionary with an "event" name
+
+        Returns
+        -----------
+        Number of listeners reached
+
+        """
+        with self._lock:
+            listeners = list(self._channels.get(channel, ()))
+
+        for subscription in listeners:
+            subscription.deliver(event)
+
+        return len(listeners)
+
+    def has_listeners(self, channel):
+        return channel in self._channels
+
+    def listeners(self):
+        with self._lock:
+            return sum(len(listeners) for listeners in self._channels.values())
+
+
+def get_broker():
+    """
+    Event broker of the current application
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Broker
+
+    """
+    broker = current_app.extensions.get("broker")
+
+    if broker is None:
+        broker = Broker(current_app.config["EVENTS_BUFFER"])
+        current_app.extensions["broker"] = broker
+
+    return broker
+
+
+def board_channel(author_id):
+    return f"board:{author_id}"
+
+
+def publish(author_id, event, ids, status=None):
+    """
+    Tell the open views of a board about a committed change
+
+    Created, updated and moved cards are sent whole, so views can place
+    them by rank, deletions only send their ids. Nothing is loaded when
+    nobody listens to the board.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - event: "created", "updated", "moved" or "deleted"
+    - ids: ids of the changed cards
+    - status: new status of moved cards
+
+    Returns
+    -----------
+    None
+
+    """
+    broker = get_broker()
+    channel = board_channel(author_id)
+
+    if not broker.has_listeners(channel):
+        return
+
+    data = {"event": event, "ids": ids}
+
+    if event in ("created", "updated", "moved"):
+        rows = get_board_db(author_id).execute(queries.POSTS_GET, (json.dumps(ids),)).fetchall()
+        data["cards"] = [card_json(row) for row in rows]
+    if event == "moved":
+        data["status"] = STATUS_LABELS[status]
+
+    broker.publish(channel, data)
+
+
+def format_event(event):
+    """
+    Encode an event for a text/event-stream response
+
+    Parameters
+    -----------
+    event: dictionary with an "event" name
+
+    Returns
+    -----------
+    Server-Sent Events message
+
+    """
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
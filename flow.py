@@ -0,0 +1,102 @@
+"""
+Flow analytics of boards
+
+Every status change of a card is appended to post_transition in the
+transaction of the move, and board.count_flow adds it to the board's
+flow_day row of the day. Cumulative flow, throughput and cycle time are
+read from the rows of the days shown, so they take the same time however
+long a board's history is. Days are UTC days.
+
+"""
+from datetime import datetime, timedelta, timezone
+
+import queries
+from board import STATUS_LABELS
+from db import get_board_db
+
+#columns of flow_day carried over days without changes
+COLUMNS = ("todo", "doing", "done")
+
+
+def load_flow(author_id, days):
+    """
+    Daily flow of a user's board over the last days
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - days: number of days, today included
+
+    Returns
+    -----------
+    JSON serializable dictionary with "days", oldest first, each with the
+    cards in every column at its end, the cards created and completed and
+    their mean cycle time in seconds, and "throughput" and "cycle_time"
+    over the whole window
+
+    """
+    today = datetime.now(timezone.utc).date()
+    start = today - timedelta(days=days - 1)
+    rows = get_board_db(author_id).execute(
+        queries.FLOW_DAYS, (author_id, start.isoformat())
+    ).fetchall()
+
+    #the last day before the window holds the columns it starts with
+    columns = dict.fromkeys(COLUMNS, 0)
+    changed = {}
+    for row in rows:
+        if row["day"] < start:
+            columns = {name: row[name] for name in COLUMNS}
+        else:
+            changed[row["day"]] = row
+
+    flow = []
+    completed = cycle = 0
+    for n in range(days):
+        day = start + timedelta(days=n)
+        row = changed.get(day)
+        if row is not None:
+            columns = {name: row[name] for name in COLUMNS}
+            completed += row["completed"]
+            cycle += row["cycle"]
+
+        flow.append({
+            "day": day.isoformat(),
+            **columns,
+            "created": row["created"] if row else 0,
+            "completed": row["completed"] if row else 0,
+            "cycle_time": row["cycle"] / row["completed"] if row and row["completed"] else None,
+        })
+
+    return {
+        "days": flow,
+        "throughput": completed,
+        "cycle_time": cycle / completed if completed else None,
+    }
+
+
+def load_history(author_id, id):
+    """
+    Status changes of a card, oldest first
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - id: post id
+
+    Returns
+    -----------
+    List of dictionaries with "from" and "to" statuses, None when the card
+    was created or deleted, "moved" and the cycle time of moves to Done
+
+    """
+    rows = get_board_db(author_id).execute(queries.TRANSITIONS_GET, (id, author_id))
+    return [
+        {
+            "from": STATUS_LABELS.get(row["from_status"]),
+            "to": STATUS_LABELS.get(row["to_status"]),
+            "moved": row["moved"].isoformat(),
+            "cycle_time": row["cycle"],
+        }
+        for row in rows
+    ]
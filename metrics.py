@@ -0,0 +1,550 @@
+"""
+Prometheus metrics of the Kanban app, served as text at /metrics
+
+Request threads update counters in a dictionary of their own, so
+recording a request takes no lock. The dictionaries are only added up
+when metrics are collected, and those of finished threads are folded
+into one so thread-per-request servers do not leak them.
+
+Worker processes each keep their own values. With METRICS_DIR set, every
+process writes its values to a file in that directory at most every
+METRICS_FLUSH_INTERVAL seconds and /metrics adds up all files. Empty the
+directory when the server starts.
+
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import request
+
+#upper bounds of the latency histograms, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    Metric updated by request threads
+
+    Parameters
+    -----------
+    - registry: Registry holding the values
+    - name: metric name
+    - help: description shown on /metrics
+    - labels: names of the labels
+
+    """
+
+    type = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry.register(self)
+
+    def key(self, labels):
+        return (self.name, tuple(str(labels[name]) for name in self.labels))
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.shard()
+        key = self.key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """
+    Metric going up and down, added up over threads and processes
+
+    """
+
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over BUCKETS
+
+    Values are kept as per-bucket counts followed by their sum.
+
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        values = self.registry.shard()
+        key = self.key(labels)
+        counts = values.get(key)
+
+        if counts is None:
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+def add(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class Registry:
+    """
+    Metrics of one application
+
+    Parameters
+    -----------
+    - directory: folder shared by worker processes, None for one process
+    - flush_interval: seconds between writes of this process's values
+
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.collectors = []
+        self.reset()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        #a forked worker starts from zero instead of counting its parent again
+        reset = weakref.WeakMethod(self.reset)
+
+        def after_fork():
+            if reset() is not None:
+                reset()()
+
+        os.register_at_fork(after_in_child=after_fork)
+
+    def reset(self):
+        self.flushed = 0.0
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def collector(self, function):
+        """
+        Add a function reporting values read at collection time
+
+        It returns (name, type, help, labels dictionary, value) tuples, for
+        example the open connections of the pool.
+
+        Parameters
+        -----------
+        function: collector function, run in an application context
+
+        Returns
+        -----------
+        The function
+
+        """
+        self.collectors.append(function)
+        return function
+
+    def shard(self):
+        """
+        Values of the calling thread, only ever written by that thread
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Dictionary of (name, label values) to value
+
+        """
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def values(self):
+        """
+        Values of this process, added up over its threads and collectors
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        List of (name, type, label values, value) tuples
+
+        """
+        with self._lock:
+            shards = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    shards.append(values)
+                else:
+                    #finished threads write no more, keep one copy of their values
+                    for key, value in list(values.items()):
+                        add(self._retired, key, value)
+
+            self._shards = [(t, v) for t, v in self._shards if t.is_alive()]
+            totals = {}
+            for key, value in self._retired.items():
+                add(totals, key, value)
+
+        for values in shards:
+            for key, value in list(values.items()):
+                add(totals, key, value)
+
+        samples = [
+            (name, self.metrics[name].type, labels, value)
+            for (name, labels), value in totals.items()
+        ]
+
+        for collect in self.collectors:
+            for name, type, help, labels, value in collect():
+                if name not in self.metrics:
+                    self.metrics[name] = Metric(self, name, help, tuple(labels))
+                    self.metrics[name].type = type
+                samples.append((name, type, tuple(str(v) for v in labels.values()), value))
+
+        return samples
+
+    def flush(self, force=False):
+        """
+        Write this process's values to the shared directory
+
+        Parameters
+        -----------
+        force: write even when the last write is recent
+
+        Returns
+        -----------
+        None
+
+        """
+        now = time.monotonic()
+        if self.directory is None or (not force and now - self.flushed < self.flush_interval):
+            return
+
+        self.flushed = now
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.values(), f)
+        os.replace(tmp, os.path.join(self.directory, f"{os.getpid()}.json"))
+
+    def collect(self):
+        """
+        Values of all processes
+
+        Gauges of processes that exited are left out, their counters stay.
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Dictionary of (name, label values) to value
+
+        """
+        totals = {}
+        for name, type, labels, value in self.values():
+            add(totals, (name, tuple(labels)), value)
+
+        if self.directory is None:
+            return totals
+
+        for entry in os.scandir(self.directory):
+            pid, extension = os.path.splitext(entry.name)
+            if extension != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+
+            alive = process_alive(int(pid))
+            try:
+                with open(entry.path) as f:
+                    samples = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            for name, type, labels, value in samples:
+                if (alive or type != "gauge") and name in self.metrics:
+                    add(totals, (name, tuple(labels)), value)
+
+        return totals
+
+    def render(self):
+        """
+        All metrics in the Prometheus text format
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        Text of the /metrics page
+
+        """
+        totals = self.collect()
+        lines = []
+
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+
+            for (sample, labels), value in sorted(totals.items()):
+                if sample != name:
+                    continue
+
+                pairs = [f'{label}="{escape(v)}"' for label, v in zip(metric.labels, labels)]
+                suffix = f"{{{','.join(pairs)}}}" if pairs else ""
+
+                if metric.type != "histogram":
+                    lines.append(f"{name}{suffix} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = ",".join(pairs + [f'le="{bound}"'])
+                    lines.append(f"{name}_bucket{{{le}}} {cumulative}")
+                lines.append(f"{name}_sum{suffix} {value[-1]}")
+                lines.append(f"{name}_count{suffix} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics():
+    return current_app.extensions.get("metrics")
+
+
+def start_request():
+    metrics = current_app.extensions["metrics"]
+    g.metrics_started = time.perf_counter()
+    metrics.in_flight.inc(endpoint=request.endpoint or "unmatched")
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(error=None):
+    """
+    Record the duration and status of a finished request
+
+    Runs on teardown, so requests failing with an exception count as 500.
+
+    Parameters
+    -----------
+    error: unhandled exception of the request
+
+    Returns
+    -----------
+    None
+
+    """
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+
+    metrics = current_app.extensions["metrics"]
+    endpoint = request.endpoint or "unmatched"
+    status = g.pop("metrics_status", 500)
+
+    metrics.in_flight.dec(endpoint=endpoint)
+    metrics.requests.inc(endpoint=endpoint, method=request.method, status=status)
+    metrics.latency.observe(time.perf_counter() - started, endpoint=endpoint)
+    metrics.registry.flush()
+
+
+def password_timer():
+    """
+    Function recording password hash timings, None with metrics disabled
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Callable taking the operation and its duration in seconds
+
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return None
+
+    def observe(operation, seconds):
+        metrics.password_hash.observe(seconds, operation=operation)
+
+    return observe
+
+
+def collect_components():
+    """
+    Counters kept by the pools, caches, hasher and event broker
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    List of (name, type, help, labels, value) tuples
+
+    """
+    from auth import get_user_cache
+    from cache import get_cache
+    from db import get_pools
+
+    samples = []
+    for shard, pool in get_pools().items():
+        database = {"database": "directory" if shard is None else f"shard{shard}"}
+        pool = pool.stats()
+        samples += [
+            ("kanban_db_connections", "gauge", "Database connections of the pool",
+             {**database, "state": "open"}, pool["open"]),
+            ("kanban_db_connections", "gauge", "Database connections of the pool",
+             {**database, "state": "idle"}, pool["idle"]),
+            ("kanban_db_acquires_total", "counter", "Connections taken from the pool",
+             {**database, "result": "reused"}, pool["hits"]),
+            ("kanban_db_acquires_total", "counter", "Connections taken from the pool",
+             {**database, "result": "opened"}, pool["misses"]),
+            ("kanban_db_acquire_waits_total", "counter",
+             "Acquires that waited for a free connection", database, pool["waits"]),
+            ("kanban_db_statements_total", "counter", "Statements run on pooled connections",
+             {**database, "prepared": "reused"}, pool["statement_hits"]),
+            ("kanban_db_statements_total", "counter", "Statements run on pooled connections",
+             {**database, "prepared": "parsed"}, pool["statement_misses"]),
+        ]
+
+    for name, cache in (("board", get_cache()), ("user", get_user_cache())):
+        stats = cache.stats()
+        samples += [
+            ("kanban_cache_requests_total", "counter", "Cache lookups",
+             {"cache": name, "result": "hit"}, stats["hits"]),
+            ("kanban_cache_requests_total", "counter", "Cache lookups",
+             {"cache": name, "result": "miss"}, stats["misses"]),
+            ("kanban_cache_evictions_total", "counter", "Entries evicted from a full cache",
+             {"cache": name}, stats["evictions"]),
+            ("kanban_cache_entries", "gauge", "Entries held by a cache",
+             {"cache": name}, stats["size"]),
+        ]
+
+    hasher = current_app.extensions.get("password_hasher")
+    samples.append(
+        ("kanban_password_hash_rejected_total", "counter",
+         "Hashes turned away because the queue was full",
+         {}, hasher.rejected if hasher is not None else 0)
+    )
+
+    broker = current_app.extensions.get("broker")
+    samples.append(
+        ("kanban_event_listeners", "gauge", "Open board event streams",
+         {}, broker.listeners() if broker is not None else 0)
+    )
+
+    return samples
+
+
+def metrics_view():
+    metrics = current_app.extensions["metrics"]
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+class AppMetrics:
+    """
+    Metrics recorded by the request hooks
+
+    Parameters
+    -----------
+    registry: Registry holding them
+
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.requests = Counter(
+            registry, "kanban_requests_total", "Finished requests",
+            ("endpoint", "method", "status"),
+        )
+        self.latency = Histogram(
+            registry, "kanban_request_duration_seconds", "Request latency",
+            ("endpoint",),
+        )
+        self.in_flight = Gauge(
+            registry, "kanban_requests_in_flight", "Requests being handled", ("endpoint",)
+        )
+        self.password_hash = Histogram(
+            registry, "kanban_password_hash_seconds", "Password hashing time, queueing included",
+            ("operation",), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+        )
+
+
+def init_app(app):
+    """
+    Record metrics of every request and serve them at /metrics
+
+    Parameters
+    -----------
+    app: Flask application
+
+    Returns
+    -----------
+    None
+
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    registry = Registry(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"])
+    registry.collector(collect_components)
+    app.extensions["metrics"] = AppMetrics(registry)
+
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,4 @@
+-- Every board is read per user and category, most recent post first,
+-- so the board query is an index range scan without a sort step.
+CREATE INDEX IF NOT EXISTS post_author_status_created
+  ON post (author_id, status, created DESC);
@@ -0,0 +1,5 @@
+-- Columns are paged by (created, id), newest first. Adding id to the
+-- board index lets every page be read in index order without sorting.
+DROP INDEX IF EXISTS post_author_status_created;
+CREATE INDEX IF NOT EXISTS post_author_status_created_id
+  ON post (author_id, status, created DESC, id DESC);
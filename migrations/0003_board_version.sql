@@ -0,0 +1,8 @@
+-- Version of every user's board, bumped in the same transaction as each
+-- change to their posts. Lets clients revalidate the board page cheaply.
+CREATE TABLE IF NOT EXISTS board (
+  author_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL,
+  modified TIMESTAMP NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
@@ -0,0 +1,29 @@
+-- Full-text index over post titles and bodies. The index stores no copy
+-- of the text, it reads it from post, and the triggers below keep it in
+-- step with every insert, update and delete.
+CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5 (
+  title,
+  body,
+  content = 'post',
+  content_rowid = 'id',
+  tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', old.id, old.title, old.body);
+END;
+
+-- moves only change the status, they leave the index alone
+CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+-- index the posts of existing databases
+INSERT INTO post_fts (post_fts) VALUES ('rebuild');
@@ -0,0 +1,23 @@
+-- Done cards are moved from post to archive once they sat in Done for
+-- ARCHIVE_AFTER_DAYS, so post and its indexes only hold the working set.
+-- moved is when a card entered its current column.
+ALTER TABLE post ADD COLUMN moved TIMESTAMP;
+UPDATE post SET moved = created;
+
+-- archive passes read the oldest Done cards of all boards
+CREATE INDEX IF NOT EXISTS post_done_moved ON post (moved) WHERE status = 2;
+
+-- archived cards keep the id they had on the board
+CREATE TABLE IF NOT EXISTS archive (
+  id INTEGER PRIMARY KEY,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL,
+  moved TIMESTAMP NOT NULL,
+  archived TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+CREATE INDEX IF NOT EXISTS archive_author_created_id
+  ON archive (author_id, created DESC, id DESC);
@@ -0,0 +1,31 @@
+-- Cards are ordered within a column by rank, highest first, so users can
+-- rearrange them and a move only rewrites the moved card. Existing cards
+-- keep their order, newest first, with the keys ranks.spread gives a
+-- column: HEAD base 36 digits around MIDDLE, STEP = 36^3 apart, so heads
+-- stay fixed width for up to 36^5 cards in a column.
+ALTER TABLE post ADD COLUMN rank TEXT NOT NULL DEFAULT '';
+
+UPDATE post SET rank = ranked.rank
+FROM (
+  SELECT id,
+    substr(digits, head / 1679616 % 36 + 1, 1)
+    || substr(digits, head / 46656 % 36 + 1, 1)
+    || substr(digits, head / 1296 % 36 + 1, 1)
+    || substr(digits, head / 36 % 36 + 1, 1)
+    || substr(digits, head % 36 + 1, 1)
+    || '000' AS rank
+  FROM (
+    -- head in steps, MIDDLE / STEP = 30233088
+    SELECT id, '0123456789abcdefghijklmnopqrstuvwxyz' AS digits,
+      30233088 + COUNT(*) OVER column / 2 - COUNT(*) OVER column
+      + ROW_NUMBER() OVER (column ORDER BY created, id) AS head
+    FROM post
+    WINDOW column AS (PARTITION BY author_id, status)
+  )
+) AS ranked
+WHERE post.id = ranked.id;
+
+-- columns are paged by (rank, id) instead of (created, id)
+DROP INDEX IF EXISTS post_author_status_created_id;
+CREATE INDEX IF NOT EXISTS post_author_status_rank_id
+  ON post (author_id, status, rank DESC, id DESC);
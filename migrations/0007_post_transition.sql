@@ -0,0 +1,48 @@
+-- Every status change of a card, appended in the transaction of the move.
+-- from_status is NULL for created cards and to_status for deleted ones,
+-- cycle is the seconds from when the card was started to a move to Done.
+CREATE TABLE IF NOT EXISTS post_transition (
+  id INTEGER PRIMARY KEY,
+  post_id INTEGER NOT NULL,
+  author_id INTEGER NOT NULL,
+  from_status INTEGER,
+  to_status INTEGER,
+  moved TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  cycle INTEGER,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+-- history of a card and the first time it entered Doing
+CREATE INDEX IF NOT EXISTS post_transition_post_status
+  ON post_transition (post_id, to_status, moved);
+
+CREATE INDEX IF NOT EXISTS post_transition_author_id
+  ON post_transition (author_id, id);
+
+-- Flow of a board per UTC day, updated with every logged transition.
+-- todo, doing and done are the cards in each column at the end of the day,
+-- archived cards stay counted as done. created and completed count the
+-- cards added and moved to Done that day, cycle sums the completed cards'
+-- cycle times.
+CREATE TABLE IF NOT EXISTS flow_day (
+  author_id INTEGER NOT NULL,
+  day DATE NOT NULL,
+  todo INTEGER NOT NULL DEFAULT 0,
+  doing INTEGER NOT NULL DEFAULT 0,
+  done INTEGER NOT NULL DEFAULT 0,
+  created INTEGER NOT NULL DEFAULT 0,
+  completed INTEGER NOT NULL DEFAULT 0,
+  cycle INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (author_id, day),
+  FOREIGN KEY (author_id) REFERENCES user (id)
+) WITHOUT ROWID;
+
+-- existing boards start from today's columns
+INSERT OR IGNORE INTO flow_day (author_id, day, todo, doing, done)
+SELECT author_id, date('now'), SUM(status = 0), SUM(status = 1), SUM(status = 2)
+FROM (
+  SELECT author_id, status FROM post
+  UNION ALL
+  SELECT author_id, 2 FROM archive
+)
+GROUP BY author_id;
@@ -0,0 +1,48 @@
+-- A search of one board read the index entries of every board in the
+-- database before post.author_id filtered them out. The index now holds
+-- terms prefixed with the owner's id, made by the search_terms function
+-- db.py registers on every connection, so a search only reads its own
+-- board's entries. It stores no text, post holds it.
+--
+-- NOTE: the triggers below call search_terms, so every insert, delete or
+-- edit of a post must run on a connection with db.register_functions
+-- applied, as the app's pools do. Elsewhere, e.g. in the sqlite3 shell,
+-- such writes fail with "no such function: search_terms" and change
+-- nothing.
+DROP TRIGGER IF EXISTS post_fts_insert;
+DROP TRIGGER IF EXISTS post_fts_delete;
+DROP TRIGGER IF EXISTS post_fts_update;
+DROP TABLE IF EXISTS post_fts;
+
+CREATE VIRTUAL TABLE post_fts USING fts5 (
+  title,
+  body,
+  content = '',
+  tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (
+    new.id, search_terms(new.author_id, new.title), search_terms(new.author_id, new.body)
+  );
+END;
+
+-- a contentless index is told which terms the row had
+CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES (
+    'delete', old.id, search_terms(old.author_id, old.title), search_terms(old.author_id, old.body)
+  );
+END;
+
+-- moves only change the status, they leave the index alone
+CREATE TRIGGER post_fts_update AFTER UPDATE OF title, body, author_id ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES (
+    'delete', old.id, search_terms(old.author_id, old.title), search_terms(old.author_id, old.body)
+  );
+  INSERT INTO post_fts (rowid, title, body) VALUES (
+    new.id, search_terms(new.author_id, new.title), search_terms(new.author_id, new.body)
+  );
+END;
+
+INSERT INTO post_fts (rowid, title, body)
+SELECT id, search_terms(author_id, title), search_terms(author_id, body) FROM post;
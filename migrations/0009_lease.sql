@@ -0,0 +1,8 @@
+-- Leases of jobs that one worker process at a time should run, like the
+-- background archive passes. A worker holds a job while expires, in
+-- seconds since the epoch, is in the future and renews it with each run.
+CREATE TABLE IF NOT EXISTS lease (
+  name TEXT PRIMARY KEY,
+  owner TEXT NOT NULL,
+  expires REAL NOT NULL
+);
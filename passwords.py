@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+from metrics import password_timer
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many password hashes are already waiting
+
+    """
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords away from the request threads
+
+    With workers set, the key derivation runs in a process pool so it
+    neither holds the GIL nor starves other requests of the worker. At most
+    queue_limit hashes may be running or waiting, further calls fail fast
+    with HashingBusy instead of queueing without bound.
+
+    Parameters
+    -----------
+    - method: werkzeug hash method including its cost, e.g. pbkdf2:sha256:260000
+    - salt_length: length of generated salts
+    - workers: size of the process pool, 0 hashes on the calling thread
+    - queue_limit: hashes allowed in flight before rejecting
+    - observe: called with the function name and seconds of every hash
+
+    """
+
+    def __init__(self, method, salt_length=16, workers=0, queue_limit=64, observe=None):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.observe = observe
+        self.rejected = 0
+        self.pid = os.getpid()
+        self._prefix = None
+        self.executor = ProcessPoolExecutor(workers) if workers else None
+        self._slots = threading.BoundedSemaphore(queue_limit)
+
+    def run(self, function, *args):
+        """
+        Run a hashing function within the queue limit
+
+        Parameters
+        -----------
+        - function: werkzeug hashing function
+        - args: its arguments
+
+        Returns
+        -----------
+        Result of the function
+
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+
+        started = time.perf_counter()
+        try:
+            if self.executor is None:
+                return function(*args)
+
+            return self.executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+            if self.observe is not None:
+                self.observe(function.__name__, time.perf_counter() - started)
+
+    def hash(self, password):
+        """
+        Hash a new password with the configured method
+
+        Parameters
+        -----------
+        password: plain text password
+
+        Returns
+        -----------
+        Password hash string
+
+        """
+        return self.run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        """
+        Check a password against a stored hash
+
+        Parameters
+        -----------
+        - pwhash: stored password hash
+        - password: plain text password
+
+        Returns
+        -----------
+        True when the password matches
+
+        """
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Whether a stored hash was made with other parameters than configured
+
+        Hashes are compared by the method werkzeug writes into them, which
+        always holds the full cost, e.g. "pbkdf2:sha256:260000" for a
+        configured "pbkdf2:sha256". It is taken from one hash of an empty
+        password, made the first time this is called.
+
+        Parameters
+        -----------
+        pwhash: stored password hash
+
+        Returns
+        -----------
+        True when the hash should be replaced
+
+        """
+        if self._prefix is None:
+            self._prefix = generate_password_hash("", self.method, 1).split("$", 1)[0]
+
+        return pwhash.split("$", 1)[0] != self._prefix
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def get_hasher():
+    """
+    Password hasher of the current application
+
+    Created on first use and again after a fork, as process pools cannot be
+    shared between processes.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    PasswordHasher configured from PASSWORD_HASH_* settings
+
+    """
+    hasher = current_app.extensions.get("password_hasher")
+
+    if hasher is None or hasher.pid != os.getpid():
+        config = current_app.config
+        hasher = PasswordHasher(
+            config["PASSWORD_HASH_METHOD"],
+            salt_length=config["PASSWORD_SALT_LENGTH"],
+            workers=config["PASSWORD_HASH_WORKERS"],
+            queue_limit=config["PASSWORD_HASH_QUEUE"],
+            observe=password_timer(),
+        )
+        current_app.extensions["password_hasher"] = hasher
+
+    return hasher
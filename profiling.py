@@ -0,0 +1,212 @@
+"""
+Per-request SQL instrumentation
+
+With SQL_PROFILING on, every statement a request runs through db.get_db
+is timed and counted. The response gets a Server-Timing header, slow
+statements are logged and totals per statement are kept for the admin
+endpoint of api.py. With it off, requests only pay for one config lookup.
+
+"""
+import threading
+import time
+
+from flask import current_app
+from flask import g
+from flask import request
+
+from db import QueryLog
+
+
+class QueryStats:
+    """
+    Totals of the statements run by all profiled requests of a process
+
+    Parameters
+    -----------
+    size: distinct statements tracked, later ones only count in the totals
+
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.requests = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self._statements = {}
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, log):
+        """
+        Add the statements of one request
+
+        Parameters
+        -----------
+        - endpoint: name of the view that handled the request
+        - log: QueryLog of the request
+
+        Returns
+        -----------
+        None
+
+        """
+        with self._lock:
+            self.requests += 1
+            self.queries += len(log.records)
+
+            requests, queries, seconds = self._endpoints.get(endpoint, (0, 0, 0.0))
+            self._endpoints[endpoint] = (
+                requests + 1, queries + len(log.records), seconds + log.seconds
+            )
+
+            for record in log.records:
+                self.seconds += record.seconds
+                totals = self._statements.get(record.sql)
+
+                if totals is None:
+                    if len(self._statements) >= self.size:
+                        continue
+                    totals = self._statements[record.sql] = [0, 0.0, 0.0, 0]
+
+                totals[0] += 1
+                totals[1] += record.seconds
+                totals[2] = max(totals[2], record.seconds)
+                totals[3] += record.rows
+
+    def snapshot(self):
+        """
+        Current totals, the statements that took the most time first
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        JSON serializable dictionary
+
+        """
+        with self._lock:
+            statements = [
+                {
+                    "sql": sql,
+                    "calls": calls,
+                    "total_ms": seconds * 1000,
+                    "mean_ms": seconds / calls * 1000,
+                    "max_ms": slowest * 1000,
+                    "rows": rows,
+                }
+                for sql, (calls, seconds, slowest, rows) in self._statements.items()
+            ]
+            endpoints = {
+                endpoint: {
+                    "requests": requests,
+                    "queries_per_request": queries / requests,
+                    "db_ms_per_request": seconds / requests * 1000,
+                }
+                for endpoint, (requests, queries, seconds) in self._endpoints.items()
+            }
+
+            return {
+                "requests": self.requests,
+                "queries": self.queries,
+                "db_ms": self.seconds * 1000,
+                "endpoints": endpoints,
+                "statements": sorted(statements, key=lambda s: s["total_ms"], reverse=True),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.queries = 0
+            self.seconds = 0.0
+            self._statements.clear()
+            self._endpoints.clear()
+
+
+def get_stats():
+    """
+    SQL statistics of the current application
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    QueryStats
+
+    """
+    stats = current_app.extensions.get("query_stats")
+
+    if stats is None:
+        stats = QueryStats(current_app.config["SQL_STATS_SIZE"])
+        current_app.extensions["query_stats"] = stats
+
+    return stats
+
+
+def start_request():
+    """
+    Attach a query log to the request when SQL_PROFILING is on
+
+    Registered before the blueprints, so it also sees the queries of
+    auth.load_logged_in_user.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    if current_app.config["SQL_PROFILING"]:
+        g.query_log = QueryLog()
+        g.request_started = time.perf_counter()
+
+
+def finish_request(response):
+    """
+    Report the queries of a profiled request
+
+    Adds a Server-Timing header with the time spent in the database and in
+    the whole request, logs statements slower than SQL_SLOW_QUERY and adds
+    them to the application's totals.
+
+    Parameters
+    -----------
+    response: response of the request
+
+    Returns
+    -----------
+    The response
+
+    """
+    log = g.get("query_log")
+    if log is None:
+        return response
+
+    elapsed = time.perf_counter() - g.request_started
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={log.seconds * 1000:.2f};desc="{len(log.records)} queries",'
+        f" app;dur={elapsed * 1000:.2f}",
+    )
+
+    slow = current_app.config["SQL_SLOW_QUERY"]
+    for record in log.records:
+        if record.seconds >= slow:
+            current_app.logger.warning(
+                "Slow query %.1fms, %d rows, %s %s: %s",
+                record.seconds * 1000, record.rows, request.method, request.path, record.sql,
+            )
+
+    get_stats().add(request.endpoint, log)
+    return response
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,278 @@
+"""
+SQL statements of the Kanban board
+
+Every statement is declared once with bound parameters, so the SQL text
+never changes between users and each connection can reuse its prepared
+statement instead of parsing and planning it again.
+
+"""
+
+#boards and tasks, every column is paged by (rank, id), highest rank first
+BOARD_PAGE = " UNION ALL ".join(
+    "SELECT * FROM ("
+    "SELECT id, title, body, created, author_id, status, rank"
+    " FROM post"
+    f" WHERE author_id = ?1 AND status = {status}"
+    " ORDER BY rank DESC, id DESC"
+    " LIMIT ?2)"
+    for status in (0, 1, 2)
+)
+
+COLUMN_PAGE = (
+    "SELECT id, title, body, created, author_id, status, rank"
+    " FROM post"
+    " WHERE author_id = ? AND status = ? AND (rank, id) < (?, ?)"
+    " ORDER BY rank DESC, id DESC"
+    " LIMIT ?"
+)
+
+#ranks of the cards around a position, the moving card excluded
+COLUMN_TOP = (
+    "SELECT rank FROM post"
+    " WHERE author_id = ? AND status = ? AND id IS NOT ?"
+    " ORDER BY rank DESC, id DESC"
+    " LIMIT 1"
+)
+
+COLUMN_BOTTOM = (
+    "SELECT rank FROM post"
+    " WHERE author_id = ? AND status = ?"
+    " ORDER BY rank, id"
+    " LIMIT 1"
+)
+
+RANK_BELOW = (
+    "SELECT rank FROM post"
+    " WHERE author_id = ? AND status = ? AND (rank, id) < (?, ?) AND id IS NOT ?"
+    " ORDER BY rank DESC, id DESC"
+    " LIMIT 1"
+)
+
+RANK_ABOVE = (
+    "SELECT rank FROM post"
+    " WHERE author_id = ? AND status = ? AND (rank, id) > (?, ?) AND id IS NOT ?"
+    " ORDER BY rank, id"
+    " LIMIT 1"
+)
+
+COLUMN_IDS = (
+    "SELECT id FROM post"
+    " WHERE author_id = ? AND status = ?"
+    " ORDER BY rank DESC, id DESC"
+)
+
+POST_SET_RANK = "UPDATE post SET rank = ? WHERE id = ?"
+
+#a card moved within its column keeps the time it entered the column
+POST_PLACE = (
+    "UPDATE post SET rank = ?3,"
+    " moved = CASE WHEN status = ?2 THEN moved ELSE CURRENT_TIMESTAMP END,"
+    " status = ?2"
+    " WHERE id = ?1"
+)
+
+RANKS_TOO_LONG = "SELECT DISTINCT author_id, status FROM post WHERE length(rank) > ?"
+
+BOARD_VERSION = "SELECT version, modified FROM board WHERE author_id = ?"
+
+#every change to a board's posts bumps its version in the same transaction
+BOARD_TOUCH = (
+    "INSERT INTO board (author_id, version, modified)"
+    " VALUES (?, 1, CURRENT_TIMESTAMP)"
+    " ON CONFLICT (author_id) DO UPDATE"
+    " SET version = version + 1, modified = CURRENT_TIMESTAMP"
+)
+
+POST_GET = (
+    "SELECT id, title, body, created, author_id, status, rank"
+    " FROM post"
+    " WHERE id = ?"
+)
+
+#ids are passed as one JSON array so the statement text never changes
+POSTS_GET = (
+    "SELECT id, title, body, created, author_id, status, rank"
+    " FROM post"
+    " WHERE id IN (SELECT value FROM json_each(?))"
+)
+
+POST_CREATE = (
+    "INSERT INTO post (title, body, status, author_id, rank, moved)"
+    " VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)"
+)
+
+#imported posts keep their creation time when the file has one
+POSTS_IMPORT = (
+    "INSERT INTO post (title, body, status, author_id, created, rank, moved)"
+    " VALUES (?1, ?2, ?3, ?4, COALESCE(?5, CURRENT_TIMESTAMP), ?6,"
+    " COALESCE(?5, CURRENT_TIMESTAMP))"
+)
+
+POST_LAST_ID = "SELECT COALESCE(MAX(id), 0) FROM post"
+
+POSTS_EXPORT = (
+    "SELECT title, body, status, created"
+    " FROM post"
+    " WHERE author_id = ?"
+    " ORDER BY status, rank DESC, id DESC"
+)
+
+POST_UPDATE = "UPDATE post SET title = ?, body = ? WHERE id = ?"
+
+#moves take a JSON array of [id, rank] pairs, posts already in the column
+#keep their place and the time they entered it
+POSTS_MOVE = (
+    "UPDATE post SET status = ?1, moved = CURRENT_TIMESTAMP,"
+    " rank = json_extract(ranks.value, '$[1]')"
+    " FROM json_each(?2) AS ranks"
+    " WHERE post.id = json_extract(ranks.value, '$[0]') AND post.status <> ?1"
+)
+
+POST_DELETE = "DELETE FROM post WHERE id = ?"
+
+POSTS_DELETE = "DELETE FROM post WHERE id IN (SELECT value FROM json_each(?))"
+
+#full-text search, title matches weigh more than body matches
+SEARCH_POSTS = (
+    "SELECT p.id, p.title, p.body, p.created, p.author_id, p.status, p.rank"
+    " FROM post_fts JOIN post p ON p.id = post_fts.rowid"
+    " WHERE post_fts MATCH ? AND p.author_id = ?"
+    " ORDER BY bm25(post_fts, 10.0, 1.0), p.id DESC"
+    " LIMIT ? OFFSET ?"
+)
+
+SEARCH_INSERT_TRIGGER = "SELECT sql FROM sqlite_master WHERE name = 'post_fts_insert'"
+
+SEARCH_INDEX_AFTER = (
+    "INSERT INTO post_fts (rowid, title, body)"
+    " SELECT id, search_terms(author_id, title), search_terms(author_id, body)"
+    " FROM post WHERE id > ?"
+)
+
+#the index stores no text, rebuilding it indexes every post again
+SEARCH_CLEAR = "INSERT INTO post_fts (post_fts) VALUES ('delete-all')"
+
+SEARCH_OPTIMIZE = "INSERT INTO post_fts (post_fts) VALUES ('optimize')"
+
+#archive of old Done cards, paged by (created, id), newest first
+ARCHIVE_CANDIDATES = (
+    "SELECT id, author_id FROM post"
+    " WHERE status = 2 AND moved < datetime('now', ?)"
+    " ORDER BY moved"
+    " LIMIT ?"
+)
+
+ARCHIVE_POSTS = (
+    "INSERT INTO archive (id, author_id, created, moved, title, body)"
+    " SELECT id, author_id, created, moved, title, body"
+    " FROM post"
+    " WHERE id IN (SELECT value FROM json_each(?))"
+)
+
+ARCHIVE_FIRST = (
+    "SELECT id, title, body, created, author_id, 2 AS status, '' AS rank, moved, archived"
+    " FROM archive"
+    " WHERE author_id = ?"
+    " ORDER BY created DESC, id DESC"
+    " LIMIT ?"
+)
+
+ARCHIVE_PAGE = (
+    "SELECT id, title, body, created, author_id, 2 AS status, '' AS rank, moved, archived"
+    " FROM archive"
+    " WHERE author_id = ? AND (created, id) < (?, ?)"
+    " ORDER BY created DESC, id DESC"
+    " LIMIT ?"
+)
+
+ARCHIVE_GET = (
+    "SELECT id, title, body, created, author_id"
+    " FROM archive"
+    " WHERE author_id = ? AND id IN (SELECT value FROM json_each(?))"
+)
+
+#restored cards go back to Done as if they were just moved there
+ARCHIVE_RESTORE = (
+    "INSERT INTO post (id, title, body, created, author_id, rank, status, moved)"
+    " VALUES (?, ?, ?, ?, ?, ?, 2, CURRENT_TIMESTAMP)"
+)
+
+ARCHIVE_DELETE = (
+    "DELETE FROM archive"
+    " WHERE author_id = ? AND id IN (SELECT value FROM json_each(?))"
+)
+
+#leases of jobs run by one worker, taken when free, expired or already held
+LEASE_TAKE = (
+    "INSERT INTO lease (name, owner, expires) VALUES (?1, ?2, ?3 + ?4)"
+    " ON CONFLICT (name) DO UPDATE SET owner = ?2, expires = ?3 + ?4"
+    " WHERE lease.expires < ?3 OR lease.owner = ?2"
+    " RETURNING owner"
+)
+
+LEASE_RELEASE = "DELETE FROM lease WHERE name = ? AND owner = ?"
+
+#status history, logged in the transaction of every move, and the
+#daily flow of boards kept from it
+TRANSITIONS_LOG = (
+    "INSERT INTO post_transition (post_id, author_id, from_status, to_status, cycle)"
+    " SELECT p.id, p.author_id, p.status, ?3,"
+    " CASE WHEN ?3 = 2 THEN unixepoch('now') - unixepoch(COALESCE("
+    "(SELECT MIN(t.moved) FROM post_transition t WHERE t.post_id = p.id AND t.to_status = 1),"
+    " CASE p.status WHEN 1 THEN p.moved ELSE p.created END)) END"
+    " FROM post p"
+    " WHERE p.author_id = ?1 AND p.id IN (SELECT value FROM json_each(?2))"
+    " AND p.status IS NOT ?3"
+    " RETURNING from_status, to_status, cycle"
+)
+
+TRANSITIONS_CREATED = (
+    "INSERT INTO post_transition (post_id, author_id, to_status)"
+    " SELECT id, author_id, status FROM post"
+    " WHERE author_id = ? AND id IN (SELECT value FROM json_each(?))"
+    " RETURNING from_status, to_status, cycle"
+)
+
+TRANSITIONS_IMPORTED = (
+    "INSERT INTO post_transition (post_id, author_id, to_status)"
+    " SELECT id, author_id, status FROM post"
+    " WHERE author_id = ? AND id > ?"
+    " RETURNING from_status, to_status, cycle"
+)
+
+TRANSITIONS_GET = (
+    "SELECT from_status, to_status, moved, cycle FROM post_transition"
+    " WHERE post_id = ? AND author_id = ?"
+    " ORDER BY id"
+)
+
+#today's row starts from the columns of the board's last day
+FLOW_COUNT = (
+    "INSERT INTO flow_day (author_id, day, todo, doing, done, created, completed, cycle)"
+    " SELECT ?1, date('now'), COALESCE(MAX(todo), 0) + ?2, COALESCE(MAX(doing), 0) + ?3,"
+    " COALESCE(MAX(done), 0) + ?4, ?5, ?6, ?7"
+    " FROM (SELECT todo, doing, done FROM flow_day"
+    " WHERE author_id = ?1 ORDER BY day DESC LIMIT 1)"
+    " WHERE true"
+    " ON CONFLICT (author_id, day) DO UPDATE SET"
+    " todo = todo + ?2, doing = doing + ?3, done = done + ?4,"
+    " created = created + ?5, completed = completed + ?6, cycle = cycle + ?7"
+)
+
+#days of a window and the last day before it, which the window starts from
+FLOW_DAYS = (
+    "SELECT * FROM ("
+    " SELECT * FROM flow_day WHERE author_id = ?1 AND day < ?2 ORDER BY day DESC LIMIT 1)"
+    " UNION ALL"
+    " SELECT * FROM (SELECT * FROM flow_day WHERE author_id = ?1 AND day >= ?2 ORDER BY day)"
+)
+
+#users
+#only what the views need, the password hash stays in the database
+USER_GET = "SELECT id, username FROM user WHERE id = ?"
+
+USER_BY_NAME = "SELECT * FROM user WHERE username = ?"
+
+USER_CREATE = "INSERT INTO user (username, password) VALUES (?, ?)"
+
+USER_SET_PASSWORD = "UPDATE user SET password = ? WHERE id = ?"
@@ -0,0 +1,149 @@
+"""
+Rank keys ordering the cards of a column
+
+A card's rank is a string compared character by character, columns show
+the highest rank first. There is always a key between two others, so
+moving a card only writes the card's own row.
+
+Keys start with HEAD base 36 digits. Cards added at either end of a column
+get a head STEP away from the last one, cards placed between neighbours
+get the middle head or, once neighbours have adjacent heads, a fraction
+after it. Splitting the same gap again and again makes keys longer, spread
+gives a column evenly spaced keys again.
+
+"""
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+#digits of the head and the distance between heads of cards added at an end
+HEAD = 8
+STEP = BASE ** 3
+MIDDLE = BASE ** HEAD // 2
+
+#columns with a longer key are rebalanced
+MAX_LENGTH = 24
+
+
+def encode(number):
+    """
+    Head of a key
+
+    Parameters
+    -----------
+    number: from 0 to BASE ** HEAD - 1
+
+    Returns
+    -----------
+    HEAD digits string
+
+    """
+    digits = []
+    for _ in range(HEAD):
+        number, digit = divmod(number, BASE)
+        digits.append(DIGITS[digit])
+
+    return "".join(reversed(digits))
+
+
+def midpoint(low, high):
+    """
+    Fraction between two fractions
+
+    Fractions are the digits after the head, without trailing zeros.
+
+    Parameters
+    -----------
+    - low: lower fraction, "" for none
+    - high: higher fraction, None for no upper bound
+
+    Returns
+    -----------
+    Fraction strictly between low and high
+
+    """
+    if high is not None:
+        #digits both fractions share are kept as they are
+        shared = 0
+        while shared < len(high) and (low[shared] if shared < len(low) else "0") == high[shared]:
+            shared += 1
+        if shared:
+            return high[:shared] + midpoint(low[shared:], high[shared:])
+
+    digit_low = DIGITS.index(low[0]) if low else 0
+    digit_high = DIGITS.index(high[0]) if high is not None else BASE
+
+    if digit_high - digit_low > 1:
+        return DIGITS[(digit_low + digit_high) // 2]
+
+    if high is not None and len(high) > 1:
+        return high[0]
+
+    return DIGITS[digit_low] + midpoint(low[1:], None)
+
+
+def rank_between(low, high):
+    """
+    Key of a card placed between two others
+
+    Parameters
+    -----------
+    - low: rank of the card below, None or "" when there is none
+    - high: rank of the card above, None when there is none
+
+    Returns
+    -----------
+    Key sorting after low and before high, raises ValueError when the
+    column has no room left and must be spread first
+
+    """
+    low = low or None
+
+    if low is not None and high is not None and low >= high:
+        raise ValueError(f"No rank between {low!r} and {high!r}.")
+
+    if low is None and high is None:
+        return encode(MIDDLE)
+
+    if high is None:
+        head = int(low[:HEAD], BASE)
+        if head + STEP < BASE ** HEAD:
+            return encode(head + STEP)
+        return low[:HEAD] + midpoint(low[HEAD:], None)
+
+    if low is None:
+        head = int(high[:HEAD], BASE)
+        if head >= STEP:
+            return encode(head - STEP)
+        if high[HEAD:]:
+            return high[:HEAD] + midpoint("", high[HEAD:])
+        if head > 0:
+            return encode(head - 1)
+        raise ValueError(f"No rank below {high!r}.")
+
+    low_head = int(low[:HEAD], BASE)
+    high_head = int(high[:HEAD], BASE)
+
+    if high_head - low_head > 1:
+        return encode((low_head + high_head) // 2)
+
+    if high_head == low_head:
+        return low[:HEAD] + midpoint(low[HEAD:], high[HEAD:])
+
+    return low[:HEAD] + midpoint(low[HEAD:], None)
+
+
+def spread(count):
+    """
+    Evenly spaced keys for a whole column
+
+    Parameters
+    -----------
+    count: number of cards
+
+    Returns
+    -----------
+    List of keys, highest first
+
+    """
+    top = MIDDLE + count // 2 * STEP
+    return [encode(top - n * STEP) for n in range(count)]
@@ -0,0 +1,229 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+def refill(tokens, updated, now, capacity, rate):
+    """
+    Tokens in a bucket after refilling it since its last update
+
+    Parameters
+    -----------
+    - tokens: tokens left at the last update
+    - updated: time of the last update
+    - now: current time
+    - capacity: largest number of tokens the bucket holds
+    - rate: tokens added per second
+
+    Returns
+    -----------
+    Current number of tokens
+
+    """
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def spend(tokens, rate):
+    """
+    Take one token from a refilled bucket
+
+    Parameters
+    -----------
+    - tokens: current number of tokens
+    - rate: tokens added per second
+
+    Returns
+    -----------
+    (allowed, tokens left, seconds until the next token)
+
+    """
+    if tokens >= 1:
+        return True, tokens - 1, 0
+
+    return False, tokens, math.ceil((1 - tokens) / rate)
+
+
+class MemoryStore:
+    """
+    Token buckets kept in the memory of one process
+
+    Parameters
+    -----------
+    maxsize: number of buckets kept, the least recently used go first
+
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """
+        Take a token from a bucket
+
+        Parameters
+        -----------
+        - key: bucket name
+        - capacity: largest number of tokens the bucket holds
+        - rate: tokens added per second
+
+        Returns
+        -----------
+        (allowed, seconds to wait before retrying)
+
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            allowed, tokens, retry = spend(refill(tokens, updated, now, capacity, rate), rate)
+            self._buckets[key] = (tokens, now)
+
+            #forgetting a bucket only makes it full again
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+        return allowed, retry
+
+
+class SQLiteStore:
+    """
+    Token buckets in a local SQLite file shared by all worker processes
+
+    Buckets that had time to refill are deleted every prune_every calls, a
+    missing bucket is a full one, so the file only holds recent keys. When
+    the file stays locked for longer than the busy timeout, attempts are
+    refused with a retry after one second.
+
+    Parameters
+    -----------
+    - path: file holding the buckets
+    - prune_every: calls between deletions of refilled buckets
+
+    """
+
+    def __init__(self, path, prune_every=1000):
+        self.path = path
+        self.pid = os.getpid()
+        self.prune_every = prune_every
+        self._calls = 0
+        #seconds the slowest bucket seen needs to refill from empty
+        self._refill = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("PRAGMA busy_timeout = 1000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS bucket ("
+            " key TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS bucket_updated ON bucket (updated)")
+
+    def take(self, key, capacity, rate):
+        now = time.time()
+
+        with self._lock:
+            self._refill = max(self._refill, capacity / rate)
+            self._calls += 1
+
+            #the write lock keeps other processes from spending the same token,
+            #when it cannot be taken there is no transaction to roll back
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                #still locked after busy_timeout, the attempt is turned away
+                #like one over the limit rather than failing the request
+                if "locked" not in str(e):
+                    raise
+                return False, 1
+
+            try:
+                row = self._db.execute(
+                    "SELECT tokens, updated FROM bucket WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row or (capacity, now)
+                allowed, tokens, retry = spend(refill(tokens, updated, now, capacity, rate), rate)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                if self._calls % self.prune_every == 0:
+                    self._db.execute(
+                        "DELETE FROM bucket WHERE updated < ?", (now - self._refill,)
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        return allowed, retry
+
+    def close(self):
+        self._db.close()
+
+
+def get_store():
+    """
+    Rate limit store of the current application
+
+    RATELIMIT_STORAGE is "memory" for per-process buckets or "sqlite" to
+    share them between the workers of one machine through RATELIMIT_DATABASE.
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    Store with a take method
+
+    """
+    store = current_app.extensions.get("ratelimit")
+
+    if store is None or getattr(store, "pid", os.getpid()) != os.getpid():
+        kind = current_app.config["RATELIMIT_STORAGE"]
+
+        if kind == "memory":
+            store = MemoryStore()
+        elif kind == "sqlite":
+            path = current_app.config["RATELIMIT_DATABASE"] or os.path.join(
+                current_app.instance_path, "ratelimit.sqlite"
+            )
+            store = SQLiteStore(path)
+        else:
+            raise ValueError(f"Unknown RATELIMIT_STORAGE {kind!r}.")
+
+        current_app.extensions["ratelimit"] = store
+
+    return store
+
+
+def hit(key, limit):
+    """
+    Count one attempt against a limit
+
+    Parameters
+    -----------
+    - key: bucket name, e.g. "ip:10.0.0.1"
+    - limit: (burst, tokens added per second) tuple
+
+    Returns
+    -----------
+    Seconds to wait when over the limit, 0 when the attempt is allowed
+
+    """
+    if not current_app.config["RATELIMIT_ENABLED"]:
+        return 0
+
+    capacity, rate = limit
+    allowed, retry = get_store().take(key, capacity, rate)
+    return 0 if allowed else retry
@@ -1,8 +1,16 @@
 -- Initialize the database.
 -- Drop any existing data and create empty tables.
+-- Indexes and later schema changes live in migrations/.
 
+DROP TABLE IF EXISTS post_fts;
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS board;
+DROP TABLE IF EXISTS archive;
+DROP TABLE IF EXISTS post_transition;
+DROP TABLE IF EXISTS flow_day;
+DROP TABLE IF EXISTS lease;
+DROP TABLE IF EXISTS schema_version;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
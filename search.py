@@ -0,0 +1,154 @@
+from collections import namedtuple
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+
+import queries
+from db import SEARCH_WORD, board_databases, get_board_db, get_db, search_terms
+
+#one page of search results and the number of the next page, None at the end
+Results = namedtuple("Results", ["posts", "next"])
+
+
+def match_query(author_id, text):
+    """
+    Turn what a user typed into an FTS5 query over the user's board
+
+    Every word must appear in the title or body, the last one as a prefix
+    so results show up while typing. Words are quoted, so operators and
+    punctuation in the input are searched for instead of parsed.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - text: search box input
+
+    Returns
+    -----------
+    FTS5 MATCH expression, None when the input has no words
+
+    """
+    if not SEARCH_WORD.search(text):
+        return None
+
+    terms = [f'"{term}"' for term in search_terms(author_id, text).split()]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_posts(author_id, text, page=1, limit=None):
+    """
+    Find a user's posts by the words of their title and body
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - text: search box input
+    - page: page of results, starting at 1
+    - limit: results per page, SEARCH_PAGE_SIZE when None
+
+    Returns
+    -----------
+    Results, best matches first
+
+    """
+    query = match_query(author_id, text)
+    if query is None:
+        return Results([], None)
+
+    if limit is None:
+        limit = current_app.config["SEARCH_PAGE_SIZE"]
+
+    #one extra row tells whether there is a next page
+    rows = get_board_db(author_id).execute(
+        queries.SEARCH_POSTS, (query, author_id, limit + 1, (page - 1) * limit)
+    ).fetchall()
+
+    return Results(rows[:limit], page + 1 if len(rows) > limit else None)
+
+
+@contextmanager
+def bulk_insert(db):
+    """
+    Index posts inserted inside the block with one statement at its end
+
+    The per-row insert trigger costs far more than indexing the rows in
+    bulk. It is dropped and created again within the caller's transaction,
+    so other connections never see the table without it. Only inserts may
+    happen inside the block. When it fails, the block is rolled back to a
+    savepoint, so the trigger is back and the rest of the caller's
+    transaction, e.g. other writes of the pipeline's batch, is kept.
+
+    Parameters
+    -----------
+    db: connection the posts are inserted with
+
+    Returns
+    -----------
+    None
+
+    """
+
+    #sqlite3 would commit the DROP TRIGGER at once outside a transaction
+    if not db.in_transaction:
+        db.execute("BEGIN")
+
+    trigger = db.execute(queries.SEARCH_INSERT_TRIGGER).fetchone()["sql"]
+    last_id = db.execute(queries.POST_LAST_ID).fetchone()[0]
+
+    db.execute("SAVEPOINT bulk_insert")
+    db.execute("DROP TRIGGER post_fts_insert")
+    try:
+        yield
+    except Exception:
+        db.execute("ROLLBACK TO bulk_insert")
+        db.execute("RELEASE bulk_insert")
+        raise
+
+    db.execute(queries.SEARCH_INDEX_AFTER, (last_id,))
+    db.execute(trigger)
+    db.execute("RELEASE bulk_insert")
+
+
+def rebuild_index():
+    """
+    Index every post again from the post table of every board database
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    for shard in board_databases():
+        db = get_db(shard)
+        db.execute(queries.SEARCH_CLEAR)
+        db.execute(queries.SEARCH_INDEX_AFTER, (0,))
+        db.execute(queries.SEARCH_OPTIMIZE)
+        db.commit()
+
+
+@click.command("rebuild-search")
+def rebuild_search_command():
+    """
+    Rebuild the full-text search index of all posts
+
+    Parameters
+    -----------
+    None
+
+    Returns
+    -----------
+    None
+
+    """
+    rebuild_index()
+    click.echo("Rebuilt the search index.")
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_search_command)
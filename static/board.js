@@ -0,0 +1,191 @@
+// Keeps the board page in sync with the Server-Sent Events of api.events
+// instead of reloading the whole page after every change.
+(function () {
+  var script = document.currentScript;
+  var labels = { todo: "To Do", doing: "Doing", done: "Done" };
+
+  function column(status) {
+    return document.querySelector('.column[data-status="' + status + '"]');
+  }
+
+  function findCard(id) {
+    return document.querySelector('.task_block[data-id="' + id + '"]');
+  }
+
+  function moveForm(id, target) {
+    var inner = document.createElement("div");
+    inner.className = "inner";
+    inner.innerHTML = '<form method="post"><input type="submit"></form>';
+    var form = inner.firstChild;
+    form.action = "/" + id + "/move_" + target;
+    form.firstChild.className = "head_" + target;
+    form.firstChild.value = labels[target];
+    return inner;
+  }
+
+  function render(card) {
+    var block = document.createElement("div");
+    block.className = "task_block";
+    block.dataset.id = card.id;
+    block.dataset.created = card.created;
+    block.dataset.rank = card.rank;
+    block.draggable = true;
+    block.innerHTML =
+      '<article class="post"><header><div><a><h1></h1></a></div></header>' +
+      "<a><p></p></a></article>" +
+      '<div id="button"></div>';
+    block.querySelectorAll("a").forEach(function (a) {
+      a.href = "/" + card.id + "/update";
+    });
+    block.querySelector("h1").textContent = card.title;
+    block.querySelector("p").textContent = card.body;
+    return block;
+  }
+
+  function above(block, other) {
+    // columns are ordered by rank then id, highest first, as board.load_board returns them
+    if (block.dataset.rank !== other.dataset.rank) {
+      return block.dataset.rank > other.dataset.rank;
+    }
+    return Number(block.dataset.id) > Number(other.dataset.id);
+  }
+
+  function place(block, status) {
+    var buttons = block.querySelector("#button");
+    buttons.innerHTML = "";
+    Object.keys(labels).forEach(function (target) {
+      if (target !== status) {
+        buttons.appendChild(moveForm(block.dataset.id, target));
+      }
+    });
+
+    var target = column(status);
+    var before = null;
+    target.querySelectorAll(".task_block").forEach(function (other) {
+      if (!before && other !== block && above(block, other)) {
+        before = other;
+      }
+    });
+    if (!before) {
+      var end = target.querySelector(".load_more, .kanban__add-item");
+      before = end && end.closest(".column > *");
+    }
+    target.insertBefore(block, before);
+  }
+
+  var handlers = {
+    created: function (data) {
+      data.cards.forEach(function (card) {
+        if (!findCard(card.id)) {
+          place(render(card), card.status);
+        }
+      });
+    },
+    updated: function (data) {
+      data.cards.forEach(function (card) {
+        var block = findCard(card.id);
+        if (block) {
+          block.querySelector("h1").textContent = card.title;
+          block.querySelector("p").textContent = card.body;
+        }
+      });
+    },
+    moved: function (data) {
+      data.cards.forEach(function (card) {
+        var block = findCard(card.id);
+        if (block) {
+          block.dataset.rank = card.rank;
+          place(block, data.status);
+        }
+      });
+    },
+    deleted: function (data) {
+      data.ids.forEach(function (id) {
+        var block = findCard(id);
+        if (block) {
+          block.remove();
+        }
+      });
+    },
+    resync: function () {
+      window.location.reload();
+    },
+  };
+
+  // move buttons post in the background, the event stream moves the card
+  document.addEventListener("submit", function (event) {
+    var form = event.target;
+    var block = form.closest(".task_block");
+    if (!block || !/\/move_\w+$/.test(form.action)) {
+      return;
+    }
+    event.preventDefault();
+    fetch("/move", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        ids: [Number(block.dataset.id)],
+        status: form.action.split("move_").pop(),
+      }),
+    }).then(function (response) {
+      if (!response.ok) {
+        form.submit();
+      }
+    });
+  });
+
+  // dropped cards post their neighbours, the event stream moves the card
+  document.addEventListener("dragstart", function (event) {
+    var block = event.target.closest && event.target.closest(".task_block");
+    if (block) {
+      event.dataTransfer.setData("text/plain", block.dataset.id);
+    }
+  });
+
+  document.addEventListener("dragover", function (event) {
+    if (event.target.closest && event.target.closest(".column")) {
+      event.preventDefault();
+    }
+  });
+
+  document.addEventListener("drop", function (event) {
+    var target = event.target.closest && event.target.closest(".column");
+    var id = event.dataTransfer.getData("text/plain");
+    if (!target || !id) {
+      return;
+    }
+    event.preventDefault();
+
+    var position = { status: target.dataset.status };
+    var cards = Array.prototype.filter.call(
+      target.querySelectorAll(".task_block"),
+      function (other) {
+        return other.dataset.id !== id;
+      }
+    );
+    var next = cards.find(function (other) {
+      var box = other.getBoundingClientRect();
+      return event.clientY < box.top + box.height / 2;
+    });
+    if (next) {
+      position.below = Number(next.dataset.id);
+    } else if (cards.length) {
+      position.above = Number(cards[cards.length - 1].dataset.id);
+    }
+
+    fetch("/api/v1/cards/" + id + "/position", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(position),
+    });
+  });
+
+  if (window.EventSource) {
+    var source = new EventSource(script.dataset.events);
+    Object.keys(handlers).forEach(function (name) {
+      source.addEventListener(name, function (event) {
+        handlers[name](JSON.parse(event.data));
+      });
+    });
+  }
+})();
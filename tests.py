@@ -1,8 +1,29 @@
+import asyncio
+import glob
+import json
 import os
+import sqlite3
 import unittest
+import shutil
 import tempfile
+import threading
+import time
+import archive
+import queries
 from app import create_app
-from db import get_db, init_db
+from asgi import create_asgi_app
+from auth import forget_user, get_user_cache
+from cache import FileCache, MemoryCache, get_cache
+from board import board_version
+from db import (
+    SHARD_ID_BITS, get_db, get_pool, init_db, list_migrations, migrate, register_functions,
+    schema_version, shard_index,
+)
+from events import board_channel, get_broker
+from metrics import Counter, Gauge, Registry
+from passwords import PasswordHasher, get_hasher
+from ranks import MAX_LENGTH, rank_between, spread
+from ratelimit import SQLiteStore
 
 
 class TestDatabase(unittest.TestCase):
@@ -52,8 +73,18 @@ class TestDatabase(unittest.TestCase):
         
         """
 
+        #closing pooled connections removes the WAL files
+        for writer in self.app.extensions.get("db_writers", {}).values():
+            writer.close()
+        with self.app.app_context():
+            get_pool().close()
+        for pool in self.app.extensions.get("db_shard_pools", {}).values():
+            pool.close()
+
         os.close(self.db_fd)
         os.unlink(self.db_path)
+        for path in glob.glob(f"{self.db_path}-shard*"):
+            os.unlink(path)
 
 
     def test_get_users(self):
@@ -127,6 +158,158 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(response.status_code, 302)
 
 
+    def test_user_cache(self):
+        """
+        Checks if the logged in user is loaded once and skipped for static files
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.get("/create")
+        self.client.get("/create")
+        self.client.get("/static/style.css")
+
+        with self.app.app_context():
+            cache = get_user_cache()
+            self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 1))
+            self.assertEqual(cache.get(1), {"id": 1, "username": "test"})
+
+            #changed accounts are read again
+            forget_user(1)
+            self.assertIsNone(cache.get(1))
+
+
+    def test_password_rehash(self):
+        """
+        Checks if passwords hashed with old parameters are upgraded on login
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        with self.app.app_context():
+            pwhash = get_db().execute("SELECT password FROM user WHERE id = 1").fetchone()[0]
+            self.assertTrue(pwhash.startswith("pbkdf2:sha256:1000$"))
+            self.assertFalse(get_hasher().needs_rehash(pwhash))
+
+        #the new hash still accepts the password
+        self.client.get("/auth/logout")
+        response = self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.assertEqual(response.headers["Location"], "/")
+
+        #methods without a cost compare with the cost werkzeug writes
+        hasher = PasswordHasher("pbkdf2:sha256")
+        self.assertFalse(hasher.needs_rehash(hasher.hash("secret")))
+        self.assertTrue(hasher.needs_rehash(pwhash))
+
+
+    def test_hashing_busy(self):
+        """
+        Checks if sign-ins are turned away when the hasher is saturated
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.app.config["PASSWORD_HASH_QUEUE"] = 0
+
+        response = self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+        response = self.client.post("/auth/register", data={"username": "new", "password": "new"})
+        self.assertEqual(response.status_code, 503)
+
+        #hashing in worker processes gives the same results
+        hasher = PasswordHasher("pbkdf2:sha256:1000", workers=1)
+        try:
+            self.assertTrue(hasher.verify(hasher.hash("secret"), "secret"))
+        finally:
+            hasher.close()
+
+
+    def test_login_rate_limit(self):
+        """
+        Checks if repeated login attempts are turned away
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        for _ in range(5):
+            response = self.client.post("/auth/login", data={"username": "test", "password": "wrong"})
+            self.assertEqual(response.status_code, 200)
+
+        #even the right password is refused until the bucket refills
+        response = self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers["Retry-After"]), 0)
+
+        #other accounts are not affected
+        response = self.client.post("/auth/login", data={"username": "other", "password": "other"})
+        self.assertEqual(response.status_code, 302)
+
+        #buckets in a shared file are seen by every worker
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ratelimit.sqlite")
+            first, second = SQLiteStore(path), SQLiteStore(path)
+            self.assertTrue(first.take("ip:1", 2, 0.001)[0])
+            self.assertTrue(second.take("ip:1", 2, 0.001)[0])
+            self.assertFalse(first.take("ip:1", 2, 0.001)[0])
+            first.close()
+            second.close()
+
+            #refilled buckets of random usernames do not pile up
+            store = SQLiteStore(path, prune_every=10)
+            for n in range(100):
+                store.take(f"user:{n}", 1, 1000.0)
+                time.sleep(0.001)
+            count = store._db.execute("SELECT COUNT(*) FROM bucket").fetchone()[0]
+            self.assertLess(count, 20)
+
+            #a store locked by another process answers 429 instead of failing
+            self.app.config["RATELIMIT_STORAGE"] = "sqlite"
+            self.app.config["RATELIMIT_DATABASE"] = path
+            self.app.extensions.pop("ratelimit")
+            locker = sqlite3.connect(path, isolation_level=None)
+            locker.execute("BEGIN IMMEDIATE")
+            try:
+                self.assertEqual(store.take("ip:2", 2, 0.001), (False, 1))
+                response = self.client.post("/auth/login", data={"username": "other", "password": "other"})
+                self.assertEqual(response.status_code, 429)
+            finally:
+                locker.execute("ROLLBACK")
+                locker.close()
+            self.assertTrue(store.take("ip:2", 2, 0.001)[0])
+            store.close()
+            self.app.extensions.pop("ratelimit").close()
+
+
     def test_logout(self):
         """
         Checks user is successfully logged out and redirected to Login page
@@ -171,6 +354,229 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(response2.status_code, 200)
 
 
+    def test_index(self):
+        """
+        Checks if Index page shows only current user's tasks in their categories
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        #anonymous users are sent to register first
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 302)
+
+        with self.app.app_context():
+            db = get_db()
+            db.execute(
+                "INSERT INTO post (title, body, author_id, status) VALUES (?, ?, ?, ?)",
+                ("other title", "other body", 2, 0),
+            )
+            db.execute(
+                "INSERT INTO post (title, body, author_id, status) VALUES (?, ?, ?, ?)",
+                ("done title", "done body", 1, 2),
+            )
+            db.commit()
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+
+        #only test user's tasks are shown, To Do before Done
+        page = response.get_data(as_text=True)
+        self.assertIn("test title", page)
+        self.assertIn("done title", page)
+        self.assertNotIn("other title", page)
+        self.assertLess(page.index("test title"), page.index("done title"))
+
+
+    def test_pagination(self):
+        """
+        Checks if long categories are split into pages that follow each other
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.app.config["BOARD_PAGE_SIZE"] = 2
+
+        with self.app.app_context():
+            db = get_db()
+            db.executemany(
+                "INSERT INTO post (title, body, author_id, status, created) VALUES (?, ?, ?, ?, ?)",
+                [(f"done {n}", "", 1, 2, "2019-01-01 00:00:00") for n in range(5)],
+            )
+            db.commit()
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        #walk the Done category through the API, newest first
+        response = self.client.get("/api/v1/board")
+        data = response.get_json()
+        titles = [card["title"] for card in data["done"]]
+        cursor = data["cursors"]["done"]
+        self.assertIsNone(data["cursors"]["todo"])
+
+        while cursor:
+            response = self.client.get("/api/v1/board/done", query_string={"cursor": cursor})
+            data = response.get_json()
+            titles += [card["title"] for card in data["cards"]]
+            cursor = data["cursor"]
+
+        self.assertEqual(titles, [f"done {n}" for n in range(4, -1, -1)])
+
+        #the board page links to the next page of the category
+        page = self.client.get("/").get_data(as_text=True)
+        self.assertIn("Load more", page)
+        self.assertNotIn("done 2", page)
+
+        response = self.client.get("/column/done", query_string={"cursor": ",5", "limit": 10})
+        page = response.get_data(as_text=True)
+        self.assertIn("done 2", page)
+        self.assertNotIn("done 3", page)
+
+        response = self.client.get("/column/done", query_string={"cursor": "broken"})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_etag(self):
+        """
+        Checks if an unchanged board is answered with 304 Not Modified
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        response = self.client.get("/")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        #every change bumps the board's version
+        self.client.post("/1/move_doing")
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertIsNotNone(response.last_modified)
+
+        #other users' changes leave the board alone
+        etag = response.headers["ETag"]
+        self.client.get("/auth/logout")
+        self.client.post("/auth/login", data={"username": "other", "password": "other"})
+        self.client.post("/create", data={"title": "other", "body": ""})
+        self.client.get("/auth/logout")
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+
+    def test_board_cache(self):
+        """
+        Checks if the rendered board is reused until the board changes
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.get("/")
+        self.client.get("/")
+
+        with self.app.app_context():
+            stats = get_cache().stats()
+            self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        #changes drop the cached page, so the next load shows them
+        self.client.post("/create", data={"title": "fresh", "body": ""})
+        self.assertIn("fresh", self.client.get("/").get_data(as_text=True))
+
+        with self.app.app_context():
+            self.assertEqual(get_cache().stats()["misses"], 2)
+
+
+    def test_cache_backends(self):
+        """
+        Checks if cache backends evict and expire entries
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        cache = MemoryCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        #b was the least recently used entry
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache.ttl = -1
+        cache.set("d", 4)
+        self.assertIsNone(cache.get("d"))
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory, maxsize=2, ttl=60)
+            cache.set("a", "page a")
+            self.assertEqual(cache.get("a"), "page a")
+
+            #another worker sees the same entries
+            shared = FileCache(directory, maxsize=2, ttl=60)
+            self.assertEqual(shared.get("a"), "page a")
+
+            shared.delete("a")
+            self.assertIsNone(cache.get("a"))
+
+            for key in "bcd":
+                cache.set(key, key)
+            self.assertEqual(cache.stats()["size"], 2)
+
+            #the size is only checked every evict_every writes
+            cache = FileCache(directory, maxsize=2, ttl=60, evict_every=3)
+            for key in "efg":
+                cache.set(key, key)
+            self.assertEqual(cache.stats()["size"], 2)
+            cache.set("h", "h")
+            self.assertEqual(cache.stats()["size"], 3)
+
+            #values that cannot be stored leave no temporary file behind
+            with self.assertRaises(Exception):
+                cache.set("lock", threading.Lock())
+            self.assertEqual(glob.glob(os.path.join(directory, "*.tmp")), [])
+
+
     def test_create(self):
         """
         Checks if task is created correctly
@@ -303,6 +709,61 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(post["status"], 0)
 
 
+    def test_move(self):
+        """
+        Checks if several tasks are moved at once and only by their author
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            db = get_db()
+            db.executemany(
+                "INSERT INTO post (title, body, author_id, status) VALUES (?, ?, ?, ?)",
+                [("second", "", 1, 0), ("third", "", 1, 1), ("other", "", 2, 0)],
+            )
+            db.commit()
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        #JSON requests get a compact result
+        response = self.client.post("/move", json={"ids": [1, 2, 3], "status": "done"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"status": "done", "moved": [1, 2, 3]})
+
+        #form requests are redirected to Index page
+        response = self.client.post("/move", data={"id": ["1", "2"], "status": "doing"})
+        self.assertEqual(response.status_code, 302)
+
+        #nothing moves when one of the tasks belongs to another user
+        response = self.client.post("/move", json={"ids": [3, 4], "status": "todo"})
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post("/move", json={"ids": [1, 99], "status": "todo"})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post("/move", json={"ids": [1], "status": "later"})
+        self.assertEqual(response.status_code, 400)
+
+        #a string is not a list of ids and an empty list writes nothing
+        with self.app.app_context():
+            version = board_version(1)
+        for body in ({"ids": "12", "status": "done"}, {"ids": [], "status": "done"}):
+            self.assertEqual(self.client.post("/move", json=body).status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(board_version(1), version)
+
+        with self.app.app_context():
+            rows = get_db().execute("SELECT id, status FROM post ORDER BY id").fetchall()
+            self.assertEqual([row["status"] for row in rows], [1, 1, 2, 0])
+
+
     def test_delete(self):
         """
         Checks if task is deleted correctly
@@ -327,5 +788,1115 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(post, None)
 
 
+    def test_migrate(self):
+        """
+        Checks if migrations upgrade an existing database without losing data
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            db = get_db()
+            latest = list_migrations()[-1][0]
+            self.assertEqual(schema_version(), latest)
+
+            #simulate a database created before migrations existed
+            with self.app.open_resource("schema.sql") as f:
+                db.executescript(f.read().decode("utf8"))
+            with self.app.open_resource("data.sql") as f:
+                db.executescript(f.read().decode("utf8"))
+
+            self.assertEqual(schema_version(), 0)
+            self.assertEqual(len(migrate()), len(list_migrations()))
+            self.assertEqual(schema_version(), latest)
+
+            #running again is a no-op and keeps existing posts
+            self.assertEqual(migrate(), [])
+            post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
+            self.assertEqual(post["title"], "test title")
+            self.assertEqual(post["moved"], post["created"])
+            #existing cards get the fixed width keys of a spread column
+            self.assertEqual(post["rank"], spread(1)[0])
+
+
+    def test_migrate_workers(self):
+        """
+        Checks if workers starting together upgrade a database once
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            db = get_db()
+            with self.app.open_resource("schema.sql") as f:
+                db.executescript(f.read().decode("utf8"))
+            with self.app.open_resource("data.sql") as f:
+                db.executescript(f.read().decode("utf8"))
+
+        errors = []
+        apps = []
+
+        def boot():
+            try:
+                apps.append(create_app({"TESTING": True, "DATABASE": self.db_path}))
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=boot) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        for app in apps:
+            app.extensions["db_pool"].close()
+        self.assertEqual(errors, [])
+        with self.app.app_context():
+            db = get_db()
+            versions = db.execute("SELECT version FROM schema_version").fetchall()
+            self.assertEqual(len(versions), len(list_migrations()))
+            self.assertEqual(db.execute("SELECT title FROM post").fetchone()[0], "test title")
+
+
+    def test_query_plans(self):
+        """
+        Checks if board, task and login lookups are served by indexes
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        def plan(sql, params):
+            rows = get_db().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            return " ".join(row["detail"] for row in rows)
+
+        with self.app.app_context():
+            board = plan(queries.BOARD_PAGE, (1, 50))
+            self.assertEqual(board.count("INDEX post_author_status_rank_id"), 3)
+            self.assertNotIn("TEMP B-TREE", board)
+
+            column = plan(queries.COLUMN_PAGE, (1, 0, "", 1, 50))
+            self.assertIn("INDEX post_author_status_rank_id", column)
+            self.assertNotIn("TEMP B-TREE", column)
+
+            task = plan(queries.POST_GET, (1,))
+            self.assertIn("INTEGER PRIMARY KEY", task)
+
+            login = plan(queries.USER_BY_NAME, ("test",))
+            self.assertIn("USING INDEX sqlite_autoindex_user_1", login)
+
+
+    def test_restart(self):
+        """
+        Checks if creating the app again keeps existing data
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        app = create_app({"TESTING": True, "DATABASE": self.db_path})
+
+        with app.app_context():
+            db = get_db()
+            self.assertEqual(schema_version(), list_migrations()[-1][0])
+
+            rows = db.execute("SELECT * FROM user").fetchall()
+            self.assertEqual(len(rows), 2)
+
+        with app.app_context():
+            get_pool().close()
+
+
+    def test_pool(self):
+        """
+        Checks if connections are tuned and reused between app contexts
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            first = get_db()
+            mode = first.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(mode, "wal")
+
+        with self.app.app_context():
+            pool = get_pool()
+            hits = pool.stats()["hits"]
+            self.assertIs(get_db(), first)
+            self.assertEqual(pool.stats()["hits"], hits + 1)
+
+            #a full pool makes callers wait and eventually fail
+            pool.timeout = 0.01
+            taken = [pool.acquire() for _ in range(pool.size - 1)]
+            with self.assertRaises(sqlite3.OperationalError):
+                pool.acquire()
+            self.assertEqual(pool.stats()["waits"], 1)
+
+            for db in taken:
+                pool.release(db)
+
+
+    def test_statement_cache(self):
+        """
+        Checks if repeated page loads reuse prepared statements
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.get("/")
+
+        with self.app.app_context():
+            before = get_pool().stats()
+
+        self.client.get("/")
+
+        #the second load only runs statements that are already prepared
+        with self.app.app_context():
+            after = get_pool().stats()
+            self.assertGreater(after["statement_hits"], before["statement_hits"])
+            self.assertEqual(after["statement_misses"], before["statement_misses"])
+
+
+    def test_api(self):
+        """
+        Checks if cards are read and changed through the JSON API
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        response = self.client.get("/api/v1/board")
+        self.assertEqual(response.status_code, 401)
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        response = self.client.get("/api/v1/board")
+        self.assertEqual([card["title"] for card in response.get_json()["todo"]], ["test title"])
+
+        #single and bulk creation
+        response = self.client.post("/api/v1/cards", json={"title": "one", "status": "doing"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()["status"], "doing")
+
+        response = self.client.post("/api/v1/cards", json=[{"title": "two"}, {"title": "three"}])
+        ids = [card["id"] for card in response.get_json()]
+        self.assertEqual(len(ids), 2)
+
+        response = self.client.post("/api/v1/cards", json={"body": "no title"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "Title is required.")
+
+        #values of the wrong type are client errors, not server errors
+        for body in (
+            {"title": ["x"]}, {"title": "x", "body": {"a": 1}}, {"title": "x", "status": ["todo"]}
+        ):
+            self.assertEqual(self.client.post("/api/v1/cards", json=body).status_code, 400)
+            self.assertEqual(self.client.patch("/api/v1/cards/1", json=body).status_code, 400)
+
+        response = self.client.patch("/api/v1/cards/1", json={"title": "renamed", "status": "done"})
+        self.assertEqual(response.get_json()["title"], "renamed")
+        self.assertEqual(response.get_json()["status"], "done")
+
+        response = self.client.post("/api/v1/cards/move", json={"ids": ids, "status": "done"})
+        self.assertEqual(response.get_json()["moved"], ids)
+
+        response = self.client.get("/api/v1/board")
+        self.assertEqual(len(response.get_json()["done"]), 3)
+
+        response = self.client.post("/api/v1/cards/delete", json={"ids": ids})
+        self.assertEqual(response.get_json()["deleted"], ids)
+
+        response = self.client.delete("/api/v1/cards/1")
+        self.assertEqual(response.status_code, 204)
+
+        response = self.client.get("/api/v1/cards/1")
+        self.assertEqual(response.status_code, 404)
+
+        #other users' cards are off limits
+        with self.app.app_context():
+            db = get_db()
+            db.execute(
+                "INSERT INTO post (title, body, author_id, status) VALUES (?, ?, ?, ?)",
+                ("other", "", 2, 0),
+            )
+            db.commit()
+
+        response = self.client.get("/api/v1/board")
+        self.assertEqual(len(response.get_json()["doing"]), 1)
+
+        response = self.client.post("/api/v1/cards/delete", json={"ids": [ids[-1] + 1]})
+        self.assertEqual(response.status_code, 403)
+
+        #booleans are not ids and empty lists are rejected
+        for body in ({"ids": [True], "status": "done"}, {"ids": [], "status": "done"}):
+            for path in ("/api/v1/cards/move", "/api/v1/cards/delete"):
+                self.assertEqual(self.client.post(path, json=body).status_code, 400)
+        self.assertEqual(len(self.client.get("/api/v1/board").get_json()["doing"]), 1)
+
+
+    def test_asgi(self):
+        """
+        Checks if the async server passes requests to Flask and long-polls boards
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        asgi_app = create_asgi_app(self.app)
+
+        def call(path, query=b"", cookie=b"", method="GET", chunks=(b"",)):
+            scope = {
+                "type": "http", "method": method, "path": path, "query_string": query,
+                "headers": [(b"cookie", cookie)], "client": ("127.0.0.1", 1),
+            }
+            messages = []
+            body = list(chunks)
+
+            async def receive():
+                chunk = body.pop(0)
+                return {"type": "http.request", "body": chunk, "more_body": bool(body)}
+
+            async def send(message):
+                messages.append(message)
+
+            asyncio.run(asgi_app(scope, receive, send))
+            body = b"".join(m.get("body", b"") for m in messages[1:])
+            return messages[0]["status"], body
+
+        status, body = call("/auth/login")
+        self.assertEqual(status, 200)
+        self.assertIn(b"Log In", body)
+
+        status, body = call("/api/v1/board/wait")
+        self.assertEqual(status, 401)
+
+        #log in through Flask and reuse its session cookie
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.post("/1/move_doing")
+        session = next(c for c in self.client.cookie_jar if c.name == "session")
+        cookie = f"session={session.value}".encode()
+
+        status, body = call("/api/v1/board/wait", b"version=0", cookie)
+        self.assertEqual(json.loads(body), {"version": 1, "changed": True})
+
+        status, body = call("/api/v1/board/wait", b"version=1&timeout=0.1", cookie)
+        self.assertEqual(json.loads(body), {"version": 1, "changed": False})
+
+        #a waiting poll wakes up with the board's next event
+        timer = threading.Timer(0.2, self.client.post, ("/1/move_done",))
+        timer.start()
+        started = time.monotonic()
+        status, body = call("/api/v1/board/wait", b"version=1&timeout=10", cookie)
+        timer.join()
+        self.assertEqual(json.loads(body), {"version": 2, "changed": True})
+        self.assertLess(time.monotonic() - started, 5)
+
+        #request bodies are read as the view consumes them, up to MAX_CONTENT_LENGTH
+        chunks = [b"title\n", b"first\n", b"second\n"]
+        status, body = call("/api/v1/board/import", b"format=csv", cookie, "POST", chunks)
+        self.assertEqual(json.loads(body), {"imported": 2})
+        self.app.config["MAX_CONTENT_LENGTH"] = 10
+        status, body = call("/api/v1/board/import", b"format=csv", cookie, "POST", chunks)
+        self.assertEqual(status, 413)
+
+        asgi_app.close()
+
+    def test_events(self):
+        """
+        Checks if board changes are streamed to open views of the board
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.assertEqual(self.client.get("/api/v1/board/events").status_code, 401)
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        response = self.client.get("/api/v1/board/events", buffered=False)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        stream = iter(response.response)
+        self.assertEqual(next(stream), b"retry: 3000\n\n")
+
+        #changes made by another client of the same user
+        other = self.app.test_client()
+        other.post("/auth/login", data={"username": "test", "password": "test"})
+        other.post("/move", json={"ids": [1], "status": "doing"})
+        other.post("/create", data={"title": "streamed", "body": ""})
+
+        moved = next(stream).decode()
+        self.assertTrue(moved.startswith("event: moved\n"))
+        moved = json.loads(moved.split("data: ", 1)[1])
+        self.assertEqual(moved["ids"], [1])
+        self.assertEqual(moved["status"], "doing")
+        self.assertEqual(moved["cards"][0]["status"], "doing")
+        created = json.loads(next(stream).decode().split("data: ", 1)[1])
+        self.assertEqual(created["event"], "created")
+        self.assertEqual(created["cards"][0]["title"], "streamed")
+
+        #a listener that falls behind is told to reload the board
+        with self.app.app_context():
+            broker = get_broker()
+            slow = broker.subscribe(board_channel(1))
+            for _ in range(broker.size + 1):
+                broker.publish(board_channel(1), {"event": "deleted", "ids": []})
+            self.assertTrue(slow.overflowed)
+            broker.unsubscribe(slow)
+
+        response.close()
+        with self.app.app_context():
+            self.assertEqual(get_broker().listeners(), 0)
+
+    def test_search(self):
+        """
+        Checks if tasks are found by words of their title and description
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.post("/api/v1/cards", json=[
+            {"title": "groceries", "body": "buy milk and bread"},
+            {"title": "milk the cow", "body": "every morning"},
+            {"title": "call mom", "body": "about dinner"},
+        ])
+
+        #title matches rank first, the last word matches as a prefix
+        response = self.client.get("/api/v1/search?q=milk")
+        self.assertEqual([c["title"] for c in response.json["cards"]], ["milk the cow", "groceries"])
+        response = self.client.get("/api/v1/search?q=din")
+        self.assertEqual([c["title"] for c in response.json["cards"]], ["call mom"])
+
+        #operators and quotes in the input are searched for, not parsed
+        self.assertEqual(self.client.get('/api/v1/search?q="OR milk (').status_code, 200)
+        self.assertEqual(self.client.get("/api/v1/search?q=--").json, {"cards": [], "next": None})
+
+        #pages
+        response = self.client.get("/api/v1/search?q=milk&limit=1")
+        self.assertEqual(response.json["next"], 2)
+        response = self.client.get("/api/v1/search?q=milk&limit=1&page=2")
+        self.assertEqual([c["title"] for c in response.json["cards"]], ["groceries"])
+        self.assertIsNone(response.json["next"])
+
+        #the index follows updates and deletes
+        self.client.post("/1/update", data={"title": "pick up milk", "body": ""})
+        self.client.post("/api/v1/cards/delete", json={"ids": [2]})
+        response = self.client.get("/search?q=milk")
+        self.assertIn(b"pick up milk", response.data)
+        self.assertNotIn(b"groceries", response.data)
+        self.assertIn(b"milk the cow", response.data)
+
+        #other users never see the tasks
+        other = self.app.test_client()
+        other.post("/auth/login", data={"username": "other", "password": "other"})
+        self.assertEqual(other.get("/api/v1/search?q=milk").json["cards"], [])
+
+        #existing databases can be indexed again
+        with self.app.app_context():
+            get_db().execute("INSERT INTO post_fts (post_fts) VALUES ('delete-all')")
+            get_db().commit()
+        self.assertEqual(self.client.get("/api/v1/search?q=milk").json["cards"], [])
+        with self.app.app_context():
+            result = self.app.test_cli_runner().invoke(args=["rebuild-search"])
+        self.assertIn("Rebuilt", result.output)
+        self.assertEqual(len(self.client.get("/api/v1/search?q=milk").json["cards"]), 2)
+
+        #outside the app writes need the triggers' functions and fail cleanly without
+        insert = (
+            "INSERT INTO post (title, body, author_id, status, rank)"
+            " VALUES ('milk shake', '', 1, 0, 'i')"
+        )
+        db = sqlite3.connect(self.db_path)
+        with self.assertRaisesRegex(sqlite3.OperationalError, "search_terms"):
+            db.execute(insert)
+        db.rollback()
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM post WHERE title = 'milk shake'").fetchone()[0], 0)
+
+        register_functions(db)
+        db.execute(insert)
+        db.commit()
+        db.close()
+        self.assertEqual(len(self.client.get("/api/v1/search?q=milk").json["cards"]), 3)
+
+    def test_import_export(self):
+        """
+        Checks if boards are imported and exported in bulk
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.app.config["IMPORT_BATCH_SIZE"] = 2
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+
+        csv_file = (
+            "title,body,status,created\n"
+            "first,\"multi\nline\",doing,2020-01-01T10:00:00\n"
+            "second,,done,\n"
+            "third,body,,\n"
+        )
+        response = self.client.post("/api/v1/board/import", data=csv_file, content_type="text/csv")
+        self.assertEqual(response.json, {"imported": 3})
+
+        board = self.client.get("/api/v1/board").json
+        self.assertEqual([c["title"] for c in board["doing"]], ["first"])
+        self.assertEqual(board["doing"][0]["body"], "multi\nline")
+        self.assertEqual(board["doing"][0]["created"], "2020-01-01T10:00:00")
+        self.assertEqual([c["title"] for c in board["done"]], ["second"])
+
+        #imported cards are indexed and later cards still are
+        self.client.post("/api/v1/cards", json={"title": "fourth"})
+        response = self.client.get("/api/v1/search?q=multi")
+        self.assertEqual([c["title"] for c in response.json["cards"]], ["first"])
+        response = self.client.get("/api/v1/search?q=fourth")
+        self.assertEqual([c["title"] for c in response.json["cards"]], ["fourth"])
+
+        #batches before an invalid card stay imported
+        json_file = '{"title": "a"}\n{"title": "b"}\n{"title": "c", "status": "later"}\n'
+        response = self.client.post("/api/v1/board/import?format=json", data=json_file)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["imported"], 2)
+        self.assertIn("Line 3", response.json["error"])
+
+        #undecodable text and values of the wrong type are client errors too
+        for format, data, line in (
+            ("csv", b"title,body\nok,\n\xff\xfe,\n", "Line 3"),
+            ("json", b'{"title": "x", "body": {"a": 1}}\n', "Line 1"),
+            ("csv", b"title\n" + b"x" * 200000 + b"\n", "Line 2"),
+        ):
+            response = self.client.post(f"/api/v1/board/import?format={format}", data=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(line, response.json["error"])
+
+        #dates with an offset are stored in UTC
+        other = self.app.test_client()
+        other.post("/auth/login", data={"username": "other", "password": "other"})
+        other.post(
+            "/api/v1/board/import?format=json",
+            data='{"title": "offset", "created": "2020-01-01T10:00:00+02:00"}\n',
+        )
+        card = other.get("/api/v1/board").get_json()["todo"][0]
+        self.assertEqual(card["created"], "2020-01-01T08:00:00")
+        other.delete(f"/api/v1/cards/{card['id']}")
+
+        response = self.client.get("/api/v1/board/export?format=json")
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        cards = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(len(cards), 7)
+        self.assertEqual(cards[0]["status"], "todo")
+        self.assertEqual(cards[-1]["title"], "second")
+
+        #the CLI exports the same rows and imports them into another board
+        path = self.db_path + ".csv"
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            runner.invoke(args=["export-board", "test", path])
+            result = runner.invoke(args=["import-board", "other", path])
+        self.assertIn("Imported 7 cards.", result.output)
+        with open(path) as f:
+            self.assertEqual(f.readline().strip(), "title,body,status,created")
+        os.unlink(path)
+
+        with self.app.app_context():
+            count = get_db().execute("SELECT COUNT(*) FROM post WHERE author_id = 2").fetchone()[0]
+        self.assertEqual(count, 7)
+
+    def test_sql_profiling(self):
+        """
+        Checks if the queries of a request are timed, counted and reported
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.assertNotIn("Server-Timing", self.client.get("/").headers)
+
+        self.app.config["SQL_PROFILING"] = True
+        self.app.config["SQL_SLOW_QUERY"] = 0
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            response = self.client.get("/1/update")
+
+        #only the post, the logged in user comes from the user cache
+        self.assertRegex(response.headers["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries", app;dur=')
+        self.assertIn(queries.POST_GET, "\n".join(logs.output))
+
+        self.assertEqual(self.client.get("/api/v1/admin/sql").status_code, 403)
+        self.app.config["ADMIN_USERNAMES"] = ("test",)
+        cards = self.client.post("/api/v1/cards", json=[{"title": "a"}, {"title": "b"}]).json
+        #rows read by iterating the cursor are counted too
+        self.client.get(f"/api/v1/cards/{cards[0]['id']}/history")
+
+        stats = self.client.get("/api/v1/admin/sql").json
+        self.assertEqual(stats["endpoints"]["blog.update"]["queries_per_request"], 1)
+        statements = {s["sql"]: s for s in stats["statements"]}
+        #the update page and the history each read the post
+        self.assertEqual(statements[queries.POST_GET]["rows"], 2)
+        self.assertEqual(statements[queries.POST_CREATE]["calls"], 2)
+        self.assertEqual(statements[queries.TRANSITIONS_GET]["rows"], 1)
+        self.assertIn("statement_hit_rate", stats["pool"])
+
+        #only the reset request itself is left
+        self.client.post("/api/v1/admin/sql/reset")
+        self.assertEqual(self.client.get("/api/v1/admin/sql").json["requests"], 1)
+
+    def test_metrics(self):
+        """
+        Checks if request, database, cache and hashing metrics are exported
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        self.client.get("/")
+        self.client.get("/")
+
+        #requests on other threads are added up, also once they finished
+        thread = threading.Thread(target=self.app.test_client().get, args=("/auth/login",))
+        thread.start()
+        thread.join()
+
+        text = self.client.get("/metrics").data.decode()
+        self.assertIn('kanban_requests_total{endpoint="blog.index",method="GET",status="200"} 2', text)
+        self.assertIn('kanban_requests_total{endpoint="auth.login",method="GET",status="200"} 1', text)
+        self.assertIn('kanban_request_duration_seconds_count{endpoint="blog.index"} 2', text)
+        self.assertIn('kanban_request_duration_seconds_bucket{endpoint="blog.index",le="+Inf"} 2', text)
+        self.assertIn('kanban_requests_in_flight{endpoint="metrics"} 1', text)
+        self.assertIn('kanban_requests_in_flight{endpoint="blog.index"} 0', text)
+        self.assertIn('kanban_cache_requests_total{cache="board",result="hit"} 1', text)
+        self.assertIn('kanban_password_hash_seconds_count{operation="check_password_hash"} 1', text)
+        self.assertIn('kanban_db_connections{database="directory",state="open"}', text)
+        self.assertIn("# TYPE kanban_request_duration_seconds histogram", text)
+
+    def test_metrics_processes(self):
+        """
+        Checks if the metrics of several worker processes are added up
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        directory = tempfile.mkdtemp()
+        registry = Registry(directory)
+        requests = Counter(registry, "requests_total", "Requests", ("endpoint",))
+        busy = Gauge(registry, "busy", "Busy workers")
+        requests.inc(endpoint="index")
+        busy.inc()
+
+        #a worker that exited keeps its counters but not its gauges
+        with open(os.path.join(directory, "999999999.json"), "w") as f:
+            json.dump([["requests_total", "counter", ["index"], 2], ["busy", "gauge", [], 1]], f)
+
+        text = registry.render()
+        self.assertIn('requests_total{endpoint="index"} 3', text)
+        self.assertIn("busy 1", text)
+
+        registry.flush()
+        self.assertTrue(os.path.exists(os.path.join(directory, f"{os.getpid()}.json")))
+        shutil.rmtree(directory)
+
+    def test_write_pipeline(self):
+        """
+        Checks if writes of concurrent requests are committed together
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.app.config.update(WRITE_PIPELINE=True, WRITE_BATCH_DELAY=0.05)
+
+        def create(n):
+            client = self.app.test_client()
+            with client.session_transaction() as session:
+                session["user_id"] = 1
+            response = client.post("/api/v1/cards", json={"title": f"card {n}"})
+            self.assertEqual(response.status_code, 201)
+
+        threads = [threading.Thread(target=create, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        writer = self.app.extensions["db_writers"][None]
+        self.assertEqual(writer.writes, 8)
+        self.assertLess(writer.batches, 8)
+
+        #a failing write is rolled back alone and raised in its request
+        response = self.client.post("/auth/register", data={"username": "test", "password": "x"})
+        self.assertIn(b"already registered", response.data)
+        self.client.post("/auth/register", data={"username": "new", "password": "x"})
+
+        with self.app.app_context():
+            db = get_db()
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM post").fetchone()[0], 9)
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM user").fetchone()[0], 3)
+            self.assertEqual(board_version(1).version, 8)
+
+        #imports commit every batch through the writer and stay searchable
+        self.app.config["IMPORT_BATCH_SIZE"] = 2
+        writes = writer.writes
+        with self.client.session_transaction() as session:
+            session["user_id"] = 1
+        response = self.client.post(
+            "/api/v1/board/import?format=csv", data="title\nimported a\nimported b\nimported c\n"
+        )
+        self.assertEqual(response.json, {"imported": 3})
+        self.assertEqual(writer.writes, writes + 2)
+        response = self.client.get("/api/v1/search?q=imported")
+        self.assertEqual(len(response.json["cards"]), 3)
+
+    def test_shards(self):
+        """
+        Checks if boards are moved to their shards and served from them
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        self.assertEqual(shard_index(1, 4), 0)
+        self.assertEqual(shard_index(2, 4), 3)
+        #growing by one shard only moves the boards hashed to it
+        moved = sum(shard_index(i, 4) != shard_index(i, 5) for i in range(1, 10001))
+        self.assertLess(moved, 2500)
+
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            result = runner.invoke(args=["reshard", "4"])
+        self.assertIn("Moved 1 boards (1 cards).", result.output)
+        self.app.config["DATABASE_SHARDS"] = 4
+
+        with self.client.session_transaction() as session:
+            session["user_id"] = 1
+        self.assertIn(b"test title", self.client.get("/").data)
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = 2
+        id = client.post("/api/v1/cards", json={"title": "sharded"}).get_json()["id"]
+        #new ids are taken from the range of the shard
+        self.assertGreaterEqual(id, 4 << SHARD_ID_BITS)
+
+        with self.app.app_context():
+            self.assertEqual(get_db().execute("SELECT COUNT(*) FROM post").fetchone()[0], 0)
+            self.assertEqual(get_db(0).execute("SELECT id FROM post").fetchall()[0][0], 1)
+            self.assertEqual(get_db(3).execute("SELECT id FROM post").fetchone()[0], id)
+
+        #the board of user 2 moves to a lower shard and gets a new id
+        with self.app.app_context():
+            result = runner.invoke(args=["reshard", "2"])
+        self.assertIn("Moved 1 boards (1 cards).", result.output)
+        self.app.config["DATABASE_SHARDS"] = 2
+
+        cards = client.get("/api/v1/board").get_json()["todo"]
+        self.assertEqual([card["title"] for card in cards], ["sharded"])
+        self.assertGreaterEqual(cards[0]["id"], 1 << SHARD_ID_BITS)
+        self.assertLess(cards[0]["id"], 2 << SHARD_ID_BITS)
+        self.assertEqual(len(client.get("/api/v1/search?q=shard").get_json()["cards"]), 1)
+        #its status history follows the new id
+        history = client.get(f"/api/v1/cards/{cards[0]['id']}/history").get_json()
+        self.assertEqual(
+            [(t["from"], t["to"]) for t in history["transitions"]], [(None, "todo")]
+        )
+
+    def test_reshard_back(self):
+        """
+        Checks if boards with interleaved ids survive moving to shards and back
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        clients = {}
+        for user_id in (1, 2):
+            clients[user_id] = self.app.test_client()
+            with clients[user_id].session_transaction() as session:
+                session["user_id"] = user_id
+        for n in range(3):
+            for user_id, client in clients.items():
+                client.post("/api/v1/cards", json={"title": f"directory {user_id} {n}"})
+
+        def titles(user_id):
+            board = clients[user_id].get("/api/v1/board").get_json()
+            return sorted(card["title"] for status in ("todo", "doing", "done") for card in board[status])
+
+        expected = {user_id: titles(user_id) for user_id in clients}
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            runner.invoke(args=["reshard", "4"])
+        self.app.config["DATABASE_SHARDS"] = 4
+
+        for n in range(2):
+            for user_id, client in clients.items():
+                client.post("/api/v1/cards", json={"title": f"shard {user_id} {n}"})
+                expected[user_id].append(f"shard {user_id} {n}")
+        #shards seeded at the directory's range by older versions
+        with self.app.app_context():
+            db = get_db(0)
+            db.execute(
+                "INSERT INTO post (id, title, body, author_id, rank, status)"
+                " VALUES (3, 'legacy', '', 1, 'i', 0)"
+            )
+            db.commit()
+        expected[1].append("legacy")
+        for user_id in clients:
+            self.assertEqual(titles(user_id), sorted(expected[user_id]))
+
+        with self.app.app_context():
+            result = runner.invoke(args=["reshard", "0"])
+        self.assertIn("Moved 2 boards (", result.output)
+        self.app.config["DATABASE_SHARDS"] = 0
+
+        for user_id in clients:
+            self.assertEqual(titles(user_id), sorted(expected[user_id]))
+        with self.app.app_context():
+            for shard in (0, 3):
+                self.assertEqual(get_db(shard).execute("SELECT COUNT(*) FROM post").fetchone()[0], 0)
+            total = get_db().execute("SELECT COUNT(*) FROM post").fetchone()[0]
+        self.assertEqual(total, sum(len(cards) for cards in expected.values()))
+
+    def test_archive(self):
+        """
+        Checks if old Done cards are archived, browsed and restored
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            db = get_db()
+            db.execute("UPDATE post SET status = 2, moved = '2000-01-01 00:00:00' WHERE id = 1")
+            db.commit()
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        #a card moved to Done now stays on the board
+        id = self.client.post("/api/v1/cards", json={"title": "recent"}).get_json()["id"]
+        self.client.post("/api/v1/cards/move", json={"ids": [id], "status": "done"})
+
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            result = runner.invoke(args=["archive-cards", "--batch-size", "1"])
+        self.assertIn("Archived 1 cards.", result.output)
+
+        board = self.client.get("/api/v1/board").get_json()
+        self.assertEqual([card["id"] for card in board["done"]], [id])
+        self.assertIn(b"test title", self.client.get("/archive").data)
+
+        cards = self.client.get("/api/v1/archive").get_json()["cards"]
+        self.assertEqual([card["id"] for card in cards], [1])
+        self.assertIn("archived", cards[0])
+
+        #other users cannot restore the card
+        other = self.app.test_client()
+        other.post("/auth/login", data={"username": "other", "password": "other"})
+        self.assertEqual(other.post("/archive/1/restore").status_code, 404)
+        response = other.post("/api/v1/archive/restore", json={"ids": [1]})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post("/api/v1/archive/restore", json={"ids": [1]})
+        self.assertEqual(response.get_json(), {"restored": [1]})
+        board = self.client.get("/api/v1/board").get_json()
+        self.assertEqual(sorted(card["id"] for card in board["done"]), [1, id])
+        self.assertEqual(self.client.get("/api/v1/archive").get_json()["cards"], [])
+
+        #background passes archive it again once it is old
+        with self.app.app_context():
+            db = get_db()
+            db.execute("UPDATE post SET moved = '2000-01-01 00:00:00' WHERE id = 1")
+            db.commit()
+        self.app.config["ARCHIVE_INTERVAL"] = 0.01
+        self.client.get("/")
+
+        archiver = self.app.extensions["archiver"]
+        for _ in range(100):
+            if archiver.archived:
+                break
+            time.sleep(0.01)
+        archiver.close()
+        self.assertEqual(archiver.archived, 1)
+        self.assertEqual(len(self.client.get("/api/v1/archive").get_json()["cards"]), 1)
+
+        #one worker holds the lease, errors of a pass don't stop its thread
+        failures = []
+
+        def failing_pass():
+            failures.append(1)
+            if len(failures) == 1:
+                raise RuntimeError("pass failed")
+            return 0
+
+        original = archive.archive_cards
+        archive.archive_cards = failing_pass
+        workers = []
+        try:
+            with self.assertLogs(self.app.logger, "ERROR"):
+                workers += [archive.Archiver(self.app, 0.01) for _ in range(2)]
+                for _ in range(100):
+                    if len(failures) > 2:
+                        break
+                    time.sleep(0.01)
+        finally:
+            for worker in workers:
+                worker.close()
+            archive.archive_cards = original
+        self.assertGreater(len(failures), 2)
+        self.assertEqual(sorted(worker.passes > 0 for worker in workers), [False, True])
+
+
+    def test_ranks(self):
+        """
+        Checks if cards are placed between their neighbours and columns get spread
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        low, high = "", None
+        for _ in range(200):
+            rank = rank_between(low, high)
+            self.assertTrue(low < rank and (high is None or rank < high))
+            low, high = (rank, high) if len(rank) % 2 else (low, rank)
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        a, b, c = (
+            self.client.post("/api/v1/cards", json={"title": title}).get_json()["id"]
+            for title in "abc"
+        )
+
+        def column(status):
+            cards = self.client.get("/api/v1/board").get_json()[status]
+            return [card["id"] for card in cards], {card["id"]: card["rank"] for card in cards}
+
+        self.assertEqual(column("todo")[0], [c, b, a, 1])
+
+        #moving a card only changes its own rank
+        _, ranks = column("todo")
+        response = self.client.post(f"/api/v1/cards/{a}/position", json={})
+        self.assertEqual(response.get_json()["id"], a)
+        self.client.post(f"/api/v1/cards/{c}/position", json={"below": 1})
+        ids, moved = column("todo")
+        self.assertEqual(ids, [a, b, c, 1])
+        self.assertEqual({id: moved[id] for id in (b, 1)}, {id: ranks[id] for id in (b, 1)})
+
+        #across categories, with the form or the API
+        self.client.post(f"/api/v1/cards/{b}/position", json={"status": "doing"})
+        self.client.post(f"/{a}/position", data={"status": "doing", "above": b})
+        self.assertEqual(column("doing")[0], [b, a])
+        self.assertEqual(column("todo")[0], [c, 1])
+
+        response = self.client.post(f"/api/v1/cards/{c}/position", json={"above": b})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f"/api/v1/cards/{c}/position", json={"above": "b"})
+        self.assertEqual(response.status_code, 400)
+        for above in ("b", "", "-1"):
+            response = self.client.post(f"/{c}/position", data={"status": "todo", "above": above})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(column("todo")[0], [c, 1])
+        other = self.app.test_client()
+        other.post("/auth/login", data={"username": "other", "password": "other"})
+        response = other.post(f"/api/v1/cards/{c}/position", json={"status": "doing"})
+        self.assertEqual(response.status_code, 403)
+
+        #splitting one gap over and over spreads the column
+        self.client.post(f"/api/v1/cards/{c}/position", json={"status": "doing", "above": b})
+        lengths = []
+        for n in range(120):
+            card = (a, c)[n % 2]
+            response = self.client.post(f"/api/v1/cards/{card}/position", json={"above": b})
+            lengths.append(len(response.get_json()["rank"]))
+            self.assertEqual(column("doing")[0], [b, card, (c, a)[n % 2]])
+        self.assertLess(lengths[-1], max(lengths))
+        self.assertTrue(all(len(rank) <= MAX_LENGTH for rank in column("doing")[1].values()))
+
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            db = get_db()
+            db.execute("UPDATE post SET rank = rank || 'i' WHERE id = ?", (a,))
+            db.commit()
+            result = runner.invoke(args=["rebalance-ranks", "--length", "8"])
+        self.assertIn("Rebalanced 1 columns.", result.output)
+        ids, ranks = column("doing")
+        self.assertEqual(ids, [b, c, a])
+        self.assertTrue(all(len(rank) == 8 for rank in ranks.values()))
+
+
+    def test_flow(self):
+        """
+        Checks if moves are logged and the daily flow is kept up to date
+
+        Parameters
+        -----------
+        None
+
+        Returns
+        -----------
+        None               
+        
+        """
+        with self.app.app_context():
+            db = get_db()
+            #the card of data.sql, counted three days ago
+            db.execute(
+                "INSERT INTO flow_day (author_id, day, todo) VALUES (1, date('now', '-3 days'), 1)"
+            )
+            db.commit()
+
+        self.client.post("/auth/login", data={"username": "test", "password": "test"})
+        a, b = (
+            card["id"] for card in self.client.post(
+                "/api/v1/cards", json=[{"title": "a"}, {"title": "b"}]
+            ).get_json()
+        )
+
+        #a is started two days ago, b goes to Done without being started
+        self.client.post("/move", json={"ids": [a], "status": "doing"})
+        with self.app.app_context():
+            db = get_db()
+            db.execute(
+                "UPDATE post_transition SET moved = datetime('now', '-2 days')"
+                " WHERE post_id = ? AND to_status = 1",
+                (a,),
+            )
+            db.commit()
+        self.client.post(f"/api/v1/cards/{a}/position", json={"status": "done"})
+        self.client.patch(f"/api/v1/cards/{b}", json={"status": "done"})
+        self.client.delete("/api/v1/cards/1")
+
+        history = self.client.get(f"/api/v1/cards/{a}/history").get_json()["transitions"]
+        self.assertEqual(
+            [(t["from"], t["to"]) for t in history],
+            [(None, "todo"), ("todo", "doing"), ("doing", "done")],
+        )
+        self.assertAlmostEqual(history[2]["cycle_time"], 2 * 86400, delta=60)
+
+        flow = self.client.get("/api/v1/flow", query_string={"days": 5}).get_json()
+        self.assertEqual(len(flow["days"]), 5)
+        #days without changes carry the columns of the day before
+        self.assertEqual(
+            [(day["todo"], day["doing"], day["done"]) for day in flow["days"]],
+            [(0, 0, 0), (1, 0, 0), (1, 0, 0), (1, 0, 0), (0, 0, 2)],
+        )
+        today = flow["days"][-1]
+        self.assertEqual((today["created"], today["completed"]), (2, 2))
+        self.assertEqual(flow["throughput"], 2)
+        self.assertAlmostEqual(flow["cycle_time"], 86400, delta=60)
+
+        #archived cards stay counted as done
+        with self.app.app_context():
+            db = get_db()
+            db.execute("UPDATE post SET moved = '2000-01-01 00:00:00' WHERE id = ?", (a,))
+            db.commit()
+        runner = self.app.test_cli_runner()
+        with self.app.app_context():
+            runner.invoke(args=["archive-cards"])
+        flow = self.client.get("/api/v1/flow", query_string={"days": 1}).get_json()
+        self.assertEqual(flow["days"][0]["done"], 2)
+
+        self.assertIn(b"2 tasks completed", self.client.get("/flow").data)
+        flow = self.client.get("/api/v1/flow", query_string={"days": 1000}).get_json()
+        self.assertEqual(len(flow["days"]), self.app.config["FLOW_MAX_DAYS"])
+
+
 if __name__ == '__main__':
     unittest.main()
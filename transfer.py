@@ -0,0 +1,388 @@
+"""
+Bulk import and export of boards
+
+Boards are exchanged as CSV with a header row, or as JSON Lines with one
+card object per line. Both have the fields title, body, status ("todo",
+"doing" or "done") and created (ISO 8601, optional on import).
+
+"""
+import csv
+import io
+import itertools
+import json
+import os
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+
+import queries
+from board import STATUS_LABELS, STATUS_NAMES, TODO, bottom_rank, count_flow, touch_board
+from db import get_board_db, get_db, write_board
+from events import publish
+from ranks import rank_between
+from search import bulk_insert
+
+FIELDS = ("title", "body", "status", "created")
+
+#export format by name, with its mimetype
+FORMATS = {"csv": "text/csv", "json": "application/x-ndjson"}
+
+
+class BoardImportError(ValueError):
+    """
+    Raised for a card that cannot be imported
+
+    Parameters
+    -----------
+    - line: line of the file holding the card
+    - message: what is wrong with it
+    - imported: cards already committed before it
+
+    """
+
+    def __init__(self, line, message, imported=0):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+        self.imported = imported
+
+
+def guess_format(filename):
+    """
+    Board format matching a file name
+
+    Parameters
+    -----------
+    filename: name of the file
+
+    Returns
+    -----------
+    "csv" or "json"
+
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return "json" if extension in (".json", ".jsonl", ".ndjson") else "csv"
+
+
+def check_text(line, text):
+    """
+    Make sure a line was valid UTF-8
+
+    Streams opened with errors="surrogateescape" keep undecodable bytes as
+    lone surrogates, so they are reported with the line holding them.
+
+    Parameters
+    -----------
+    - line: line of the file
+    - text: decoded text of the line
+
+    Returns
+    -----------
+    None
+
+    """
+    try:
+        text.encode("utf8")
+    except UnicodeEncodeError:
+        raise BoardImportError(line, "Invalid UTF-8.") from None
+
+
+def read_cards(stream, format):
+    """
+    Read cards from a text stream one at a time
+
+    Parameters
+    -----------
+    - stream: file-like object yielding lines
+    - format: "csv" or "json"
+
+    Returns
+    -----------
+    Iterator of (line, dictionary) tuples, raises BoardImportError for
+    text that is not UTF-8 or not valid in the format
+
+    """
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                card = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                raise BoardImportError(reader.line_num + 1, "Invalid UTF-8.") from None
+            except csv.Error as e:
+                #DictReader.line_num is only updated after a row was read
+                raise BoardImportError(reader.reader.line_num, f"Invalid CSV, {e}.") from None
+            check_text(reader.line_num, "".join(
+                value for value in card.values() if isinstance(value, str)
+            ))
+            yield reader.line_num, card
+    elif format == "json":
+        lines = enumerate(stream, 1)
+        line = 0
+        while True:
+            try:
+                line, text = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                #the stream decodes ahead, the error is on this line or after it
+                raise BoardImportError(line + 1, "Invalid UTF-8.") from None
+            check_text(line, text)
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    raise BoardImportError(line, "Invalid JSON.") from None
+    else:
+        raise ValueError(f"Unknown board format {format!r}.")
+
+
+def card_row(line, card, author_id):
+    """
+    Validate a card and turn it into POSTS_IMPORT parameters but the rank
+
+    Parameters
+    -----------
+    - line: line of the file holding the card
+    - card: dictionary read from the file
+    - author_id: id of the board's owner
+
+    Returns
+    -----------
+    (title, body, status, author_id, created) tuple
+
+    """
+    if not isinstance(card, dict) or not card.get("title"):
+        raise BoardImportError(line, "Title is required.")
+
+    body = card.get("body") or ""
+    if not isinstance(card["title"], str) or not isinstance(body, str):
+        raise BoardImportError(line, "Title and body must be strings.")
+
+    status = card.get("status") or STATUS_LABELS[TODO]
+    if not isinstance(status, str) or status not in STATUS_NAMES:
+        raise BoardImportError(line, f"Unknown status {status!r}.")
+
+    created = card.get("created") or None
+    if created is not None:
+        try:
+            created = datetime.fromisoformat(created)
+        except (TypeError, ValueError):
+            raise BoardImportError(line, f"Invalid created date {created!r}.") from None
+
+        #stored like CURRENT_TIMESTAMP, in UTC without an offset
+        if created.tzinfo is not None:
+            created = created.astimezone(timezone.utc)
+        created = created.strftime("%Y-%m-%d %H:%M:%S")
+
+    return card["title"], body, STATUS_NAMES[status], author_id, created
+
+
+def insert_cards(author_id, batch, ranks):
+    """
+    Insert a batch of read cards below the cards of their columns
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - batch: card rows of card_row
+    - ranks: dictionary of the last rank given in each column, updated
+
+    Returns
+    -----------
+    Number of inserted cards
+
+    """
+    db = get_board_db(author_id)
+    rows = []
+
+    with bulk_insert(db):
+        for row in batch:
+            status = row[2]
+            if status not in ranks:
+                ranks[status] = bottom_rank(author_id, status)
+            ranks[status] = rank_between(None, ranks[status] or None)
+            rows.append(row + (ranks[status],))
+
+        last_id = db.execute(queries.POST_LAST_ID).fetchone()[0]
+        db.executemany(queries.POSTS_IMPORT, rows)
+        count_flow(
+            author_id,
+            db.execute(queries.TRANSITIONS_IMPORTED, (author_id, last_id)).fetchall(),
+        )
+    touch_board(author_id)
+
+    return len(rows)
+
+
+def import_board(author_id, stream, format, batch_size=None):
+    """
+    Add the cards of a file to a user's board
+
+    The file is read as it is inserted, batch_size cards per transaction,
+    so memory does not grow with its size. Every batch is one write_board
+    write, so with WRITE_PIPELINE on it is committed by the board's writer.
+    Cards are added below the cards of their column in the order of the
+    file. An invalid card stops the import, the batches before it stay
+    imported.
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - stream: text stream of the file
+    - format: "csv" or "json"
+    - batch_size: cards per transaction, IMPORT_BATCH_SIZE when None
+
+    Returns
+    -----------
+    Number of imported cards
+
+    """
+    if batch_size is None:
+        batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+
+    cards = read_cards(stream, format)
+    ranks = {}
+    imported = 0
+
+    try:
+        while True:
+            batch = [
+                card_row(line, card, author_id)
+                for line, card in itertools.islice(cards, batch_size)
+            ]
+            if not batch:
+                break
+
+            imported += write_board(insert_cards, author_id, batch, ranks)
+    except BoardImportError as e:
+        e.imported = imported
+        raise
+    finally:
+        #open boards reload once instead of receiving every card
+        if imported:
+            publish(author_id, "resync", [])
+
+    return imported
+
+
+def export_board(author_id, format, batch_size=None):
+    """
+    Write all cards of a user's board, a batch of rows at a time
+
+    Parameters
+    -----------
+    - author_id: id of the board's owner
+    - format: "csv" or "json"
+    - batch_size: rows fetched per chunk, IMPORT_BATCH_SIZE when None
+
+    Returns
+    -----------
+    Iterator of text chunks
+
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown board format {format!r}.")
+
+    if batch_size is None:
+        batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+
+    cursor = get_board_db(author_id).execute(queries.POSTS_EXPORT, (author_id,))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if format == "csv":
+        writer.writerow(FIELDS)
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        for row in rows:
+            card = (
+                row["title"],
+                row["body"],
+                STATUS_LABELS[row["status"]],
+                row["created"].isoformat(),
+            )
+            if format == "csv":
+                writer.writerow(card)
+            else:
+                buffer.write(json.dumps(dict(zip(FIELDS, card))) + "\n")
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def find_user(username):
+    user = get_db().execute(queries.USER_BY_NAME, (username,)).fetchone()
+    if user is None:
+        raise click.BadParameter(f"No user named {username!r}.", param_hint="USERNAME")
+
+    return user
+
+
+@click.command("import-board")
+@click.argument("username")
+@click.argument("file", type=click.File("r", encoding="utf8", errors="surrogateescape"))
+@click.option("--format", type=click.Choice(tuple(FORMATS)), help="Guessed from the file name.")
+@click.option("--batch-size", type=int, help="Cards per transaction.")
+def import_board_command(username, file, format, batch_size):
+    """
+    Import cards from a CSV or JSON Lines file into a user's board
+
+    Parameters
+    -----------
+    - username: owner of the board
+    - file: file to read, - for standard input
+    - format: "csv" or "json"
+    - batch_size: cards per transaction
+
+    Returns
+    -----------
+    None
+
+    """
+    user = find_user(username)
+    try:
+        count = import_board(user["id"], file, format or guess_format(file.name), batch_size)
+    except BoardImportError as e:
+        raise click.ClickException(f"{e} ({e.imported} cards imported before it)")
+
+    click.echo(f"Imported {count} cards.")
+
+
+@click.command("export-board")
+@click.argument("username")
+@click.argument("file", type=click.File("w", encoding="utf8"), default="-")
+@click.option("--format", type=click.Choice(tuple(FORMATS)), help="Guessed from the file name.")
+def export_board_command(username, file, format):
+    """
+    Export the cards of a user's board as CSV or JSON Lines
+
+    Parameters
+    -----------
+    - username: owner of the board
+    - file: file to write, standard output by default
+    - format: "csv" or "json"
+
+    Returns
+    -----------
+    None
+
+    """
+    user = find_user(username)
+    for chunk in export_board(user["id"], format or guess_format(file.name)):
+        file.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(import_board_command)
+    app.cli.add_command(export_board_command)